@@ -40,11 +40,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'uploader.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'uploader.middleware.RequestContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -53,7 +55,8 @@ ROOT_URLCONF = 'FileManagment.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # همان DjangoTemplates به همراه اندازه‌گیری زمان render برای /metrics
+        'BACKEND': 'uploader.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -62,21 +65,87 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'uploader.context.request_context',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'FileManagment.wsgi.application'
+ASGI_APPLICATION = 'FileManagment.asgi.application'
+
+# فقط در استقرار ASGI (مثلاً uvicorn) فعال شود؛ زیر WSGI ویوهای async هر بار یک event loop جدا می‌سازند
+UPLOADER_ASYNC_VIEWS = os.environ.get('UPLOADER_ASYNC_VIEWS', '') == '1'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql برای استقرار اصلی؛ در غیر این صورت SQLite
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL = os.environ.get('DB_POOL', '') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'uploader'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            # اتصال پایدار بین درخواست‌ها به جای اتصال جدید برای هر درخواست؛ قبل از استفاده دوباره بررسی می‌شود.
+            # با DB_POOL=1 (نیازمند psycopg[pool]، مناسب ASGI) pool جای اتصال پایدار را می‌گیرد
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'pool': True} if DB_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # WAL: خواندن‌ها نویسنده را متوقف نمی‌کنند؛ NORMAL در حالت WAL امن و سریع‌تر است.
+                # تراکنش IMMEDIATE قفل نوشتن را از ابتدا می‌گیرد تا منتظر busy_timeout بماند
+                # و وسط تراکنش با "database is locked" شکست نخورد
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA busy_timeout=20000;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # دیتابیس تست روی فایل است تا تست‌های هم‌زمانی با همان قفل‌های محیط واقعی اجرا شوند
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+# Cache
+# برای چند پروسه/سرور باید کش مشترک باشد (مثلاً Redis)؛ در غیر این صورت کش حافظه هر پروسه استفاده می‌شود
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+# هر پروسه حداکثر هر چند ثانیه نسخه فاز را از کش مشترک بررسی می‌کند (uploader/phase.py)
+PHASE_CACHE_CHECK_INTERVAL = 5
+# حداکثر عمر بخش‌های کش‌شده داشبوردها؛ تغییرات با سیگنال‌ها زودتر باطلشان می‌کنند (uploader/fragments.py)
+FRAGMENT_CACHE_TTL = 600
+
+# کنترل پذیرش درخواست‌های صدور لینک و ثبت فایل (uploader/ratelimit.py): token bucket برای هر کاربر و
+# برای کل سرویس به صورت (درخواست در ثانیه، ظرفیت)، و سقف درخواست‌های هم‌زمان. None: غیرفعال
+UPLOAD_RATE_LIMIT = {
+    'user': (2.0, 20),
+    'global': (100.0, 300),
+    'in_flight': 32,
 }
 
 # Password validation
@@ -118,6 +187,12 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/accounts/login/'
 
 
+# متریک‌ها (uploader/metrics.py): /metrics برای سوپریوزر یا با هدر Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# درخواست‌های کندتر از این چند ثانیه همراه با کندترین کوئری‌ها در لاگ uploader.slow_requests ثبت می‌شوند (None: غیرفعال)
+SLOW_REQUEST_THRESHOLD = 1.0
+SLOW_REQUEST_TOP_QUERIES = 5
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -132,3 +207,23 @@ AWS_S3_ENDPOINT_URL = ''
 AWS_S3_REGION_NAME = ''
 AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = 'private'
+# کلاینت مشترک S3 (uploader/storage.py)
+AWS_S3_MAX_POOL_CONNECTIONS = 50
+AWS_S3_CONNECT_TIMEOUT = 5
+AWS_S3_READ_TIMEOUT = 60
+AWS_S3_MAX_ATTEMPTS = 5
+
+# اعتبار لینک دانلود امضاشده و مدت نگه‌داری آن در کش (باید کوتاه‌تر از اعتبار لینک باشد)
+DOWNLOAD_URL_EXPIRES_IN = 3600
+DOWNLOAD_URL_CACHE_TTL = 2700
+
+# صف حذف از bucket (manage.py process_deletions)
+DELETION_RETRY_BASE_DELAY = 30
+DELETION_RETRY_MAX_DELAY = 3600
+DELETION_LEASE_SECONDS = 300
+
+# وب‌هوک رویدادهای ObjectCreated باکت (uploader/ingest.py)؛ MinIO/S3 باید هدر Authorization را با این مقدار
+# بفرستد. خالی: وب‌هوک غیرفعال است و ثبت فایل فقط با save_file_metadata انجام می‌شود
+S3_WEBHOOK_TOKEN = os.environ.get('S3_WEBHOOK_TOKEN', '')
+# توکن‌های آپلودی که تا این مدت رویدادی برایشان نرسیده پاک می‌شوند
+UPLOAD_TOKEN_TTL = 7 * 24 * 3600
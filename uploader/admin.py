@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, UploadedFile
+from .models import UserProfile, UploadedFile, PendingObjectDeletion
 from django.utils.html import format_html
 
 class UploadedFileInline(admin.TabularInline):
@@ -29,5 +29,10 @@ class UserProfileInline(admin.StackedInline):
 class CustomUserAdmin(UserAdmin):
     inlines = (UserProfileInline, UploadedFileInline)
 
+class PendingObjectDeletionAdmin(admin.ModelAdmin):
+    list_display = ('file_key', 'attempts', 'next_attempt_at', 'last_error')
+    ordering = ('next_attempt_at',)
+
 admin.site.unregister(User)
-admin.site.register(User, CustomUserAdmin)
\ No newline at end of file
+admin.site.register(User, CustomUserAdmin)
+admin.site.register(PendingObjectDeletion, PendingObjectDeletionAdmin)
@@ -0,0 +1,205 @@
+import uuid
+
+from asgiref.sync import sync_to_async
+from botocore.exceptions import ClientError
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect
+from django.views.decorators.csrf import csrf_exempt
+
+from . import storage
+from .deletion import delete_files, delete_user
+from .ingest import consume_upload_tokens, issue_upload_tokens
+from .models import UploadedFile, UserProfile
+from .phase import get_current_phase
+from .ratelimit import rate_limited
+from .views import _already_recorded, _uploaded_sizes, _validate_upload
+
+# نسخه async ویوهایی که بیشتر وقتشان منتظر دیتابیس یا S3 است (UPLOADER_ASYNC_VIEWS).
+# کوئری‌های ساده با ORM async اجرا می‌شوند؛ کارهای تراکنشی و فراخوانی‌های boto3 در thread جدا،
+# تا event loop آزاد بماند و یک پروسه ASGI هزاران درخواست هم‌زمان را نگه دارد.
+
+
+def _download_url(file_id, file_key, scope):
+    # لینک کش‌شده و نرخ hit هر دو از کش خوانده می‌شوند؛ با هم و در یک thread، نه روی event loop
+    presigned_url, cached = storage.cached_download_url(file_id, file_key, scope)
+    return presigned_url, cached, storage.download_url_hit_rate()
+
+
+_current_phase = sync_to_async(get_current_phase)
+_validate = sync_to_async(_validate_upload)
+_recorded = sync_to_async(_already_recorded)
+_sizes = sync_to_async(_uploaded_sizes)
+_consume_upload_tokens = sync_to_async(consume_upload_tokens)
+_issue_upload_tokens = sync_to_async(issue_upload_tokens)
+_create_within_quota = sync_to_async(UploadedFile.objects.create_within_quota)
+_delete_files = sync_to_async(delete_files)
+_delete_user = sync_to_async(delete_user)
+
+# امضای لینک‌ها به thread اصلی sync وابسته نیست، پس موازی اجرا می‌شود
+_presigned_upload_url = sync_to_async(storage.presigned_upload_url, thread_sensitive=False)
+_cached_download_url = sync_to_async(_download_url, thread_sensitive=False)
+
+
+async def _aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+async def save_file_metadata(request):
+    if request.method == 'POST':
+        user = await request.auser()
+        file_key = request.POST.get('file_key')
+        field = request.POST.get('field')
+        # کاربر از auser آمده است؛ ctx همان را استفاده می‌کند تا در thread دوباره بارگذاری نشود
+        request.ctx.user = user
+
+        if await _recorded(request.ctx, field, file_key):
+            return JsonResponse({'success': True})
+        sizes, error = await _sizes(request.ctx, [(field, file_key)])
+        if error:
+            return error
+        size = sizes[file_key]
+        error = await _validate(request.ctx, field, size)
+        if error:
+            return error
+
+        try:
+            file = await _create_within_quota(user=user, file_key=file_key, field=field, size=size)
+            if file is None:
+                return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+            await _consume_upload_tokens(user, [file_key])
+            return JsonResponse({'success': True})
+        except IntegrityError:
+            if await UploadedFile.objects.filter(user=user, field=field, file_key=file_key).aexists():
+                return JsonResponse({'success': True})
+            return JsonResponse({'error': 'شما قبلاً فایلی در این رشته آپلود کرده‌اید'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Invalid method'}, status=405)
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+async def generate_upload_url(request):
+    if request.method == 'POST':
+        file_name = request.POST.get('file_name', f'upload_{uuid.uuid4()}')
+        file_type = request.POST.get('file_type', 'application/octet-stream')
+        file_key = file_name
+        size = None
+
+        field = request.POST.get('field')
+        if field:
+            request.ctx.user = await request.auser()
+            try:
+                size = int(request.POST.get('size'))
+            except (TypeError, ValueError):
+                return JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
+            error = await _validate(request.ctx, field, size)
+            if error:
+                return error
+            file_key, = await _issue_upload_tokens(
+                request.ctx.user, [{'field': field, 'size': size, 'file_name': file_name}]
+            )
+
+        try:
+            presigned_url = await _presigned_upload_url(file_key, content_length=size)
+            return JsonResponse({
+                'upload_url': presigned_url,
+                'file_key': file_key,
+                'content_type': file_type
+            })
+        except ClientError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Invalid method'}, status=405)
+
+
+@login_required
+async def download_file(request, file_id):
+    user = await request.auser()
+    file_obj = await _aget_or_404(UploadedFile.objects, id=file_id)
+    profile = await UserProfile.objects.aget(user=user)
+    is_phase_one = await _current_phase()
+
+    if not (user.is_superuser or file_obj.user_id == user.id or
+            (profile.user_type == 'FieldManager' and not is_phase_one and file_obj.field == profile.field)):
+        return JsonResponse({'error': 'شما اجازه دانلود این فایل را ندارید'}, status=403)
+
+    if user.is_superuser:
+        scope = 'admin'
+    elif file_obj.user_id == user.id:
+        scope = 'owner'
+    else:
+        scope = 'manager'
+
+    try:
+        presigned_url, cached, hit_rate = await _cached_download_url(file_obj.id, file_obj.file_key, scope)
+        return JsonResponse({
+            'download_url': presigned_url,
+            'cached': cached,
+            'hit_rate': hit_rate,
+        })
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+@login_required
+async def delete_file(request, file_id):
+    user = await request.auser()
+    profile = await UserProfile.objects.aget(user=user)
+    is_phase_one = await _current_phase()
+    if not (profile.user_type == 'Normal' or (profile.user_type == 'FieldManager' and is_phase_one)):
+        return redirect('home')
+    file = await _aget_or_404(UploadedFile.objects, id=file_id, user=user)
+
+    await _delete_files(UploadedFile.objects.filter(id=file.id))
+    messages.success(request, 'فایل با موفقیت حذف شد.')
+    return redirect('home')
+
+
+@login_required
+async def admin_delete_file(request, file_id):
+    user = await request.auser()
+    if not user.is_superuser:
+        return redirect('home')
+    file = await _aget_or_404(UploadedFile.objects, id=file_id)
+
+    await _delete_files(UploadedFile.objects.filter(id=file.id))
+    messages.success(request, 'فایل با موفقیت حذف شد.')
+    return redirect('admin_dashboard')
+
+
+@login_required
+async def admin_delete_user(request, user_id):
+    if not (await request.auser()).is_superuser:
+        return redirect('home')
+    user = await _aget_or_404(User.objects, id=user_id)
+    if not user.is_superuser:
+        await _delete_user(user)
+        messages.success(request, 'کاربر و فایل‌هایش با موفقیت حذف شدند.')
+    else:
+        messages.error(request, 'نمی‌توان سوپریوزر را حذف کرد.')
+    return redirect('admin_dashboard')
+
+
+@login_required
+async def field_manager_delete_file(request, file_id):
+    user = await request.auser()
+    profile = await UserProfile.objects.aget(user=user)
+    is_phase_one = await _current_phase()
+    if profile.user_type != 'FieldManager' or is_phase_one:
+        return redirect('home')
+    file = await _aget_or_404(UploadedFile.objects, id=file_id, field=profile.field)
+
+    await _delete_files(UploadedFile.objects.filter(id=file.id))
+    messages.success(request, 'فایل با موفقیت حذف شد.')
+    return redirect('field_manager_dashboard')
@@ -0,0 +1,236 @@
+import json
+import platform
+import random
+import time
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import storage
+from .ingest import issue_upload_tokens
+from .local_s3 import LocalS3Client
+from .models import Phase, UploadedFile, UserProfile
+from .phase import invalidate_phase_cache
+
+# اندازه‌گیری تأخیر endpointهای اصلی روی داده ساختگی و S3 درون‌پروسه‌ای (manage.py benchmark).
+# فقط روی دیتابیس تست اجرا شود؛ کاربران، فایل‌ها و فاز را می‌سازد و تغییر می‌دهد.
+
+BENCHMARK_PREFIX = 'bench-'
+ENDPOINTS = (
+    'home', 'generate_upload_url', 'batch_upload_urls', 'save_file_metadata', 'batch_save_file_metadata',
+    'download_file', 'admin_dashboard', 'field_manager_dashboard', 'field_manager_dashboard_data',
+)
+# داشبورد مدیر رشته فقط در فاز دوم و آپلود فقط در فاز اول در دسترس است
+PHASE_TWO_ENDPOINTS = ('field_manager_dashboard', 'field_manager_dashboard_data')
+BATCH_FILES = 2
+# کش جدا تا لینک‌های دانلود و نسخه فاز benchmark به کش مشترک نرسد
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'uploader-benchmark',
+    }
+}
+
+
+def seed(users=200, regions=10, files_per_user=3, seed=0):
+    rng = random.Random(seed)
+    fields = [code for code, _ in UserProfile.FIELD_CHOICES]
+    region_codes = [code for code, _ in UserProfile.REGION_CHOICES[:regions]]
+    # حداقل یک رشته خالی برای هر کاربر می‌ماند تا save_file_metadata ثبت موفق داشته باشد
+    files_per_user = min(files_per_user, len(fields) - 1)
+    password = make_password(None)
+
+    User.objects.bulk_create(
+        [User(username=f'{BENCHMARK_PREFIX}user-{i}', password=password) for i in range(users)]
+        + [User(username=f'{BENCHMARK_PREFIX}manager', password=password),
+           User(username=f'{BENCHMARK_PREFIX}admin', password=password, is_staff=True, is_superuser=True)],
+        batch_size=1000,
+    )
+    by_username = User.objects.filter(username__startswith=BENCHMARK_PREFIX).in_bulk(field_name='username')
+
+    files, profiles = [], []
+    for i in range(users):
+        user = by_username[f'{BENCHMARK_PREFIX}user-{i}']
+        used = 0
+        for j in range(files_per_user):
+            field = fields[(i + j) % len(fields)]
+            size = rng.randint(1024 * 1024, 50 * 1024 * 1024)
+            used += size
+            files.append(UploadedFile(user=user, file_key=f'{user.username}/{field}.pdf', field=field, size=size))
+        profiles.append(UserProfile(user=user, region=region_codes[i % len(region_codes)], user_type='Normal',
+                                    allowed_storage=10 ** 12, used_storage=used))
+    profiles.append(UserProfile(user=by_username[f'{BENCHMARK_PREFIX}manager'], user_type='FieldManager',
+                                field=fields[0], region=region_codes[0], allowed_storage=10 ** 12))
+    profiles.append(UserProfile(user=by_username[f'{BENCHMARK_PREFIX}admin'], allowed_storage=10 ** 12))
+    UserProfile.objects.bulk_create(profiles, batch_size=1000)
+    UploadedFile.objects.bulk_create(files, batch_size=1000)
+    Phase.objects.update_or_create(id=1, defaults={'is_phase_one': True})
+    return {'users': users, 'regions': len(region_codes), 'files': len(files)}
+
+
+def percentile(samples, p):
+    # درون‌یابی خطی بین دو نمونه نزدیک
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def summarize(latencies, errors):
+    total = sum(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'mean_ms': round(total / len(latencies) * 1000, 3) if latencies else None,
+        'throughput_rps': round(len(latencies) / total, 2) if total else None,
+    }
+
+
+def _logged_in(user):
+    client = Client(raise_request_exception=False)
+    client.force_login(user)
+    return client
+
+
+def _free_fields(users):
+    # رشته‌هایی که هر کاربر هنوز فایلی در آن‌ها ندارد، به ترتیب FIELD_CHOICES
+    used = set(UploadedFile.objects.filter(user__in=users).values_list('user_id', 'field'))
+    return {user: [code for code, _ in UserProfile.FIELD_CHOICES if (user.id, code) not in used] for user in users}
+
+
+def _put_uploads(user, fields, rng):
+    # لینک آپلود و خود شیء، مثل مرورگر، پیش از درخواست و خارج از زمان‌سنجی ساخته می‌شوند
+    file_keys = issue_upload_tokens(user, [
+        {'field': field, 'size': 1024, 'file_name': f'{field}.pdf'} for field in fields
+    ])
+    s3 = storage.get_s3_client()
+    for file_key in file_keys:
+        s3.put(file_key, b'x' * rng.randint(1, 1024))
+    return file_keys
+
+
+def _requests(name, count, users, manager, admin, rng):
+    # هر آیتم: (کلاینت، متد، مسیر، داده)؛ ورود کاربران خارج از زمان‌سنجی انجام می‌شود
+    if name in ('home', 'generate_upload_url', 'batch_upload_urls'):
+        free = _free_fields(users[:10])
+        clients = [(_logged_in(user), free[user]) for user in users[:10]]
+        for n in range(count):
+            client, fields = clients[n % len(clients)]
+            if name == 'home':
+                yield client, 'get', reverse('home'), None
+            elif name == 'generate_upload_url':
+                yield client, 'post', reverse('generate_upload_url'), {
+                    'file_name': f'bench/{n}.pdf', 'field': fields[0], 'size': '1024',
+                }
+            else:
+                yield client, 'post_json', reverse('batch_upload_urls'), {'files': [
+                    {'field': field, 'file_name': f'bench/{n}-{field}.pdf', 'size': 1024}
+                    for field in fields[:BATCH_FILES]
+                ]}
+    elif name == 'download_file':
+        owners = {}
+        for file in UploadedFile.objects.filter(user__in=users[:10]).only('id', 'user_id'):
+            owners.setdefault(file.user_id, []).append(file.id)
+        clients = [(_logged_in(user), owners[user.id]) for user in users[:10] if user.id in owners]
+        for n in range(count if clients else 0):
+            client, file_ids = clients[n % len(clients)]
+            yield client, 'get', reverse('download_file', args=[rng.choice(file_ids)]), None
+    elif name == 'save_file_metadata':
+        # هر درخواست یک (کاربر، رشته) خالی می‌گیرد؛ تعداد درخواست‌ها به رشته‌های خالی محدود است
+        free = [(user, field) for user, fields in _free_fields(users).items() for field in fields]
+        for user, field in free[:count]:
+            file_key, = _put_uploads(user, [field], rng)
+            yield _logged_in(user), 'post', reverse('save_file_metadata'), {'file_key': file_key, 'field': field}
+    elif name == 'batch_save_file_metadata':
+        batches = [(user, fields[start:start + BATCH_FILES])
+                   for user, fields in _free_fields(users).items()
+                   for start in range(0, len(fields), BATCH_FILES)]
+        for user, fields in batches[:count]:
+            file_keys = _put_uploads(user, fields, rng)
+            yield _logged_in(user), 'post_json', reverse('batch_save_file_metadata'), {'files': [
+                {'field': field, 'file_key': file_key} for field, file_key in zip(fields, file_keys)
+            ]}
+    elif name == 'admin_dashboard':
+        for n in range(count):
+            yield admin, 'get', reverse('admin_dashboard'), None
+    elif name == 'field_manager_dashboard':
+        for n in range(count):
+            yield manager, 'get', reverse('field_manager_dashboard'), None
+    elif name == 'field_manager_dashboard_data':
+        for n in range(count):
+            yield manager, 'get', reverse('field_manager_dashboard_data'), {'page': n % 2 + 1}
+
+
+def _send(client, method, path, data):
+    if method == 'post_json':
+        return client.post(path, json.dumps(data), content_type='application/json')
+    return getattr(client, method)(path, data)
+
+
+def _set_phase(is_phase_one):
+    Phase.objects.update_or_create(id=1, defaults={'is_phase_one': is_phase_one})
+    # کش benchmark جداست؛ پاک کردنش فاز جدید را بدون انتظار برای on_commit نمایان می‌کند
+    cache.clear()
+
+
+def run_benchmark(requests=100, warmup=5, endpoints=ENDPOINTS, seed_options=None):
+    seed_options = seed_options or {}
+    rng = random.Random(seed_options.get('seed', 0))
+    # محدودیت نرخ خاموش است تا تأخیر خود endpointها اندازه گرفته شود، نه 429
+    with override_settings(DEBUG=False, CACHES=BENCHMARK_CACHES, UPLOAD_RATE_LIMIT=None):
+        s3 = LocalS3Client()
+        storage.install_s3_client(s3)
+        try:
+            dataset = seed(**seed_options)
+            users = list(User.objects.filter(username__startswith=f'{BENCHMARK_PREFIX}user-').order_by('id'))
+            manager = _logged_in(User.objects.get(username=f'{BENCHMARK_PREFIX}manager'))
+            admin = _logged_in(User.objects.get(username=f'{BENCHMARK_PREFIX}admin'))
+
+            results = {}
+            started = time.perf_counter()
+            for name in endpoints:
+                _set_phase(name not in PHASE_TWO_ENDPOINTS)
+                calls = _requests(name, warmup + requests, users, manager, admin, rng)
+                latencies, errors = [], 0
+                for n, (client, method, path, data) in enumerate(calls):
+                    begin = time.perf_counter()
+                    response = _send(client, method, path, data)
+                    elapsed = time.perf_counter() - begin
+                    if n < warmup:
+                        continue
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        errors += 1
+                results[name] = summarize(latencies, errors)
+        finally:
+            storage.reset_s3_client()
+            # مقدار فاز کش‌شده در همین پروسه از دیتابیس benchmark آمده است
+            invalidate_phase_cache()
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'duration_s': round(time.perf_counter() - started, 3),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'dataset': dataset,
+        'requests_per_endpoint': requests,
+        'warmup': warmup,
+        's3_calls': s3.calls,
+        'endpoints': results,
+    }
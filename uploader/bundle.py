@@ -0,0 +1,117 @@
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.utils import timezone
+
+from . import storage
+
+BUNDLE_CHUNK_SIZE = 1024 * 1024
+BUNDLE_PREFETCH = 4
+
+
+class _StreamBuffer:
+    # شیء فایل‌مانند بدون seek؛ zipfile در این حالت از data descriptor استفاده می‌کند
+    # و هر چه نوشته شود بلافاصله می‌تواند برای کلاینت فرستاده شود
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    # entries: (نام، date_time، اندازه یا None، iterable از بایت‌ها)
+    # فایل zip بدون فایل موقت و با حافظه محدود به یک chunk ساخته و تکه‌تکه yield می‌شود
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=compression, allowZip64=True) as archive:
+        for name, date_time, size, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time)
+            info.compress_type = compression
+            if size is not None:
+                info.file_size = size
+            # بدون اندازه معلوم، فقط ZIP64 اجازه می‌دهد فایل از ۴ گیگابایت بزرگ‌تر شود
+            with archive.open(info, 'w', force_zip64=size is None and compression == zipfile.ZIP_STORED) as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def _get_object(file_key):
+    try:
+        return storage.get_s3_client().get_object(Bucket=storage.bucket_name(), Key=file_key), None
+    except (BotoCoreError, ClientError) as e:
+        return None, str(e)
+
+
+def _prefetched(files, prefetch):
+    # درخواست get_object چند فایل بعدی زودتر فرستاده می‌شود تا تأخیر S3 با ارسال فایل فعلی هم‌پوشانی کند؛
+    # بدنه‌ها همچنان تکه‌تکه خوانده می‌شوند، پس حافظه محدود می‌ماند
+    files = iter(files)
+    window = deque()
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        for file in files:
+            window.append((file, executor.submit(_get_object, file.file_key)))
+            if len(window) >= prefetch:
+                break
+        while window:
+            file, future = window.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                window.append((next_file, executor.submit(_get_object, next_file.file_key)))
+            yield file, future.result()
+    finally:
+        for _, future in window:
+            if future.cancel():
+                continue
+            response, _ = future.result()
+            if response is not None:
+                response['Body'].close()
+        executor.shutdown(wait=False)
+
+
+def _body_chunks(response):
+    try:
+        yield from response['Body'].iter_chunks(BUNDLE_CHUNK_SIZE)
+    finally:
+        response['Body'].close()
+
+
+def bundle_entry_name(file):
+    region = file.user.userprofile.region or 'NoRegion'
+    return f'{region}/{file.user.username}/{file.field}-{os.path.basename(file.file_key)}'
+
+
+def iter_bundle_entries(files, prefetch=BUNDLE_PREFETCH):
+    errors = []
+    for file, (response, error) in _prefetched(files, prefetch):
+        name = bundle_entry_name(file)
+        if response is None:
+            errors.append(f'{name}: {error}')
+            continue
+        date_time = timezone.localtime(file.uploaded_at).timetuple()[:6]
+        yield name, date_time, response['ContentLength'], _body_chunks(response)
+    if errors:
+        report = '\n'.join(errors).encode('utf-8')
+        yield 'errors.txt', timezone.localtime().timetuple()[:6], len(report), [report]
@@ -0,0 +1,52 @@
+from django.utils.functional import cached_property
+
+from .models import UploadedFile
+from .phase import get_current_phase
+
+
+class RequestContext:
+    # داده‌های کاربر جاری که ویوها، فرم‌ها و قالب‌ها لازم دارند؛ هر کدام حداکثر یک بار در هر درخواست
+    # و فقط در صورت استفاده بارگذاری می‌شوند (request.ctx، توسط RequestContextMiddleware)
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def user(self):
+        return self.request.user
+
+    @cached_property
+    def profile(self):
+        # از طریق رابطه معکوس تا پروفایل روی خود شیء user هم کش شود (user.userprofile در قالب‌ها)
+        # و profile.user بدون کوئری اضافه در دسترس باشد
+        return self.user.userprofile
+
+    @cached_property
+    def is_phase_one(self):
+        return get_current_phase()
+
+    @cached_property
+    def used_fields(self):
+        return set(UploadedFile.objects.filter(user=self.user).values_list('field', flat=True))
+
+    @cached_property
+    def usage(self):
+        used, allowed = self.profile.used_storage, self.profile.allowed_storage
+        return {
+            'used': used,
+            'allowed': allowed,
+            'percentage': (used / allowed * 100) if allowed > 0 else 0,
+        }
+
+    @property
+    def is_normal_user(self):
+        return self.profile.user_type == 'Normal' or (self.profile.user_type == 'FieldManager' and self.is_phase_one)
+
+    @property
+    def is_active_field_manager(self):
+        # مدیر رشته فقط در فاز دوم به فایل‌های رشته‌اش دسترسی دارد
+        return self.profile.user_type == 'FieldManager' and not self.is_phase_one
+
+
+def request_context(request):
+    # context processor برای قالب‌ها
+    return {'ctx': getattr(request, 'ctx', None)}
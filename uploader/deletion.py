@@ -0,0 +1,15 @@
+from .models import batched_file_accounting
+
+
+def delete_files(files):
+    # حذف گروهی ردیف‌ها؛ کلیدها در همان تراکنش در صف PendingObjectDeletion قرار می‌گیرند
+    # و حذف از bucket در پس‌زمینه توسط process_deletions انجام می‌شود
+    with batched_file_accounting():
+        deleted, _ = files.delete()
+    return deleted
+
+
+def delete_user(user):
+    # فایل‌ها با cascade حذف می‌شوند و سیگنال‌هایشان در همین دسته جمع می‌شود
+    with batched_file_accounting():
+        user.delete()
@@ -0,0 +1,158 @@
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .bundle import stream_zip
+from .models import UploadedFile, UserProfile
+
+# خروجی مصرف فضا: یک ردیف برای هر کاربر و بعد از آن یک ردیف برای هر فایل او.
+# پروفایل‌ها و فایل‌ها با دو کوئری مرتب بر اساس user_id و به صورت iterator خوانده و در پایتون
+# ادغام می‌شوند، پس حافظه به تعداد فایل‌ها بستگی ندارد.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FLUSH_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = [
+    'row_type', 'username', 'region', 'field', 'user_type',
+    'allowed_storage', 'used_storage', 'file_key', 'size', 'uploaded_at',
+]
+# نام کاربری و کلید فایل از ورودی کاربران می‌آیند؛ متنی که با این نویسه‌ها شروع شود در Excel فرمول می‌شود
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# نویسه‌هایی که در XML 1.0 مجاز نیستند و فایل xlsx را خراب می‌کنند
+_XML_INVALID = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+
+def _text(value):
+    value = str(value)
+    return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+
+
+def iter_usage_rows(filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    filters = filters or {}
+    profiles = UserProfile.objects.filter(**filters).order_by('user_id').values_list(
+        'user_id', 'user__username', 'region', 'field', 'user_type', 'allowed_storage', 'used_storage'
+    ).iterator(chunk_size=chunk_size)
+    files = UploadedFile.objects.filter(
+        **{f'user__userprofile__{name}': value for name, value in filters.items()}
+    ).order_by('user_id', 'id').values_list(
+        'user_id', 'field', 'file_key', 'size', 'uploaded_at'
+    ).iterator(chunk_size=chunk_size)
+
+    pending = next(files, None)
+    for user_id, username, region, field, user_type, allowed, used in profiles:
+        yield ['user', username, region or '', field or '', user_type, allowed, used, '', '', '']
+        # فایل کاربرانی که پروفایل ندارند نادیده گرفته می‌شود
+        while pending is not None and pending[0] < user_id:
+            pending = next(files, None)
+        while pending is not None and pending[0] == user_id:
+            _, file_field, file_key, size, uploaded_at = pending
+            yield ['file', username, region or '', file_field, user_type, '', '', file_key, size,
+                   timezone.localtime(uploaded_at).isoformat()]
+            pending = next(files, None)
+
+
+class _Echo:
+    # csv.writer به جای نوشتن در فایل، خود سطر را برمی‌گرداند
+    def write(self, value):
+        return value
+
+
+def _buffered(pieces):
+    # سطرهای کوچک در تکه‌های حدوداً ۶۴ کیلوبایتی فرستاده می‌شوند
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXPORT_FLUSH_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        # BOM تا Excel متن فارسی را درست باز کند
+        yield '\ufeff' + writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            yield writer.writerow([_text(value) if isinstance(value, str) else value for value in row])
+
+    return _buffered(lines())
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="usage" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _cell(value):
+    if value == '':
+        return '<c/>'
+    if isinstance(value, int):
+        return f'<c><v>{value}</v></c>'
+    # رشته‌ها inline نوشته می‌شوند تا به جدول sharedStrings (و نگه‌داشتن همه رشته‌ها در حافظه) نیازی نباشد
+    return f'<c t="inlineStr"><is><t>{escape(_XML_INVALID.sub("", _text(value)))}</t></is></c>'
+
+
+def _sheet_rows(rows):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    yield '<row>' + ''.join(_cell(name) for name in EXPORT_COLUMNS) + '</row>'
+    for row in rows:
+        yield '<row>' + ''.join(_cell(value) for value in row) + '</row>'
+    yield '</sheetData></worksheet>'
+
+
+def stream_xlsx(rows):
+    # فایل xlsx همان zip است؛ برگه با stream_zip ساخته و هم‌زمان با خواندن ردیف‌ها فشرده و فرستاده می‌شود
+    date_time = timezone.localtime().timetuple()[:6]
+    static = [
+        ('[Content_Types].xml', _CONTENT_TYPES),
+        ('_rels/.rels', _ROOT_RELS),
+        ('xl/workbook.xml', _WORKBOOK),
+        ('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS),
+    ]
+    entries = [(name, date_time, None, [content.encode('utf-8')]) for name, content in static]
+    entries.append(('xl/worksheets/sheet1.xml', date_time, None, _buffered(_sheet_rows(rows))))
+    return stream_zip(entries, compression=zipfile.ZIP_DEFLATED)
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
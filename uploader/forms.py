@@ -11,28 +11,23 @@ class FileUploadForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        # با ctx (request.ctx) رشته‌های استفاده‌شده از همان داده‌ای می‌آید که ویو هم استفاده می‌کند
+        ctx = kwargs.pop('ctx', None)
         super().__init__(*args, **kwargs)
-        if user:
-            profile = UserProfile.objects.get(user=user)
-            # اگر مدیر رشته است، باید اجازه دهد که رشته‌هایی که هنوز آپلود نشده‌اند، انتخاب شوند
-            if profile.user_type == 'FieldManager':
-                # برای مدیر رشته، تمام رشته‌هایی که هنوز فایل برای آنها آپلود نشده را نشان بده
-                used_fields = UploadedFile.objects.filter(user=user).values_list('field', flat=True)
-                available_choices = [(code, name) for code, name in UserProfile.FIELD_CHOICES if code not in used_fields]
-                if available_choices:
-                    self.fields['field'].choices = available_choices
-                else:
-                    self.fields['field'].disabled = True
-                    self.fields['field'].help_text = "شما در تمام رشته‌ها فایل آپلود کرده‌اید. برای آپلود فایل جدید، ابتدا فایل‌های قبلی را حذف کنید."
-            else:
-                # برای کاربر عادی، فقط رشته‌هایی که هنوز آپلود نشده‌اند
-                used_fields = UploadedFile.objects.filter(user=user).values_list('field', flat=True)
-                available_choices = [(code, name) for code, name in UserProfile.FIELD_CHOICES if code not in used_fields]
-                if available_choices:
-                    self.fields['field'].choices = available_choices
-                else:
-                    self.fields['field'].disabled = True
-                    self.fields['field'].help_text = "شما در تمام رشته‌ها فایل آپلود کرده‌اید. برای آپلود فایل جدید، ابتدا فایل‌های قبلی را حذف کنید."
+        if ctx is not None:
+            used_fields = ctx.used_fields
+        elif user:
+            used_fields = set(UploadedFile.objects.filter(user=user).values_list('field', flat=True))
+        else:
+            return
+        # برای کاربر عادی و مدیر رشته، فقط رشته‌هایی که هنوز فایل برای آنها آپلود نشده
+        available_choices = [(code, name) for code, name in UserProfile.FIELD_CHOICES if code not in used_fields]
+        if available_choices:
+            self.fields['field'].choices = available_choices
+        else:
+            self.fields['field'].disabled = True
+            self.fields['field'].help_text = "شما در تمام رشته‌ها فایل آپلود کرده‌اید. برای آپلود فایل جدید، ابتدا فایل‌های قبلی را حذف کنید."
+
 class CreateUserForm(UserCreationForm):
     user_type = forms.ChoiceField(choices=UserProfile.USER_TYPE_CHOICES, label='نوع کاربر')
     region = forms.ChoiceField(choices=UserProfile.REGION_CHOICES, label='پژوهشسرا')
@@ -79,4 +74,14 @@ class CreateUserForm(UserCreationForm):
             profile.allowed_storage = self.cleaned_data['allowed_storage_gb'] * 1024 * 1024 * 1024
             profile.field = self.cleaned_data['field']
             profile.save()
-        return user
\ No newline at end of file
+        return user
+
+class ImportUsersForm(forms.Form):
+    users_file = forms.FileField(label='فایل کاربران (CSV یا JSONL)')
+
+    def clean_users_file(self):
+        users_file = self.cleaned_data['users_file']
+        extension = users_file.name.rsplit('.', 1)[-1].lower()
+        if extension not in ('csv', 'jsonl'):
+            raise forms.ValidationError('فقط فایل‌های CSV و JSONL پذیرفته می‌شوند.')
+        return users_file
@@ -0,0 +1,44 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+# نسخه بخش‌های کش‌شده قالب‌ها ({% cache %}). هر بخش با نسخه‌های مربوط به خودش کلید می‌خورد؛
+# با هر تغییر فقط نسخه عوض می‌شود و مدخل‌های قدیمی با TTL از کش خارج می‌شوند.
+EPOCH_KEY = 'uploader:fragments:epoch'        # همه بخش‌ها (تغییر فاز و اصلاح‌های گروهی)
+ADMIN_KEY = 'uploader:fragments:admin'        # جدول کاربران ادمین؛ با هر تغییر فایل یا پروفایل
+USER_KEY = 'uploader:fragments:user:{}'       # فایل‌ها و مصرف یک کاربر
+
+
+def versions(*keys):
+    current = cache.get_many(keys)
+    missing = [key for key in keys if key not in current]
+    for key in missing:
+        cache.add(key, uuid.uuid4().hex, None)
+    if missing:
+        current.update(cache.get_many(missing))
+    return ':'.join(current.get(key, '') for key in keys)
+
+
+def home_version(user_id):
+    return versions(EPOCH_KEY, USER_KEY.format(user_id))
+
+
+def admin_version():
+    return versions(EPOCH_KEY, ADMIN_KEY)
+
+
+def user_keys(user_id):
+    # بخش‌هایی که با تغییر فایل‌ها یا پروفایل یک کاربر کهنه می‌شوند
+    return {USER_KEY.format(user_id), ADMIN_KEY}
+
+
+def invalidate(keys):
+    # مثل phase.py، نسخه جدید بعد از commit منتشر می‌شود تا داده قدیمی با نسخه جدید کش نشود
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, None))
+
+
+def invalidate_all():
+    invalidate([EPOCH_KEY])
@@ -0,0 +1,144 @@
+import os
+import uuid
+from datetime import timedelta
+from urllib.parse import unquote_plus
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fragments, storage
+from .models import (
+    PendingObjectDeletion, UploadedFile, UploadToken, UserProfile, apply_storage_deltas, discard_field_manifests,
+)
+
+# ثبت فایل‌ها از روی رویدادهای ObjectCreated باکت، بدون نیاز به درخواست save_file_metadata از مرورگر.
+# رویدادها ممکن است تکراری یا با تأخیر برسند، پس ثبت به صورت upsert روی (user, field) است.
+
+
+def upload_file_key(token, file_name):
+    name = os.path.basename(file_name or '') or f'upload_{uuid.uuid4()}'
+    return f'{token}/{name[:200]}'
+
+
+def issue_upload_tokens(user, items):
+    # items: دیکشنری‌هایی با field، size و file_name؛ کلید فایل‌ها به همان ترتیب برگردانده می‌شود
+    tokens = []
+    for item in items:
+        token = uuid.uuid4().hex
+        tokens.append(UploadToken(
+            token=token, user=user, field=item['field'], size=item['size'],
+            file_key=upload_file_key(token, item.get('file_name')),
+        ))
+    UploadToken.objects.bulk_create(tokens)
+    return [token.file_key for token in tokens]
+
+
+def issued_upload_keys(user, items):
+    # items: (field, file_key)؛ آن‌هایی که برای همین کاربر و همان رشته صادر شده و هنوز منقضی نشده‌اند
+    expired = timezone.now() - timedelta(seconds=settings.UPLOAD_TOKEN_TTL)
+    return set(UploadToken.objects.filter(
+        user=user, file_key__in=[file_key for _, file_key in items], created_at__gte=expired,
+    ).values_list('field', 'file_key'))
+
+
+def consume_upload_tokens(user, file_keys):
+    # فایل با اندازه خوانده‌شده از S3 ثبت شده است؛ رویداد بعدی باکت برای این کلیدها دیگر کاری ندارد
+    UploadToken.objects.filter(user=user, file_key__in=file_keys).delete()
+
+
+def parse_object_created(payload):
+    # قالب رویداد S3 و MinIO؛ چند payload هم می‌تواند به صورت فهرست یک‌جا برسد.
+    # خروجی: {file_key: اندازه} برای رویدادهای ObjectCreated همین باکت
+    objects = {}
+    for batch in payload if isinstance(payload, list) else [payload]:
+        for record in batch.get('Records') or []:
+            if 'ObjectCreated' not in record.get('eventName', ''):
+                continue
+            s3 = record['s3']
+            if s3['bucket']['name'] != storage.bucket_name():
+                continue
+            objects[unquote_plus(s3['object']['key'])] = int(s3['object']['size'])
+    return objects
+
+
+def ingest_created_objects(objects):
+    tokens = {key.split('/', 1)[0] for key in objects if '/' in key}
+    result = {'recorded': 0, 'ignored': 0, 'conflicts': 0, 'over_quota': 0}
+    with transaction.atomic():
+        issued = {token.file_key: token for token in UploadToken.objects.filter(token__in=tokens)}
+        matched = {}
+        for key, size in objects.items():
+            token = issued.get(key)
+            if token is None:
+                result['ignored'] += 1
+                continue
+            matched.setdefault((token.user_id, token.field), []).append((token, size))
+
+        if matched:
+            # قفل پروفایل‌ها، هم‌زمان با رزرو سهمیه در create_within_quota، تا محاسبه اختلاف اندازه
+            # با ثبت هم‌زمان همان فایل از save_file_metadata تداخل نکند
+            user_ids = {user_id for user_id, _ in matched}
+            list(UserProfile.objects.select_for_update().filter(user_id__in=user_ids).values_list('id', flat=True))
+            existing = {
+                (file.user_id, file.field): file
+                for file in UploadedFile.objects.filter(user_id__in=user_ids, field__in={f for _, f in matched})
+            }
+
+            entries, orphans = {}, []
+            for (user_id, field), candidates in matched.items():
+                current = existing.get((user_id, field))
+                # هر کاربر در هر رشته یک فایل دارد: فایل ثبت‌شده فعلی، وگرنه آخرین فایل همین دسته؛
+                # بقیه اشیاء هرگز ثبت نمی‌شوند و از باکت حذف می‌شوند
+                if current is None:
+                    kept = candidates[-1]
+                else:
+                    kept = next((c for c in candidates if c[0].file_key == current.file_key), None)
+                orphans.extend(token.file_key for token, _ in candidates if kept is None or token is not kept[0])
+                if kept is None:
+                    continue
+                token, size = kept
+                row = UploadedFile(user_id=user_id, field=field, file_key=token.file_key, size=size)
+                entries.setdefault(user_id, []).append((row, size - (current.size if current else 0), current))
+            result['conflicts'] = len(orphans)
+
+            # اندازه گزارش‌شده S3 همان شرط create_within_quota را می‌گذراند: افزایش هر کاربر با یک UPDATE شرطی
+            # رزرو می‌شود و اگر جا نشود فایل‌های آن کاربر در این دسته ثبت نمی‌شوند و شیء جدید به صف حذف می‌رود
+            rows, refunds = [], {}
+            for user_id, user_entries in entries.items():
+                delta = sum(delta for _, delta, _ in user_entries)
+                if delta <= 0:
+                    refunds[user_id] = delta
+                elif not UserProfile.objects.filter(
+                    user_id=user_id, used_storage__lte=F('allowed_storage') - delta,
+                ).update(used_storage=F('used_storage') + delta):
+                    orphans.extend(row.file_key for row, _, current in user_entries if current is None)
+                    result['over_quota'] += len(user_entries)
+                    continue
+                rows.extend(row for row, _, _ in user_entries)
+
+            # یک INSERT ... ON CONFLICT برای همه فایل‌ها؛ bulk_create سیگنال ندارد، پس شمارنده‌ها
+            # و نسخه بخش‌های کش‌شده اینجا به‌روز می‌شوند
+            UploadedFile.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user', 'field'], update_fields=['size'],
+            )
+            apply_storage_deltas(refunds)
+            PendingObjectDeletion.objects.bulk_create([PendingObjectDeletion(file_key=key) for key in orphans])
+            keys = set()
+            for row in rows:
+                keys |= fragments.user_keys(row.user_id)
+            fragments.invalidate(keys)
+            discard_field_manifests({row.field for row in rows})
+            UploadToken.objects.filter(
+                id__in=[token.id for candidates in matched.values() for token, _ in candidates]
+            ).delete()
+            result['recorded'] = len(rows)
+    return result
+
+
+def purge_expired_upload_tokens():
+    # توکن لینک‌هایی که رویدادشان نرسیده (وب‌هوک خاموش، آپلود نیمه‌کاره)؛ process_deletions آن را صدا می‌زند
+    expired = timezone.now() - timedelta(seconds=settings.UPLOAD_TOKEN_TTL)
+    deleted, _ = UploadToken.objects.filter(created_at__lt=expired).delete()
+    return deleted
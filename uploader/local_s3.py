@@ -0,0 +1,153 @@
+import hashlib
+import io
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+# جایگزین درون‌پروسه‌ای S3 برای تست‌ها و benchmark؛ فقط بخشی از API کلاینت boto3 را
+# که uploader استفاده می‌کند پیاده‌سازی می‌کند و اشیاء را در حافظه نگه می‌دارد.
+
+def _error(code, operation, status=404):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+                       operation)
+
+
+class _Body(io.BytesIO):
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class _Paginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get('PageSize')
+        if page_size:
+            kwargs['MaxKeys'] = page_size
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class LocalS3Client:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def put(self, key, data, last_modified=None):
+        # برای آماده‌سازی داده تست بدون شمارش فراخوانی
+        self.objects[key] = (bytes(data), last_modified or datetime.now(timezone.utc))
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        self._count('generate_presigned_url')
+        params = Params or {}
+        query = '&'.join(f'{k}={v}' for k, v in sorted(params.items()) if k not in ('Bucket', 'Key'))
+        return f'http://local-s3/{params.get("Bucket")}/{params.get("Key")}?{query}&method={ClientMethod}'
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self._count('put_object')
+        self.put(Key, Body if isinstance(Body, bytes) else Body.read())
+        return {'ETag': hashlib.md5(self.objects[Key][0]).hexdigest()}
+
+    def head_object(self, Bucket, Key):
+        self._count('head_object')
+        if Key not in self.objects:
+            raise _error('404', 'HeadObject')
+        data, last_modified = self.objects[Key]
+        return {'ContentLength': len(data), 'LastModified': last_modified}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._count('get_object')
+        if Key not in self.objects:
+            raise _error('NoSuchKey', 'GetObject')
+        data, last_modified = self.objects[Key]
+        return {'Body': _Body(data), 'ContentLength': len(data), 'LastModified': last_modified}
+
+    def delete_object(self, Bucket, Key):
+        self._count('delete_object')
+        self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self._count('delete_objects')
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'], None)
+        return {'Errors': []}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._count('list_objects_v2')
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and (ContinuationToken is None or k > ContinuationToken))
+        page = keys[:MaxKeys]
+        response = {
+            'Contents': [
+                {'Key': k, 'Size': len(self.objects[k][0]), 'LastModified': self.objects[k][1]} for k in page
+            ],
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys,
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation_name):
+        return _Paginator(getattr(self, operation_name))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._count('create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {'key': Key, 'parts': {}}
+        return {'UploadId': upload_id, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._count('upload_part')
+        if UploadId not in self.uploads:
+            raise _error('NoSuchUpload', 'UploadPart')
+        data = Body if isinstance(Body, bytes) else Body.read()
+        etag = hashlib.md5(data).hexdigest()
+        self.uploads[UploadId]['parts'][PartNumber] = (data, etag)
+        return {'ETag': etag}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000):
+        self._count('list_parts')
+        if UploadId not in self.uploads:
+            raise _error('NoSuchUpload', 'ListParts')
+        numbers = sorted(n for n in self.uploads[UploadId]['parts'] if n > PartNumberMarker)
+        page = numbers[:MaxParts]
+        parts = self.uploads[UploadId]['parts']
+        response = {
+            'Parts': [{'PartNumber': n, 'ETag': parts[n][1], 'Size': len(parts[n][0])} for n in page],
+            'IsTruncated': len(numbers) > MaxParts,
+        }
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = page[-1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._count('complete_multipart_upload')
+        upload = self.uploads.pop(UploadId, None)
+        if upload is None:
+            raise _error('NoSuchUpload', 'CompleteMultipartUpload')
+        self.put(Key, b''.join(upload['parts'][p['PartNumber']][0] for p in MultipartUpload['Parts']))
+        return {'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._count('abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+        return {}
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from uploader.benchmark import ENDPOINTS, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ('تأخیر (p50/p95/p99) و توان عملیاتی endpointهای اصلی را روی یک دیتابیس تست جدا '
+            'و S3 درون‌پروسه‌ای اندازه می‌گیرد و نتیجه را به صورت JSON ذخیره می‌کند.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--regions', type=int, default=10)
+        parser.add_argument('--files-per-user', type=int, default=3)
+        parser.add_argument('--requests', type=int, default=100, help='تعداد درخواست اندازه‌گیری‌شده برای هر endpoint')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='پیش‌فرض: همه endpointها')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='پیش‌فرض: benchmark-<زمان>.json')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['regions'] < 1:
+            raise CommandError('--users and --regions must be positive.')
+        output = options['output'] or f'benchmark-{timezone.now():%Y%m%d-%H%M%S}.json'
+
+        # داده ساختگی فقط در دیتابیس تست ساخته می‌شود و در پایان همراه آن حذف می‌شود
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmark(
+                requests=options['requests'],
+                warmup=options['warmup'],
+                endpoints=options['endpoint'] or ENDPOINTS,
+                seed_options={
+                    'users': options['users'],
+                    'regions': options['regions'],
+                    'files_per_user': options['files_per_user'],
+                    'seed': options['seed'],
+                },
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(output, 'w', encoding='utf-8') as stream:
+            json.dump(results, stream, indent=2)
+
+        self.stdout.write(f"{'endpoint':<26}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'req/s':>10}")
+        for name, row in results['endpoints'].items():
+            self.stdout.write(f"{name:<26}{row['requests']:>9}{row['errors']:>8}{row['p50_ms'] or 0:>10.2f}"
+                              f"{row['p95_ms'] or 0:>10.2f}{row['p99_ms'] or 0:>10.2f}{row['throughput_rps'] or 0:>10.1f}")
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from uploader.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, iter_usage_rows
+from uploader.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = ('مصرف فضای کاربران را با یک ردیف برای هر کاربر و هر فایل به صورت CSV یا XLSX خروجی می‌دهد؛ '
+            'ردیف‌ها تکه‌تکه از دیتابیس خوانده و نوشته می‌شوند.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', help='پیش‌فرض: usage-<زمان>.<قالب>')
+        parser.add_argument('--region', choices=dict(UserProfile.REGION_CHOICES))
+        parser.add_argument('--user-type', choices=dict(UserProfile.USER_TYPE_CHOICES))
+        parser.add_argument('--field', choices=dict(UserProfile.FIELD_CHOICES))
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        export_format = options['format']
+        output = options['output'] or f'usage-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        filters = {name: options[name] for name in ('region', 'user_type', 'field') if options[name]}
+
+        stream, _ = EXPORT_FORMATS[export_format]
+        written = 0
+        with open(output, 'wb') as destination:
+            for chunk in stream(iter_usage_rows(filters, chunk_size=options['chunk_size'])):
+                destination.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} bytes to {output}'))
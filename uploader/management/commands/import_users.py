@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from uploader.provisioning import USER_IMPORT_BATCH_SIZE, import_users
+
+
+class Command(BaseCommand):
+    help = 'ساخت گروهی کاربران از فایل CSV یا JSONL با همان فیلدها و اعتبارسنجی CreateUserForm.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='پیش‌فرض: از روی پسوند فایل')
+        parser.add_argument('--workers', type=int, default=None, help='تعداد پروسه‌های هش رمز عبور')
+        parser.add_argument('--batch-size', type=int, default=USER_IMPORT_BATCH_SIZE)
+        parser.add_argument('--skip-invalid', action='store_true', help='سطرهای نامعتبر را رد کن و بقیه را بساز')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Use --format csv or --format jsonl.')
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            created, errors = import_users(
+                stream, file_format,
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                skip_invalid=options['skip_invalid'],
+                processes=True,
+            )
+
+        for line, messages in errors:
+            self.stderr.write(f'line {line}: ' + ' '.join(messages))
+        if errors and not options['skip_invalid']:
+            raise CommandError(f'{len(errors)} invalid row(s); nothing was imported.')
+        self.stdout.write(self.style.SUCCESS(f'Created {created} user(s).'))
@@ -0,0 +1,85 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from uploader import storage
+from uploader.ingest import purge_expired_upload_tokens
+from uploader.models import PendingObjectDeletion, unreferenced_file_keys
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    # backoff نمایی با jitter، با سقف DELETION_RETRY_MAX_DELAY ثانیه
+    delay = min(settings.DELETION_RETRY_BASE_DELAY * 2 ** attempts, settings.DELETION_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def claim_batch(limit):
+    # ردیف‌های سررسیده برای مدت lease به این worker اختصاص داده می‌شوند؛ اگر worker وسط کار
+    # از بین برود، بعد از پایان lease دوباره برداشته می‌شوند
+    now = timezone.now()
+    with transaction.atomic():
+        rows = PendingObjectDeletion.objects.filter(next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            rows = rows.select_for_update(skip_locked=True)
+        rows = list(rows.values_list('id', 'file_key', 'attempts')[:limit])
+        PendingObjectDeletion.objects.filter(id__in=[row[0] for row in rows]).update(
+            next_attempt_at=now + timedelta(seconds=settings.DELETION_LEASE_SECONDS)
+        )
+    return rows
+
+
+def process_batch(rows, workers):
+    # اگر بعد از ثبت در صف فایلی با همین کلید دوباره ثبت شده باشد، شیء باکت حذف نمی‌شود و ردیف صف کنار می‌رود
+    keys = unreferenced_file_keys(file_key for _, file_key, _ in rows)
+    size = storage.DELETE_OBJECTS_BATCH_SIZE
+    chunks = [keys[start:start + size] for start in range(0, len(keys), size)]
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk_failed in executor.map(storage.delete_objects, chunks):
+            failed.update(chunk_failed)
+
+    PendingObjectDeletion.objects.filter(id__in=[row_id for row_id, file_key, _ in rows if file_key not in failed]).delete()
+    now = timezone.now()
+    for row_id, file_key, attempts in rows:
+        if file_key in failed:
+            logger.warning('Deleting %s from bucket failed (attempt %d): %s', file_key, attempts + 1, failed[file_key])
+            PendingObjectDeletion.objects.filter(id=row_id).update(
+                attempts=attempts + 1,
+                next_attempt_at=now + retry_delay(attempts),
+                last_error=failed[file_key],
+            )
+    return len(rows) - sum(1 for _, file_key, _ in rows if file_key in failed), len(failed)
+
+
+class Command(BaseCommand):
+    help = 'صف حذف فایل‌ها از bucket (PendingObjectDeletion) را با چند thread و تلاش مجدد خالی می‌کند و توکن‌های آپلود منقضی را پاک می‌کند.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='بعد از خالی شدن ردیف‌های سررسیده خارج شو')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--poll-interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            rows = claim_batch(options['batch_size'])
+            if rows:
+                deleted, failed = process_batch(rows, options['workers'])
+                self.stdout.write(f'Deleted {deleted} object(s), {failed} failed.')
+                continue
+            # وقتی صف خالی است، توکن‌های آپلود منقضی هم پاک می‌شوند
+            expired = purge_expired_upload_tokens()
+            if expired:
+                self.stdout.write(f'Purged {expired} expired upload token(s).')
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from uploader import fragments
+from uploader.models import UploadedFile, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'فضای استفاده‌شده همه کاربران را از روی جدول فایل‌ها دوباره محاسبه و شمارنده‌ها را اصلاح می‌کند.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='فقط گزارش اختلاف‌ها، بدون تغییر دیتابیس')
+
+    def handle(self, *args, **options):
+        actual = Coalesce(
+            Subquery(
+                UploadedFile.objects.filter(user=OuterRef('user'))
+                .values('user')
+                .annotate(total=Sum('size'))
+                .values('total'),
+                output_field=BigIntegerField(),
+            ),
+            Value(0),
+        )
+
+        drifted = (
+            UserProfile.objects.annotate(actual=actual)
+            .exclude(used_storage=F('actual'))
+            .values_list('user__username', 'used_storage', 'actual')
+        )
+        count = 0
+        for username, used_storage, actual_storage in drifted.iterator():
+            count += 1
+            self.stdout.write(f'{username}: {used_storage} -> {actual_storage}')
+
+        if options['dry_run']:
+            self.stdout.write(f'{count} counter(s) out of sync.')
+            return
+
+        # بازسازی کامل با یک UPDATE، مستقل از این‌که کدام ردیف‌ها اختلاف داشتند
+        UserProfile.objects.update(used_storage=actual)
+        fragments.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f'Repaired {count} counter(s).'))
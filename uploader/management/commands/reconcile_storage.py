@@ -0,0 +1,66 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uploader.reconcile import delete_orphans, fix_sizes, reconcile
+
+
+class Command(BaseCommand):
+    help = ('فایل‌های bucket را با جدول UploadedFile مقایسه می‌کند و فایل‌های گمشده، '
+            'اشیاء بی‌صاحب و اختلاف اندازه را گزارش (و در صورت درخواست اصلاح) می‌کند.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='')
+        parser.add_argument('--fix-sizes', action='store_true', help='اندازه ردیف‌ها را با اندازه S3 یکی کن')
+        parser.add_argument('--delete-orphans', action='store_true', help='اشیاء بدون ردیف را از bucket حذف کن')
+        parser.add_argument('--orphan-min-age', type=float, default=24,
+                            help='فقط اشیاء قدیمی‌تر از این چند ساعت حذف شوند (آپلودهای در جریان حفظ شوند)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orphan_cutoff = timezone.now() - timedelta(hours=options['orphan_min_age'])
+        counts = Counter()
+        mismatches, orphans = [], []
+        failed = {}
+
+        for item in reconcile(options['prefix'], page_size=options['page_size'], chunk_size=batch_size):
+            counts[item.kind] += 1
+            if item.kind == 'missing':
+                self.stdout.write(f'missing\t{item.file_key}\tid={item.file_id}\tsize={item.db_size}')
+            elif item.kind == 'orphan':
+                self.stdout.write(f'orphan\t{item.file_key}\tsize={item.bucket_size}')
+                if options['delete_orphans'] and item.last_modified < orphan_cutoff:
+                    orphans.append(item)
+            else:
+                self.stdout.write(f'size_mismatch\t{item.file_key}\tid={item.file_id}'
+                                  f'\tdb={item.db_size}\tbucket={item.bucket_size}')
+                if options['fix_sizes']:
+                    mismatches.append(item)
+
+            # اصلاح‌ها هم دسته‌ای انجام می‌شوند تا حافظه به اندازه bucket وابسته نباشد
+            if len(mismatches) >= batch_size:
+                fix_sizes(mismatches)
+                counts['sizes_fixed'] += len(mismatches)
+                mismatches = []
+            if len(orphans) >= batch_size:
+                failed.update(delete_orphans(orphans))
+                counts['orphans_deleted'] += len(orphans)
+                orphans = []
+
+        fix_sizes(mismatches)
+        counts['sizes_fixed'] += len(mismatches)
+        if orphans:
+            failed.update(delete_orphans(orphans))
+            counts['orphans_deleted'] += len(orphans)
+        counts['orphans_deleted'] -= len(failed)
+
+        for file_key, error in failed.items():
+            self.stderr.write(f'delete failed\t{file_key}\t{error}')
+        self.stdout.write(
+            f"missing={counts['missing']} orphans={counts['orphan']} size_mismatches={counts['size_mismatch']} "
+            f"sizes_fixed={counts['sizes_fixed']} orphans_deleted={counts['orphans_deleted']}"
+        )
@@ -0,0 +1,111 @@
+from itertools import groupby
+from operator import attrgetter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FieldManifest, UploadedFile, UserProfile
+
+MANIFEST_CHUNK_SIZE = 2000
+
+
+def group_files_by_region(files):
+    # فایل‌ها (با select_related پروفایل) به ساختار پژوهشسرا ← کاربر ← فایل تبدیل می‌شوند،
+    # به ترتیب REGION_CHOICES و بدون هیچ کوئری اضافه
+    region_names = dict(UserProfile.REGION_CHOICES)
+    region_order = {code: index for index, (code, name) in enumerate(UserProfile.REGION_CHOICES)}
+    regions = {}
+    for file in files:
+        region_code = file.user.userprofile.region
+        region = regions.setdefault(region_code, {
+            'code': region_code,
+            'display_name': region_names.get(region_code, region_code),
+            'users': {},
+        })
+        user = region['users'].setdefault(file.user_id, {
+            'id': file.user_id,
+            'username': file.user.username,
+            'files': [],
+        })
+        user['files'].append({
+            'id': file.id,
+            'field': file.field,
+            'field_display': file.get_field_display(),
+            'file_key': file.file_key,
+            'size': file.size,
+            'uploaded_at': file.uploaded_at.isoformat(),
+        })
+
+    result = []
+    for region in sorted(regions.values(), key=lambda r: region_order[r['code']]):
+        region['users'] = list(region['users'].values())
+        result.append(region)
+    return result
+
+
+def _with_totals(regions):
+    # تعداد و حجم فایل‌ها در هر سطح؛ بعد از هر تغییر از روی خود فایل‌ها دوباره حساب می‌شود
+    for region in regions:
+        for user in region['users']:
+            user['file_count'] = len(user['files'])
+            user['total_size'] = sum(file['size'] for file in user['files'])
+        region['file_count'] = sum(user['file_count'] for user in region['users'])
+        region['total_size'] = sum(user['total_size'] for user in region['users'])
+    return {
+        'regions': regions,
+        'file_count': sum(region['file_count'] for region in regions),
+        'total_size': sum(region['total_size'] for region in regions),
+    }
+
+
+def build_field_manifests(fields=None):
+    # همه رشته‌ها با یک کوئری مرتب بر اساس رشته و یک upsert گروهی؛ رشته بدون فایل هم مانیفست خالی دارد
+    fields = fields or [code for code, name in UserProfile.FIELD_CHOICES]
+    files = UploadedFile.objects.filter(
+        field__in=fields,
+        user__userprofile__region__in=dict(UserProfile.REGION_CHOICES),
+    ).select_related('user__userprofile').order_by('field', 'user__username', 'id').iterator(
+        chunk_size=MANIFEST_CHUNK_SIZE
+    )
+    regions_by_field = {field: [] for field in fields}
+    for field, field_files in groupby(files, key=attrgetter('field')):
+        regions_by_field[field] = group_files_by_region(field_files)
+
+    now = timezone.now()
+    manifests = []
+    for field, regions in regions_by_field.items():
+        data = _with_totals(regions)
+        manifests.append(FieldManifest(
+            field=field, data=data, file_count=data['file_count'], total_size=data['total_size'], built_at=now,
+        ))
+    FieldManifest.objects.bulk_create(
+        manifests, update_conflicts=True, unique_fields=['field'],
+        update_fields=['data', 'file_count', 'total_size', 'built_at'],
+    )
+    return {manifest.field: manifest for manifest in manifests}
+
+
+def get_field_manifest(field):
+    # اگر مانیفست رشته پاک شده باشد (فایل جدید در فاز دوم)، همین‌جا دوباره ساخته می‌شود
+    manifest = FieldManifest.objects.filter(field=field).first()
+    if manifest is None:
+        manifest = build_field_manifests([field])[field]
+    return manifest
+
+
+def remove_files(file_ids_by_field):
+    # به‌روزرسانی تدریجی بعد از حذف: فقط فایل‌های حذف‌شده از درخت برداشته و مجموع‌ها دوباره حساب می‌شوند
+    with transaction.atomic():
+        for manifest in FieldManifest.objects.select_for_update().filter(field__in=file_ids_by_field):
+            removed = file_ids_by_field[manifest.field]
+            regions = []
+            for region in manifest.data.get('regions', []):
+                for user in region['users']:
+                    user['files'] = [file for file in user['files'] if file['id'] not in removed]
+                region['users'] = [user for user in region['users'] if user['files']]
+                if region['users']:
+                    regions.append(region)
+            manifest.data = _with_totals(regions)
+            manifest.file_count = manifest.data['file_count']
+            manifest.total_size = manifest.data['total_size']
+            manifest.save(update_fields=['data', 'file_count', 'total_size'])
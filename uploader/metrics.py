@@ -0,0 +1,176 @@
+import bisect
+import contextvars
+import heapq
+import threading
+import time
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+# متریک‌های هر پروسه به صورت هیستوگرام و با فرمت متنی Prometheus (بدون وابستگی اضافه).
+# هر پروسه متریک‌های خودش را دارد؛ Prometheus باید همه پروسه‌ها/سرورها را جداگانه scrape کند.
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # شمارنده هر bucket به اضافه +Inf، مجموع و تعداد
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_value, (counts, total, count) in sorted(series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram('uploader_request_duration_seconds', 'Total view time', 'view', TIME_BUCKETS)
+DB_QUERIES = Histogram('uploader_db_queries', 'Database queries per request', 'view', COUNT_BUCKETS)
+DB_TIME = Histogram('uploader_db_query_seconds', 'Database time per request', 'view', TIME_BUCKETS)
+S3_CALLS = Histogram('uploader_s3_calls', 'S3 API calls per request', 'view', COUNT_BUCKETS)
+S3_TIME = Histogram('uploader_s3_call_seconds', 'S3 API time per request', 'view', TIME_BUCKETS)
+RENDER_TIME = Histogram('uploader_template_render_seconds', 'Template render time per request', 'view', TIME_BUCKETS)
+S3_OPERATION = Histogram('uploader_s3_operation_seconds', 'Latency of each S3 API call', 'operation', TIME_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, DB_QUERIES, DB_TIME, S3_CALLS, S3_TIME, RENDER_TIME, S3_OPERATION)
+
+
+class RequestMetrics:
+    def __init__(self, keep_queries=False):
+        self.keep_queries = keep_queries
+        self.queries = []
+        self.query_count = 0
+        self.query_time = 0.0
+        self.s3_calls = 0
+        self.s3_time = 0.0
+        self.render_time = 0.0
+
+    def worst_queries(self, limit):
+        return heapq.nlargest(limit, self.queries)
+
+
+# با contextvar، متریک‌ها در ویوهای async و threadهای sync_to_async هم به همان درخواست می‌رسند
+current_request = contextvars.ContextVar('uploader_request_metrics', default=None)
+
+
+def expose():
+    return '\n'.join(histogram.expose() for histogram in HISTOGRAMS) + '\n'
+
+
+def record_request(view, duration, metrics):
+    REQUEST_DURATION.observe(view, duration)
+    DB_QUERIES.observe(view, metrics.query_count)
+    DB_TIME.observe(view, metrics.query_time)
+    S3_CALLS.observe(view, metrics.s3_calls)
+    S3_TIME.observe(view, metrics.s3_time)
+    RENDER_TIME.observe(view, metrics.render_time)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.query_count += 1
+        metrics.query_time += elapsed
+        if metrics.keep_queries:
+            metrics.queries.append((elapsed, sql))
+
+
+def instrument_connection(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def _instrument_new_connection(sender, connection, **kwargs):
+    instrument_connection(connection)
+
+
+def _s3_call_started(model, context, **kwargs):
+    context['uploader_started_at'] = (model.name, time.perf_counter())
+
+
+def _s3_call_finished(context, **kwargs):
+    # after-call-error (خطای شبکه) model ندارد، پس نام عملیات از شروع فراخوانی نگه داشته می‌شود
+    started = context.pop('uploader_started_at', None)
+    if started is None:
+        return
+    operation, started_at = started
+    elapsed = time.perf_counter() - started_at
+    S3_OPERATION.observe(operation, elapsed)
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.s3_calls += 1
+        metrics.s3_time += elapsed
+
+
+def register_s3_hooks(client):
+    # زمان هر فراخوانی API (شامل retryها)؛ امضای لینک‌ها فراخوانی شبکه نیست و شمرده نمی‌شود
+    client.meta.events.register('provide-client-params.s3', _s3_call_started)
+    client.meta.events.register('after-call.s3', _s3_call_finished)
+    client.meta.events.register('after-call-error.s3', _s3_call_finished)
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current_request.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.render_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    # همان موتور قالب جنگو؛ فقط زمان render قالب اصلی هر پاسخ اندازه‌گیری می‌شود
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,78 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+from .context import RequestContext
+from .metrics import RequestMetrics, current_request, instrument_connection, record_request
+
+slow_request_logger = logging.getLogger('uploader.slow_requests')
+
+
+class RequestMetricsMiddleware:
+    # زمان کل، کوئری‌ها، فراخوانی‌های S3 و render قالب هر درخواست را به تفکیک ویو ثبت می‌کند
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        instrument_connection(connection)
+        metrics, token, start = self._start()
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(request, metrics, token, start)
+
+    async def __acall__(self, request):
+        metrics, token, start = self._start()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(request, metrics, token, start)
+
+    def _start(self):
+        metrics = RequestMetrics(keep_queries=settings.SLOW_REQUEST_THRESHOLD is not None)
+        return metrics, current_request.set(metrics), time.perf_counter()
+
+    def _finish(self, request, metrics, token, start):
+        duration = time.perf_counter() - start
+        current_request.reset(token)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        record_request(view, duration, metrics)
+
+        threshold = settings.SLOW_REQUEST_THRESHOLD
+        if threshold is not None and duration >= threshold:
+            worst = ''.join(
+                f'\n  {elapsed * 1000:.1f}ms {sql[:500]}'
+                for elapsed, sql in metrics.worst_queries(settings.SLOW_REQUEST_TOP_QUERIES)
+            )
+            slow_request_logger.warning(
+                '%s %s (%s) %.0fms: %d queries %.0fms, %d S3 calls %.0fms, render %.0fms%s',
+                request.method, request.path, view, duration * 1000,
+                metrics.query_count, metrics.query_time * 1000,
+                metrics.s3_calls, metrics.s3_time * 1000, metrics.render_time * 1000, worst,
+            )
+
+
+class RequestContextMiddleware:
+    # request.ctx را می‌سازد؛ خود شیء تنبل است و تا وقتی استفاده نشود کوئری نمی‌زند
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.ctx = RequestContext(request)
+        return self.get_response(request)
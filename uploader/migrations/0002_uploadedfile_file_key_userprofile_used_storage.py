@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_used_storage(apps, schema_editor):
+    UploadedFile = apps.get_model('uploader', 'UploadedFile')
+    UserProfile = apps.get_model('uploader', 'UserProfile')
+    totals = UploadedFile.objects.values('user').annotate(total=Sum('size'))
+    for row in totals:
+        UserProfile.objects.filter(user_id=row['user']).update(used_storage=row['total'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0001_initial'),
+    ]
+
+    operations = [
+        # مسیر ذخیره‌شده FileField همان کلید شیء در باکت است؛ ستون تغییر نام می‌دهد تا کلیدها حفظ شوند
+        migrations.RenameField(
+            model_name='uploadedfile',
+            old_name='file',
+            new_name='file_key',
+        ),
+        migrations.AlterField(
+            model_name='uploadedfile',
+            name='file_key',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='used_storage',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_used_storage, migrations.RunPython.noop),
+    ]
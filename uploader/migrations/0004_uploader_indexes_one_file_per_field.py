@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicate_files(apps, schema_editor):
+    # قبل از قید یکتا، فایل‌های تکراری هر (کاربر، رشته) که از رقابت درخواست‌های هم‌زمان
+    # ایجاد شده‌اند حذف می‌شوند؛ قدیمی‌ترین فایل (کمترین id) می‌ماند
+    UploadedFile = apps.get_model('uploader', 'UploadedFile')
+    UserProfile = apps.get_model('uploader', 'UserProfile')
+    PendingObjectDeletion = apps.get_model('uploader', 'PendingObjectDeletion')
+
+    duplicates = (UploadedFile.objects.values('user', 'field')
+                  .annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1))
+    for group in duplicates:
+        extra = UploadedFile.objects.filter(user=group['user'], field=group['field']).exclude(id=group['keep'])
+        rows = list(extra.values_list('id', 'file_key', 'size'))
+        extra.delete()
+        UserProfile.objects.filter(user_id=group['user']).update(
+            used_storage=F('used_storage') - sum(size for _, _, size in rows)
+        )
+        # کلیدی که هنوز ردیف دیگری به آن اشاره می‌کند نباید از bucket حذف شود
+        keys = {file_key for _, file_key, _ in rows}
+        keys -= set(UploadedFile.objects.filter(file_key__in=keys).values_list('file_key', flat=True))
+        PendingObjectDeletion.objects.bulk_create([PendingObjectDeletion(file_key=key) for key in keys])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0003_pendingobjectdeletion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_files, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['field'], name='uploader_file_field_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['region'], name='uploader_profile_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['user_type'], name='uploader_profile_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['field'], name='uploader_profile_field_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='uploadedfile',
+            constraint=models.UniqueConstraint(fields=('user', 'field'), name='uploader_one_file_per_field'),
+        ),
+    ]
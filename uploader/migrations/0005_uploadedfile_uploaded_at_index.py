@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0004_uploader_indexes_one_file_per_field'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['uploaded_at', 'id'], name='uploader_file_uploaded_idx'),
+        ),
+    ]
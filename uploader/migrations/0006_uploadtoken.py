@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0005_uploadedfile_uploaded_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('field', models.CharField(choices=[('Literature', 'ادبیات و علوم انسانی'), ('LabSciences', 'آزمایشگاه علوم تجربی'), ('RoboticsAI', 'رباتیک و هوش مصنوعی'), ('Coding', 'کدنویسی'), ('Nanotechnology', 'نانوفناوری'), ('StemCells', 'سلول\u200cهای بنیادی'), ('SpaceTech', 'فناوری\u200cهای حوزه فضایی'), ('Astronomy', 'نجوم'), ('MedicinalPlants', 'گیاهان دارویی'), ('NuclearTech', 'علوم و فنون هسته\u200cای'), ('RenewableEnergy', 'انرژی\u200cهای نوین'), ('Biotechnology', 'زیست\u200cفناوری')], max_length=50)),
+                ('file_key', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0006_uploadtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('Literature', 'ادبیات و علوم انسانی'), ('LabSciences', 'آزمایشگاه علوم تجربی'), ('RoboticsAI', 'رباتیک و هوش مصنوعی'), ('Coding', 'کدنویسی'), ('Nanotechnology', 'نانوفناوری'), ('StemCells', 'سلول\u200cهای بنیادی'), ('SpaceTech', 'فناوری\u200cهای حوزه فضایی'), ('Astronomy', 'نجوم'), ('MedicinalPlants', 'گیاهان دارویی'), ('NuclearTech', 'علوم و فنون هسته\u200cای'), ('RenewableEnergy', 'انرژی\u200cهای نوین'), ('Biotechnology', 'زیست\u200cفناوری')], max_length=50, unique=True)),
+                ('data', models.JSONField(default=dict)),
+                ('file_count', models.PositiveIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('built_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,15 +1,52 @@
-from django.db import models
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import BigIntegerField, Case, F, Value, When
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import fragments, storage
+from .phase import get_current_phase, invalidate_phase_cache
 
 class Phase(models.Model):
     is_phase_one = models.BooleanField(default=True)  # True for Phase 1, False for Phase 2
 
+@receiver(pre_save, sender=Phase)
+def remember_previous_phase(sender, instance, **kwargs):
+    # فاز ذخیره‌شده قبل از این تغییر، با همان پیش‌فرض _load_phase
+    previous = Phase.objects.values_list('is_phase_one', flat=True).first()
+    instance._was_phase_one = True if previous is None else previous
+
 @receiver(post_save, sender=Phase)
 def ensure_single_phase(sender, instance, created, **kwargs):
     if created:
         Phase.objects.exclude(id=instance.id).delete()
+    invalidate_phase_cache()
+    fragments.invalidate_all()
+    # ذخیره فرم فاز بدون تغییر مقدار نباید همه مانیفست‌ها را دوباره بسازد یا پاک کند
+    if instance.is_phase_one != getattr(instance, '_was_phase_one', None):
+        _rebuild_field_manifests(instance.is_phase_one)
+
+@receiver(post_delete, sender=Phase)
+def phase_deleted(sender, instance, **kwargs):
+    invalidate_phase_cache()
+    fragments.invalidate_all()
+    # بدون ردیف فاز، فاز اول است؛ مگر این‌که ensure_single_phase ردیف قدیمی را به نفع ردیف جدید فاز دوم حذف کرده باشد
+    if not instance.is_phase_one and not Phase.objects.filter(is_phase_one=False).exists():
+        _rebuild_field_manifests(True)
+
+def _rebuild_field_manifests(is_phase_one):
+    # با رفتن به فاز دوم فایل‌ها ثابت می‌شوند و فهرست هر رشته یک بار ساخته می‌شود؛ در فاز اول مانیفستی نیست
+    from .manifest import build_field_manifests
+
+    if is_phase_one:
+        FieldManifest.objects.all().delete()
+    else:
+        build_field_manifests()
 
 class UserProfile(models.Model):
     REGION_CHOICES = [
@@ -89,12 +126,60 @@ class UserProfile(models.Model):
     region = models.CharField(max_length=50, choices=REGION_CHOICES, blank=True, null=True)
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES, default='Normal')
     field = models.CharField(max_length=50, choices=FIELD_CHOICES, blank=True, null=True)
+    # مجموع حجم فایل‌های کاربر؛ فقط با عبارت‌های F به‌روزرسانی می‌شود (recompute_used_storage برای اصلاح)
+    used_storage = models.BigIntegerField(default=0)
+
+    class Meta:
+        # داشبورد ادمین و مدیر رشته روی همین ستون‌ها فیلتر می‌کنند
+        indexes = [
+            models.Index(fields=['region'], name='uploader_profile_region_idx'),
+            models.Index(fields=['user_type'], name='uploader_profile_type_idx'),
+            models.Index(fields=['field'], name='uploader_profile_field_idx'),
+        ]
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    _invalidate_fragments(fragments.user_keys(instance.user_id))
+
+class UploadedFileManager(models.Manager):
+    def create_within_quota(self, user, size, **kwargs):
+        # بررسی سهمیه و رزرو فضا در یک UPDATE شرطی؛ اگر جا نباشد هیچ ردیفی تغییر نمی‌کند
+        if size <= 0:
+            raise ValueError('اندازه فایل نامعتبر است')
+        with transaction.atomic():
+            reserved = UserProfile.objects.filter(
+                user=user, used_storage__lte=F('allowed_storage') - size
+            ).update(used_storage=F('used_storage') + size)
+            if not reserved:
+                return None
+            file = self.model(user=user, size=size, **kwargs)
+            file._storage_reserved = True
+            file.save(force_insert=True)
+        return file
+
+    def bulk_create_within_quota(self, user, files):
+        # چند فایل با یک رزرو سهمیه و یک INSERT؛ یا همه ثبت می‌شوند یا هیچ‌کدام
+        if any(file['size'] <= 0 for file in files):
+            raise ValueError('اندازه فایل نامعتبر است')
+        total = sum(file['size'] for file in files)
+        with transaction.atomic():
+            reserved = UserProfile.objects.filter(
+                user=user, used_storage__lte=F('allowed_storage') - total
+            ).update(used_storage=F('used_storage') + total)
+            if not reserved:
+                return None
+            created = self.bulk_create([self.model(user=user, **file) for file in files])
+            # bulk_create سیگنال post_save نمی‌فرستد
+            _invalidate_fragments(fragments.user_keys(user.id))
+        return created
+
+
 class UploadedFile(models.Model):
     FIELD_CHOICES = UserProfile.FIELD_CHOICES
 
@@ -104,5 +189,168 @@ class UploadedFile(models.Model):
     size = models.BigIntegerField(default=0)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    objects = UploadedFileManager()
+
+    class Meta:
+        # هر کاربر در هر رشته فقط یک فایل؛ ایندکس یکتای (user, field) همان ایندکس ترکیبی هم هست
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'field'], name='uploader_one_file_per_field'),
+        ]
+        indexes = [
+            models.Index(fields=['field'], name='uploader_file_field_idx'),
+            # ترتیب صفحه‌بندی keyset در API فهرست فایل‌ها
+            models.Index(fields=['uploaded_at', 'id'], name='uploader_file_uploaded_idx'),
+        ]
+
     def get_field_display(self):
-        return dict(self.FIELD_CHOICES).get(self.field, self.field)
\ No newline at end of file
+        return dict(self.FIELD_CHOICES).get(self.field, self.field)
+
+class UploadToken(models.Model):
+    # هر لینک آپلود یک توکن دارد و کلید فایل با آن شروع می‌شود (<token>/<file_name>)،
+    # تا رویداد ObjectCreated باکت به کاربر و رشته‌ای که آپلود برایش مجاز شده برگردد
+    token = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_tokens')
+    field = models.CharField(max_length=50, choices=UserProfile.FIELD_CHOICES)
+    file_key = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # اندازه اعلام‌شده؛ اندازه واقعی از رویداد S3 می‌آید
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class FieldManifest(models.Model):
+    # فهرست فشرده فایل‌های هر رشته (پژوهشسرا ← کاربر ← فایل، با تعداد و حجم هر سطح) که با رفتن به
+    # فاز دوم ساخته می‌شود و داشبوردها به جای ساختن دوباره درخت از روی فایل‌ها از آن استفاده می‌کنند
+    field = models.CharField(max_length=50, choices=UserProfile.FIELD_CHOICES, unique=True)
+    data = models.JSONField(default=dict)
+    file_count = models.PositiveIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    built_at = models.DateTimeField(default=timezone.now)
+
+
+class PendingObjectDeletion(models.Model):
+    # صف خروجی حذف از bucket؛ در همان تراکنشی نوشته می‌شود که ردیف UploadedFile حذف می‌شود
+    # و process_deletions آن را خالی می‌کند
+    file_key = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+
+_file_accounting = threading.local()
+
+UNREFERENCED_KEYS_BATCH_SIZE = 1000
+
+
+def unreferenced_file_keys(file_keys):
+    # کلیدی که ردیف دیگری هنوز از آن استفاده می‌کند (مثلاً لینک بدون رشته که خود نام فایل را کلید می‌کند)
+    # نباید از bucket حذف شود
+    file_keys = sorted(set(file_keys))
+    in_use = set()
+    for start in range(0, len(file_keys), UNREFERENCED_KEYS_BATCH_SIZE):
+        in_use.update(UploadedFile.objects.filter(
+            file_key__in=file_keys[start:start + UNREFERENCED_KEYS_BATCH_SIZE]
+        ).values_list('file_key', flat=True))
+    return [file_key for file_key in file_keys if file_key not in in_use]
+
+
+def apply_storage_deltas(deltas):
+    # تغییرات used_storage چند کاربر با یک UPDATE
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if deltas:
+        UserProfile.objects.filter(user_id__in=deltas).update(used_storage=F('used_storage') + Case(
+            *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=BigIntegerField(),
+        ))
+
+
+@contextmanager
+def batched_file_accounting():
+    # داخل این بلوک تغییرات used_storage و کلیدهای حذف‌شده جمع می‌شوند و در پایان
+    # با یک UPDATE و یک bulk_create اعمال می‌شوند (به جای چند کوئری برای هر فایل)
+    if getattr(_file_accounting, 'pending', None) is not None:
+        yield
+        return
+    _file_accounting.pending = {
+        'storage': defaultdict(int), 'deleted_keys': [], 'deleted_ids': [], 'fragments': set(),
+        'manifest': defaultdict(set),
+    }
+    try:
+        with transaction.atomic():
+            yield
+            apply_storage_deltas(_file_accounting.pending['storage'])
+            PendingObjectDeletion.objects.bulk_create(
+                [PendingObjectDeletion(file_key=file_key)
+                 for file_key in unreferenced_file_keys(_file_accounting.pending['deleted_keys'])],
+                batch_size=1000,
+            )
+            fragments.invalidate(_file_accounting.pending['fragments'])
+            remove_from_field_manifests(_file_accounting.pending['manifest'])
+        storage.evict_download_urls(_file_accounting.pending['deleted_ids'])
+    finally:
+        _file_accounting.pending = None
+
+
+def _apply_storage_delta(user_id, delta):
+    pending = getattr(_file_accounting, 'pending', None)
+    if pending is not None:
+        pending['storage'][user_id] += delta
+    else:
+        UserProfile.objects.filter(user_id=user_id).update(used_storage=F('used_storage') + delta)
+
+
+def _invalidate_fragments(keys):
+    pending = getattr(_file_accounting, 'pending', None)
+    if pending is not None:
+        pending['fragments'].update(keys)
+    else:
+        fragments.invalidate(keys)
+
+
+def remove_from_field_manifests(file_ids_by_field):
+    # مانیفست فقط در فاز دوم وجود دارد؛ فاز از کش همین پروسه خوانده می‌شود و در فاز اول کوئری ندارد
+    if file_ids_by_field and not get_current_phase():
+        from .manifest import remove_files
+
+        remove_files(file_ids_by_field)
+
+
+def discard_field_manifests(fields):
+    # فایل جدید در فاز دوم (مثلاً رویداد دیرهنگام باکت)؛ مانیفست رشته در بازدید بعدی دوباره ساخته می‌شود
+    if fields and not get_current_phase():
+        FieldManifest.objects.filter(field__in=fields).delete()
+
+
+def _remove_from_manifest(field, file_id):
+    pending = getattr(_file_accounting, 'pending', None)
+    if pending is not None:
+        pending['manifest'][field].add(file_id)
+    else:
+        remove_from_field_manifests({field: {file_id}})
+
+
+def _enqueue_object_deletion(file_id, file_key):
+    pending = getattr(_file_accounting, 'pending', None)
+    if pending is not None:
+        pending['deleted_keys'].append(file_key)
+        pending['deleted_ids'].append(file_id)
+    else:
+        if unreferenced_file_keys([file_key]):
+            PendingObjectDeletion.objects.create(file_key=file_key)
+        storage.evict_download_urls([file_id])
+
+@receiver(post_save, sender=UploadedFile)
+def add_to_used_storage(sender, instance, created, **kwargs):
+    # فایل‌هایی که از مسیر create_within_quota ساخته شده‌اند قبلاً حساب شده‌اند
+    if created and not getattr(instance, '_storage_reserved', False):
+        _apply_storage_delta(instance.user_id, instance.size)
+    _invalidate_fragments(fragments.user_keys(instance.user_id))
+    discard_field_manifests([instance.field])
+
+@receiver(post_delete, sender=UploadedFile)
+def file_deleted(sender, instance, **kwargs):
+    # post_delete داخل تراکنش حذف اجرا می‌شود، پس ردیف صف هم‌زمان با حذف commit می‌شود
+    _apply_storage_delta(instance.user_id, -instance.size)
+    _enqueue_object_deletion(instance.id, instance.file_key)
+    _invalidate_fragments(fragments.user_keys(instance.user_id))
+    _remove_from_manifest(instance.field, instance.id)
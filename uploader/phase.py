@@ -0,0 +1,57 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+PHASE_VERSION_KEY = 'uploader:phase:version'
+PHASE_VALUE_KEY = 'uploader:phase:value:{}'
+
+# (نسخه، مقدار، زمان آخرین بررسی نسخه) در حافظه همین پروسه.
+# هر پروسه حداکثر هر PHASE_CACHE_CHECK_INTERVAL ثانیه یک بار نسخه را از کش مشترک می‌خواند،
+# پس تغییر فاز در همه پروسه‌ها حداکثر با همین تأخیر دیده می‌شود.
+_local = (None, None, 0.0)
+
+
+def _load_phase():
+    from .models import Phase
+
+    phase = Phase.objects.first()
+    return phase.is_phase_one if phase else True
+
+
+def get_current_phase():
+    global _local
+    version, value, checked_at = _local
+    now = time.monotonic()
+    if version is not None and now - checked_at < settings.PHASE_CACHE_CHECK_INTERVAL:
+        return value
+
+    current_version = cache.get(PHASE_VERSION_KEY)
+    if current_version is None:
+        cache.add(PHASE_VERSION_KEY, uuid.uuid4().hex, None)
+        current_version = cache.get(PHASE_VERSION_KEY)
+    if current_version is not None and current_version == version:
+        _local = (version, value, now)
+        return value
+
+    value = cache.get(PHASE_VALUE_KEY.format(current_version))
+    if value is None:
+        value = _load_phase()
+        cache.set(PHASE_VALUE_KEY.format(current_version), value, None)
+    _local = (current_version, value, now)
+    return value
+
+
+def invalidate_phase_cache():
+    global _local
+
+    def bump():
+        global _local
+        cache.set(PHASE_VERSION_KEY, uuid.uuid4().hex, None)
+        _local = (None, None, 0.0)
+
+    # نسخه جدید فقط بعد از commit منتشر می‌شود تا پروسه‌های دیگر مقدار قدیمی را دوباره کش نکنند
+    _local = (None, None, 0.0)
+    transaction.on_commit(bump)
@@ -0,0 +1,109 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import fragments
+from .forms import CreateUserForm
+from .models import UserProfile
+
+USER_IMPORT_BATCH_SIZE = 500
+# درون درخواست وب پروسه فرزند ساخته نمی‌شود و تعداد threadها محدود است تا worker وب اشغال نشود
+USER_IMPORT_MAX_THREADS = 4
+
+
+def read_rows(stream, file_format):
+    # هر سطر همان فیلدهای CreateUserForm را دارد؛ ستون password برای هر دو رمز پذیرفته می‌شود
+    if file_format == 'csv':
+        rows = csv.DictReader(stream)
+    elif file_format == 'jsonl':
+        rows = (json.loads(line) for line in stream if line.strip())
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+    for row in rows:
+        row = {key.strip(): ('' if value is None else str(value).strip()) for key, value in row.items() if key}
+        if 'password' in row:
+            row.setdefault('password1', row['password'])
+            row.setdefault('password2', row['password'])
+        yield row
+
+
+def validate_rows(rows):
+    valid, errors = [], []
+    seen = set()
+    for line, row in enumerate(rows, start=1):
+        form = CreateUserForm(data=row)
+        if not form.is_valid():
+            errors.append((line, [str(e) for field_errors in form.errors.values() for e in field_errors]))
+            continue
+        username = form.cleaned_data['username']
+        if username in seen:
+            errors.append((line, [f'نام کاربری {username} در فایل تکراری است.']))
+            continue
+        seen.add(username)
+        valid.append(form.cleaned_data)
+    return valid, errors
+
+
+def _init_worker():
+    # در حالت spawn پروسه‌های فرزند باید خودشان جنگو را راه‌اندازی کنند تا PASSWORD_HASHERS را بشناسند
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'FileManagment.settings')
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None, processes=False):
+    # PBKDF2 عمداً کند است؛ فرمان import_users هش‌کردن را بین چند پروسه پخش می‌کند. در مسیر وب از
+    # threadها استفاده می‌شود: pbkdf2_hmac هنگام محاسبه GIL را آزاد می‌کند و fork از worker وب لازم نیست
+    if len(passwords) < 2 or workers == 1:
+        return [make_password(password) for password in passwords]
+    if processes:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            return list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+    workers = workers or min(USER_IMPORT_MAX_THREADS, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords))
+
+
+def create_users(valid, workers=None, batch_size=USER_IMPORT_BATCH_SIZE, processes=False):
+    hashes = hash_passwords([data['password1'] for data in valid], workers, processes)
+    created = 0
+    with transaction.atomic():
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            users = User.objects.bulk_create([
+                User(username=data['username'], password=password_hash)
+                for data, password_hash in zip(batch, hashes[start:start + batch_size])
+            ])
+            # bulk_create سیگنال post_save نمی‌فرستد، پس پروفایل‌ها هم مستقیماً ساخته می‌شوند
+            if users and users[0].pk is None:
+                ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+            UserProfile.objects.bulk_create([
+                UserProfile(
+                    user=user,
+                    user_type=data['user_type'],
+                    region=data['region'],
+                    allowed_storage=(data['allowed_storage_gb'] or 0) * 1024 * 1024 * 1024,
+                    field=data['field'] or None,
+                )
+                for user, data in zip(users, batch)
+            ])
+            created += len(users)
+        # پروفایل‌ها بدون سیگنال ساخته شدند، پس بخش‌های کش‌شده دستی باطل می‌شوند
+        fragments.invalidate([fragments.ADMIN_KEY])
+    return created
+
+
+def import_users(stream, file_format, workers=None, batch_size=USER_IMPORT_BATCH_SIZE, skip_invalid=False,
+                 processes=False):
+    valid, errors = validate_rows(read_rows(stream, file_format))
+    if errors and not skip_invalid:
+        return 0, errors
+    return create_users(valid, workers, batch_size, processes), errors
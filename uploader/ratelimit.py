@@ -0,0 +1,172 @@
+import functools
+import math
+import random
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+# کنترل پذیرش درخواست‌های آپلود (صدور لینک و ثبت فایل) با کش مشترک، تا نزدیک مهلت ارسال درخواست‌های
+# اضافه سریع با 429 رد شوند و در صف دیتابیس و S3 منتظر نمانند (UPLOAD_RATE_LIMIT در settings)
+USER_BUCKET_KEY = 'uploader:ratelimit:user:{}'
+GLOBAL_BUCKET_KEY = 'uploader:ratelimit:global'
+# هر درخواست در جریان یکی از in_flight خانه را با کلید جدا و TTL خودش می‌گیرد؛ منقضی شدن یک خانه
+# فقط همان خانه را آزاد می‌کند و شمارنده مشترکی نیست که با decr بعدی از صفر پایین‌تر برود
+IN_FLIGHT_KEY = 'uploader:ratelimit:in_flight:{}'
+STATS_KEY = 'uploader:ratelimit:stats:{}'
+STATS = ('admitted', 'rejected_user', 'rejected_global', 'rejected_in_flight')
+# اگر پروسه‌ای وسط درخواست از بین برود، خانه‌اش حداکثر تا این مدت گرفته می‌ماند
+IN_FLIGHT_TIMEOUT = 60
+
+
+def _interval(rate):
+    return max(1, round(1000 / rate))
+
+
+def _take(key, rate, burst):
+    # token bucket به شکل GCRA: کلید، زمان نظری درخواست بعدی (TAT) به میلی‌ثانیه است و هر درخواست
+    # آن را یک فاصله جلو می‌برد؛ با incr اتمیک، بدون قفل بین پروسه‌ها. خروجی: ثانیه‌های انتظار یا 0
+    interval = _interval(rate)
+    now = int(time.time() * 1000)
+    if cache.add(key, now + interval, math.ceil(interval / 1000) + 1):
+        return 0
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        tat = 0
+    if tat < now + interval:
+        # سطل پر بوده است؛ TAT به اکنون منتقل می‌شود. در رقابت هم‌زمان ممکن است یکی دو درخواست بیشتر
+        # پذیرفته شوند، ولی هیچ درخواستی بی‌جهت رد نمی‌شود
+        tat = now + interval
+        cache.set(key, tat, math.ceil(interval / 1000) + 1)
+        return 0
+    if tat - now > burst * interval:
+        _refund(key, interval)
+        return (tat - now - burst * interval) / 1000
+    cache.touch(key, math.ceil((tat - now) / 1000) + 1)
+    return 0
+
+
+def _refund(key, interval):
+    try:
+        cache.decr(key, interval)
+    except ValueError:
+        pass
+
+
+def _count(name):
+    key = STATS_KEY.format(name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def _in_flight_keys(limit):
+    return [IN_FLIGHT_KEY.format(slot) for slot in range(limit)]
+
+
+def _acquire_slot(limit):
+    # یک get_many برای پیدا کردن خانه‌های خالی و add اتمیک برای گرفتن یکی از آن‌ها؛ خروجی: (کلید، شناسه) یا None
+    keys = _in_flight_keys(limit)
+    taken = cache.get_many(keys)
+    free = [key for key in keys if key not in taken]
+    random.shuffle(free)
+    owner = uuid.uuid4().hex
+    for key in free:
+        if cache.add(key, owner, IN_FLIGHT_TIMEOUT):
+            return key, owner
+    return None
+
+
+def _release(slot):
+    # اگر خانه منقضی شده و درخواست دیگری آن را گرفته باشد، آزاد نمی‌شود
+    key, owner = slot
+    if cache.get(key) == owner:
+        cache.delete(key)
+
+
+def _admit(user_id):
+    # خروجی: (ثانیه انتظار یا 0، خانه گرفته‌شده در سقف درخواست‌های هم‌زمان یا None)
+    limits = settings.UPLOAD_RATE_LIMIT
+    if not limits:
+        return 0, None
+
+    user_limit, global_limit = limits.get('user'), limits.get('global')
+    if user_limit:
+        wait = _take(USER_BUCKET_KEY.format(user_id), *user_limit)
+        if wait:
+            _count('rejected_user')
+            return wait, None
+    if global_limit:
+        wait = _take(GLOBAL_BUCKET_KEY, *global_limit)
+        if wait:
+            # درخواست رد شده نباید از سهم کاربر کم کند
+            if user_limit:
+                _refund(USER_BUCKET_KEY.format(user_id), _interval(user_limit[0]))
+            _count('rejected_global')
+            return wait, None
+
+    slot = None
+    if limits.get('in_flight'):
+        slot = _acquire_slot(limits['in_flight'])
+        if slot is None:
+            # رد به خاطر سقف هم‌زمانی هم از سهم کاربر و سهم کل کم نمی‌کند
+            if user_limit:
+                _refund(USER_BUCKET_KEY.format(user_id), _interval(user_limit[0]))
+            if global_limit:
+                _refund(GLOBAL_BUCKET_KEY, _interval(global_limit[0]))
+            _count('rejected_in_flight')
+            return 1, None
+    _count('admitted')
+    return 0, slot
+
+
+def _too_many_requests(wait):
+    response = JsonResponse(
+        {'error': 'تعداد درخواست‌ها زیاد است؛ چند ثانیه دیگر دوباره تلاش کنید'}, status=429
+    )
+    response['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def rate_limited(view):
+    # بعد از login_required استفاده شود؛ برای ویوهای sync و async
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            wait, slot = await sync_to_async(_admit)(user.id)
+            if wait:
+                return _too_many_requests(wait)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                if slot:
+                    await sync_to_async(_release)(slot)
+        return wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        wait, slot = _admit(request.user.id)
+        if wait:
+            return _too_many_requests(wait)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            if slot:
+                _release(slot)
+    return wrapper
+
+
+def limiter_stats():
+    limit = (settings.UPLOAD_RATE_LIMIT or {}).get('in_flight') or 0
+    slots = _in_flight_keys(limit)
+    values = cache.get_many([STATS_KEY.format(name) for name in STATS] + slots)
+    stats = {name: values.get(STATS_KEY.format(name), 0) for name in STATS}
+    stats['in_flight'] = sum(1 for key in slots if key in values)
+    return stats
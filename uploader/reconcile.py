@@ -0,0 +1,77 @@
+from collections import defaultdict, namedtuple
+
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, Value, When
+from django.db.models.functions import Collate
+
+from . import fragments, storage
+from .models import UploadedFile, apply_storage_deltas, discard_field_manifests
+
+# kind یکی از missing (ردیف بدون شیء)، orphan (شیء بدون ردیف) و size_mismatch است
+Discrepancy = namedtuple('Discrepancy', 'kind file_key file_id user_id db_size bucket_size last_modified')
+
+
+def iter_bucket_objects(prefix='', page_size=1000):
+    paginator = storage.get_s3_client().get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=storage.bucket_name(), Prefix=prefix, PaginationConfig={'PageSize': page_size})
+    for page in pages:
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['Size'], obj['LastModified']
+
+
+def iter_db_files(prefix='', chunk_size=2000):
+    files = UploadedFile.objects.all()
+    if prefix:
+        files = files.filter(file_key__startswith=prefix)
+    # S3 کلیدها را بر اساس بایت‌های UTF-8 مرتب می‌کند؛ collation پیش‌فرض PostgreSQL ممکن است متفاوت باشد
+    order = Collate('file_key', 'C') if connection.vendor == 'postgresql' else 'file_key'
+    return files.order_by(order, 'id').values_list('id', 'file_key', 'size', 'user_id').iterator(chunk_size=chunk_size)
+
+
+def reconcile(prefix='', page_size=1000, chunk_size=2000):
+    # merge join دو جریان مرتب؛ در هر لحظه فقط یک صفحه از bucket و یک chunk از دیتابیس در حافظه است
+    objects = iter_bucket_objects(prefix, page_size)
+    rows = iter_db_files(prefix, chunk_size)
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj is not None or row is not None:
+        if row is None or (obj is not None and obj[0] < row[1]):
+            yield Discrepancy('orphan', obj[0], None, None, None, obj[1], obj[2])
+            obj = next(objects, None)
+        elif obj is None or row[1] < obj[0]:
+            yield Discrepancy('missing', row[1], row[0], row[3], row[2], None, None)
+            row = next(rows, None)
+        else:
+            # ممکن است چند ردیف به یک کلید اشاره کنند
+            while row is not None and row[1] == obj[0]:
+                if row[2] != obj[1]:
+                    yield Discrepancy('size_mismatch', row[1], row[0], row[3], row[2], obj[1], obj[2])
+                row = next(rows, None)
+            obj = next(objects, None)
+
+
+def fix_sizes(mismatches):
+    # اندازه ردیف‌ها با اندازه واقعی S3 یکی می‌شود و used_storage هم به همان اندازه اصلاح می‌شود
+    if not mismatches:
+        return
+    deltas = defaultdict(int)
+    for item in mismatches:
+        deltas[item.user_id] += item.bucket_size - item.db_size
+    with transaction.atomic():
+        files = UploadedFile.objects.filter(id__in=[item.file_id for item in mismatches])
+        owners = list(files.values_list('user_id', 'field'))
+        files.update(size=Case(
+            *[When(id=item.file_id, then=Value(item.bucket_size)) for item in mismatches],
+            output_field=BigIntegerField(),
+        ))
+        apply_storage_deltas(deltas)
+        # UPDATE گروهی سیگنال ندارد؛ بخش‌های کش‌شده و مانیفست رشته‌های این فایل‌ها دستی باطل می‌شوند
+        keys = set()
+        for user_id, _ in owners:
+            keys |= fragments.user_keys(user_id)
+        fragments.invalidate(keys)
+        discard_field_manifests({field for _, field in owners})
+
+
+def delete_orphans(orphans):
+    return storage.delete_objects([item.file_key for item in orphans])
@@ -0,0 +1,231 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import register_s3_hooks
+
+DELETE_OBJECTS_BATCH_SIZE = 1000
+
+DOWNLOAD_URL_SCOPES = ('owner', 'admin', 'manager')
+DOWNLOAD_URL_CACHE_KEY = 'uploader:download-url:{}:{}'
+DOWNLOAD_URL_STATS_KEY = 'uploader:download-url-stats:{}'
+
+# کلاینت boto3 thread-safe است؛ پس هر پروسه فقط یک کلاینت با pool اتصال مشترک می‌سازد
+# و دیگر برای هر درخواست مدل سرویس، session و اتصال TLS از نو ساخته نمی‌شود.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _build_client():
+    config = Config(
+        signature_version='s3v4',
+        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings.AWS_S3_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_S3_READ_TIMEOUT,
+        tcp_keepalive=True,
+        # max_attempts در botocore تعداد تلاش‌های مجدد است؛ total_max_attempts درخواست اول را هم می‌شمارد
+        retries={'total_max_attempts': settings.AWS_S3_MAX_ATTEMPTS, 'mode': 'standard'},
+    )
+    # Session خود boto3 thread-safe نیست، برای همین زیر قفل و جداگانه ساخته می‌شود
+    session = boto3.session.Session()
+    client = session.client(
+        's3',
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL or None,
+        region_name=settings.AWS_S3_REGION_NAME or 'us-east-1',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        config=config,
+    )
+    register_s3_hooks(client)
+    return client
+
+
+def get_s3_client():
+    global _client, _client_pid
+    pid = os.getpid()
+    # بعد از fork، پروسه فرزند نباید از اتصال‌های پروسه والد استفاده کند
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = _build_client()
+                _client_pid = pid
+    return _client
+
+
+def reset_s3_client():
+    global _client, _client_pid
+    with _client_lock:
+        _client = None
+        _client_pid = None
+
+
+def install_s3_client(client):
+    # جایگزینی کلاینت همین پروسه، مثلاً با LocalS3Client برای benchmark؛ reset_s3_client آن را برمی‌گرداند
+    global _client, _client_pid
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    if setting.startswith('AWS_'):
+        reset_s3_client()
+
+
+def bucket_name():
+    return settings.AWS_STORAGE_BUCKET_NAME
+
+
+def presigned_upload_url(file_key, expires_in=3600, content_length=None):
+    params = {'Bucket': bucket_name(), 'Key': file_key}
+    # Content-Length جزو سرآیندهای امضاشده می‌شود و S3 بدنه‌ای با اندازه دیگر را با این لینک نمی‌پذیرد
+    if content_length is not None:
+        params['ContentLength'] = content_length
+    return get_s3_client().generate_presigned_url('put_object', Params=params, ExpiresIn=expires_in)
+
+
+def presigned_download_url(file_key, expires_in=3600):
+    return get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket_name(), 'Key': file_key},
+        ExpiresIn=expires_in
+    )
+
+
+def cached_download_url(file_id, file_key, scope):
+    # لینک امضاشده برای هر (فایل، سطح دسترسی) کش می‌شود؛ TTL کش از ExpiresIn کوتاه‌تر است
+    # تا لینکی که از کش برمی‌گردد هنوز دست‌کم چند دقیقه اعتبار داشته باشد
+    cache_key = DOWNLOAD_URL_CACHE_KEY.format(file_id, scope)
+    url = cache.get(cache_key)
+    hit = url is not None
+    if not hit:
+        url = presigned_download_url(file_key, expires_in=settings.DOWNLOAD_URL_EXPIRES_IN)
+        cache.set(cache_key, url, settings.DOWNLOAD_URL_CACHE_TTL)
+    _count_download_url(hit)
+    return url, hit
+
+
+def _count_download_url(hit):
+    stats_key = DOWNLOAD_URL_STATS_KEY.format('hits' if hit else 'misses')
+    cache.add(stats_key, 0, None)
+    try:
+        cache.incr(stats_key)
+    except ValueError:
+        pass
+
+
+def download_url_hit_rate():
+    stats = cache.get_many([DOWNLOAD_URL_STATS_KEY.format('hits'), DOWNLOAD_URL_STATS_KEY.format('misses')])
+    hits = stats.get(DOWNLOAD_URL_STATS_KEY.format('hits'), 0)
+    total = hits + stats.get(DOWNLOAD_URL_STATS_KEY.format('misses'), 0)
+    return hits / total if total else 0.0
+
+
+def evict_download_urls(file_ids):
+    cache.delete_many([DOWNLOAD_URL_CACHE_KEY.format(file_id, scope)
+                       for file_id in file_ids for scope in DOWNLOAD_URL_SCOPES])
+
+
+def object_size(file_key):
+    return get_s3_client().head_object(Bucket=bucket_name(), Key=file_key)['ContentLength']
+
+
+def object_sizes(file_keys):
+    # head_object چند کلید به صورت هم‌زمان روی کلاینت مشترک؛ خروجی: کلید ← اندازه
+    file_keys = list(file_keys)
+    if len(file_keys) == 1:
+        return {file_keys[0]: object_size(file_keys[0])}
+    with ThreadPoolExecutor(max_workers=min(len(file_keys), settings.AWS_S3_MAX_POOL_CONNECTIONS)) as executor:
+        return dict(zip(file_keys, executor.map(object_size, file_keys)))
+
+
+def delete_object(file_key):
+    get_s3_client().delete_object(Bucket=bucket_name(), Key=file_key)
+
+
+def delete_objects(file_keys):
+    # حذف گروهی با DeleteObjects (حداکثر ۱۰۰۰ کلید در هر درخواست)؛ خروجی: کلید ← پیام خطا
+    s3_client = get_s3_client()
+    file_keys = list(file_keys)
+    failed = {}
+    for start in range(0, len(file_keys), DELETE_OBJECTS_BATCH_SIZE):
+        batch = file_keys[start:start + DELETE_OBJECTS_BATCH_SIZE]
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket_name(),
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except (BotoCoreError, ClientError) as e:
+            failed.update((key, str(e)) for key in batch)
+            continue
+        for error in response.get('Errors', []):
+            failed[error['Key']] = error.get('Message') or error.get('Code', '')
+    return failed
+
+
+def create_multipart_upload(file_key, content_type):
+    response = get_s3_client().create_multipart_upload(
+        Bucket=bucket_name(),
+        Key=file_key,
+        ContentType=content_type
+    )
+    return response['UploadId']
+
+
+def presigned_part_urls(file_key, upload_id, part_numbers, expires_in=3600):
+    s3_client = get_s3_client()
+    return {
+        n: s3_client.generate_presigned_url(
+            'upload_part',
+            Params={
+                'Bucket': bucket_name(),
+                'Key': file_key,
+                'UploadId': upload_id,
+                'PartNumber': n,
+            },
+            ExpiresIn=expires_in
+        )
+        for n in part_numbers
+    }
+
+
+def list_parts(file_key, upload_id):
+    s3_client = get_s3_client()
+    parts = []
+    marker = 0
+    while True:
+        response = s3_client.list_parts(
+            Bucket=bucket_name(),
+            Key=file_key,
+            UploadId=upload_id,
+            PartNumberMarker=marker
+        )
+        parts.extend(response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return parts
+        marker = response['NextPartNumberMarker']
+
+
+def complete_multipart_upload(file_key, upload_id, parts):
+    s3_client = get_s3_client()
+    s3_client.complete_multipart_upload(
+        Bucket=bucket_name(),
+        Key=file_key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts]}
+    )
+    return object_size(file_key)
+
+
+def abort_multipart_upload(file_key, upload_id):
+    get_s3_client().abort_multipart_upload(Bucket=bucket_name(), Key=file_key, UploadId=upload_id)
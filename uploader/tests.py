@@ -1,3 +1,1531 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from urllib.parse import quote_plus
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from botocore.exceptions import EndpointConnectionError
+from botocore.stub import Stubber
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+
+from . import fragments, metrics, ratelimit, storage
+from . import phase as phase_module
+from . import urls as uploader_urls
+from .benchmark import ENDPOINTS, run_benchmark
+from .bundle import iter_bundle_entries, stream_zip
+from .local_s3 import LocalS3Client
+from .deletion import delete_files
+from .ingest import issue_upload_tokens
+from .models import FieldManifest, PendingObjectDeletion, Phase, UploadedFile, UploadToken, UserProfile
+from .manifest import get_field_manifest
+from .phase import get_current_phase, invalidate_phase_cache
+from .provisioning import import_users
+
+
+@override_settings(AWS_ACCESS_KEY_ID='key', AWS_SECRET_ACCESS_KEY='secret', AWS_S3_ENDPOINT_URL='http://s3.local',
+                   AWS_S3_MAX_POOL_CONNECTIONS=7, AWS_S3_MAX_ATTEMPTS=3)
+class S3ClientTests(SimpleTestCase):
+    def setUp(self):
+        storage.reset_s3_client()
+        self.addCleanup(storage.reset_s3_client)
+
+    def test_one_configured_client_per_process(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: storage.get_s3_client(), range(32)))
+        client = clients[0]
+        self.assertTrue(all(other is client for other in clients))
+        config = client.meta.config
+        self.assertEqual(config.max_pool_connections, 7)
+        self.assertEqual(config.retries, {'total_max_attempts': 3, 'mode': 'standard'})
+        self.assertEqual(client.meta.endpoint_url, 'http://s3.local')
+
+    def test_client_is_rebuilt_after_fork_and_setting_change(self):
+        client = storage.get_s3_client()
+        # پروسه فرزند (pid دیگر) نباید pool اتصال والد را به ارث ببرد
+        with mock.patch('uploader.storage.os.getpid', return_value=os.getpid() + 1):
+            child = storage.get_s3_client()
+            self.assertIsNot(child, client)
+            self.assertIs(storage.get_s3_client(), child)
+
+        with self.settings(AWS_S3_ENDPOINT_URL='http://other.local'):
+            self.assertEqual(storage.get_s3_client().meta.endpoint_url, 'http://other.local')
+
+@override_settings(PHASE_CACHE_CHECK_INTERVAL=5)
+class PhaseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        self.now = 1000.0
+        patcher = mock.patch('uploader.phase.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        invalidate_phase_cache()
+
+    def test_flip_is_published_after_commit_and_seen_within_interval(self):
+        self.assertTrue(get_current_phase())
+        # حافظه پروسه دیگری که فاز را همین حالا خوانده است
+        other_process = phase_module._local
+        with self.assertNumQueries(0):
+            self.assertTrue(get_current_phase())
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Phase.objects.create(is_phase_one=False)
+            # تا commit نسخه مشترک عوض نمی‌شود و مقدار قدیمی با نسخه جدید کش نمی‌شود
+            phase_module._local, local = other_process, phase_module._local
+            self.now += 10
+            self.assertTrue(get_current_phase())
+            phase_module._local = local
+        for callback in callbacks:
+            callback()
+
+        # همین پروسه تغییر را بلافاصله می‌بیند و مقدار جدید را در کش مشترک می‌گذارد
+        self.assertFalse(get_current_phase())
+        # پروسه دیگر که همین حالا نسخه را بررسی کرده، حداکثر تا پایان بازه مقدار قدیمی را می‌بیند
+        phase_module._local = other_process[:2] + (self.now,)
+        self.now += 1
+        self.assertTrue(get_current_phase())
+        self.now += 5
+        with self.assertNumQueries(0):
+            self.assertFalse(get_current_phase())
+
+
+class RecomputeUsedStorageTests(TestCase):
+    def test_counters_are_rebuilt_from_file_sizes(self):
+        student = User.objects.create(username='student')
+        other = User.objects.create(username='other')
+        empty = User.objects.create(username='empty')
+        UploadedFile.objects.create(user=student, file_key='a.pdf', field='Coding', size=10)
+        UploadedFile.objects.create(user=student, file_key='b.pdf', field='Astronomy', size=20)
+        UploadedFile.objects.create(user=other, file_key='c.pdf', field='Coding', size=5)
+        UserProfile.objects.filter(user=student).update(used_storage=999)
+        UserProfile.objects.filter(user=empty).update(used_storage=42)
+
+        out = StringIO()
+        call_command('recompute_used_storage', '--dry-run', stdout=out)
+        self.assertIn('2 counter(s) out of sync.', out.getvalue())
+        self.assertEqual(UserProfile.objects.get(user=student).used_storage, 999)
+
+        out = StringIO()
+        call_command('recompute_used_storage', stdout=out)
+        self.assertIn('student: 999 -> 30', out.getvalue())
+        self.assertIn('Repaired 2 counter(s).', out.getvalue())
+        self.assertEqual(
+            dict(UserProfile.objects.values_list('user__username', 'used_storage')),
+            {'student': 30, 'other': 5, 'empty': 0},
+        )
+
+
+class ReconcileStorageTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create(username='student')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=10 ** 6)
+        old = datetime.now(timezone.utc) - timedelta(days=2)
+        self.s3.put('a/ok.pdf', b'x' * 10)
+        self.s3.put('b/resized.pdf', b'x' * 30)
+        self.s3.put('c/orphan-old.zip', b'x' * 5, last_modified=old)
+        self.s3.put('d/orphan-new.zip', b'x' * 5)
+        UploadedFile.objects.create(user=self.user, file_key='a/ok.pdf', field='Coding', size=10)
+        UploadedFile.objects.create(user=self.user, file_key='b/resized.pdf', field='Astronomy', size=20)
+        UploadedFile.objects.create(user=self.user, file_key='e/missing.pdf', field='StemCells', size=7)
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_storage', '--page-size', '2', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_reports_discrepancies_across_pages(self):
+        output = self.reconcile()
+
+        self.assertIn('missing=1 orphans=2 size_mismatches=1', output)
+        self.assertIn('missing\te/missing.pdf', output)
+        self.assertIn('size_mismatch\tb/resized.pdf', output)
+        self.assertEqual(self.s3.calls['list_objects_v2'], 2)
+        self.assertEqual(UploadedFile.objects.get(file_key='b/resized.pdf').size, 20)
+
+    def test_fix_sizes_updates_rows_and_usage(self):
+        self.reconcile('--fix-sizes')
+
+        self.assertEqual(UploadedFile.objects.get(file_key='b/resized.pdf').size, 30)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 10 + 30 + 7)
+
+    def test_fix_sizes_refreshes_manifests_and_fragments(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        UserProfile.objects.filter(user=self.user).update(region='RaziAbdi')
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=False)
+        home, admin = fragments.home_version(self.user.id), fragments.admin_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reconcile('--fix-sizes')
+
+        self.assertEqual(get_field_manifest('Astronomy').total_size, 30)
+        self.assertEqual(FieldManifest.objects.get(field='Coding').total_size, 10)
+        self.assertNotEqual(fragments.home_version(self.user.id), home)
+        self.assertNotEqual(fragments.admin_version(), admin)
+
+    def test_delete_orphans_skips_recent_objects(self):
+        output = self.reconcile('--delete-orphans')
+
+        self.assertIn('orphans_deleted=1', output)
+        self.assertNotIn('c/orphan-old.zip', self.s3.objects)
+        self.assertIn('d/orphan-new.zip', self.s3.objects)
+
+
+
+class MigrationTestCase(TransactionTestCase):
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+class FileKeyMigrationTests(MigrationTestCase):
+    def test_stored_paths_become_file_keys(self):
+        apps = self.migrate([('uploader', '0001_initial')])
+        user = apps.get_model('auth', 'User').objects.create(username='student')
+        apps.get_model('uploader', 'UserProfile').objects.create(user=user)
+        apps.get_model('uploader', 'UploadedFile').objects.create(
+            user=user, file='uploads/2024/01/02/a.pdf', field='Coding', size=10,
+        )
+
+        apps = self.migrate([('uploader', '0002_uploadedfile_file_key_userprofile_used_storage')])
+
+        file = apps.get_model('uploader', 'UploadedFile').objects.get()
+        self.assertEqual(file.file_key, 'uploads/2024/01/02/a.pdf')
+        self.assertEqual(apps.get_model('uploader', 'UserProfile').objects.get(user_id=user.id).used_storage, 10)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked against SQLite output')
+class IndexMigrationTests(MigrationTestCase):
+    migrate_from = [('uploader', '0003_pendingobjectdeletion')]
+    migrate_to = [('uploader', '0004_uploader_indexes_one_file_per_field')]
+
+    def plans(self, apps):
+        UploadedFile = apps.get_model('uploader', 'UploadedFile')
+        UserProfile = apps.get_model('uploader', 'UserProfile')
+        return {
+            'file_field': UploadedFile.objects.filter(field='Coding').explain(),
+            'user_field': UploadedFile.objects.filter(user_id=1, field='Coding').explain(),
+            'profile_region': UserProfile.objects.filter(region='RaziAbdi').explain(),
+            'profile_type': UserProfile.objects.filter(user_type='FieldManager').explain(),
+            'profile_field': UserProfile.objects.filter(field='Coding').explain(),
+        }
+
+    def test_dashboard_filters_use_indexes_after_migration(self):
+        before = self.plans(self.migrate(self.migrate_from))
+        after = self.plans(self.migrate(self.migrate_to))
+
+        for name in ('file_field', 'profile_region', 'profile_type', 'profile_field'):
+            self.assertIn('SCAN', before[name])
+            self.assertIn('USING INDEX', after[name])
+        self.assertIn('uploader_file_field_idx', after['file_field'])
+        self.assertIn('uploader_profile_region_idx', after['profile_region'])
+        self.assertNotIn('user_id=? AND field=?', before['user_field'])
+        self.assertIn('user_id=? AND field=?', after['user_field'])
+
+    def test_duplicates_are_removed_before_constraint(self):
+        apps = self.migrate(self.migrate_from)
+        UploadedFile = apps.get_model('uploader', 'UploadedFile')
+        UserProfile = apps.get_model('uploader', 'UserProfile')
+        user = apps.get_model('auth', 'User').objects.create(username='student')
+        UserProfile.objects.create(user=user, used_storage=10 + 20 + 30)
+        kept = UploadedFile.objects.create(user=user, file_key='a.pdf', field='Coding', size=10)
+        UploadedFile.objects.create(user=user, file_key='b.pdf', field='Coding', size=20)
+        UploadedFile.objects.create(user=user, file_key='a.pdf', field='Coding', size=30)
+
+        apps = self.migrate(self.migrate_to)
+
+        UploadedFile = apps.get_model('uploader', 'UploadedFile')
+        self.assertEqual(list(UploadedFile.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(apps.get_model('uploader', 'UserProfile').objects.get(user_id=user.id).used_storage, 10)
+        self.assertEqual(
+            list(apps.get_model('uploader', 'PendingObjectDeletion').objects.values_list('file_key', flat=True)),
+            ['b.pdf'],
+        )
+
+
+def put_upload(s3, user, field, size, file_name='a.pdf'):
+    # لینک آپلود (توکن) صادر و شیء با اندازه داده‌شده در S3 محلی نوشته می‌شود
+    file_key, = issue_upload_tokens(user, [{'field': field, 'size': size, 'file_name': file_name}])
+    s3.put(file_key, b'x' * size)
+    return file_key
+
+
+class SaveFileMetadataTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=1000)
+        self.client.force_login(self.user)
+
+    def test_concurrent_duplicate_is_rejected_by_constraint(self):
+        UploadedFile.objects.create(user=self.user, file_key='first.pdf', field='Coding', size=100)
+        file_key = put_upload(self.s3, self.user, 'Coding', 200, 'second.pdf')
+        # شبیه‌سازی درخواستی که بررسی exists را قبل از ثبت فایل اول گذرانده است
+        with mock.patch('uploader.views._validate_upload', return_value=None):
+            response = self.client.post(reverse('save_file_metadata'), {'file_key': file_key, 'field': 'Coding'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadedFile.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 100)
+
+    def test_non_positive_size_cannot_lower_usage(self):
+        # اندازه از head_object خوانده می‌شود؛ size ارسالی نادیده گرفته می‌شود
+        file_key = put_upload(self.s3, self.user, 'Coding', 0)
+        for size in ('-100000', '0'):
+            response = self.client.post(reverse('save_file_metadata'),
+                                        {'file_key': file_key, 'field': 'Coding', 'size': size})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('generate_upload_url'),
+                                    {'file_name': 'a.pdf', 'field': 'Coding', 'size': '-5'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 0)
+
+        # حتی اگر اعتبارسنجی ویو دور زده شود، رزرو سهمیه اندازه منفی را نمی‌پذیرد
+        with self.assertRaises(ValueError):
+            UploadedFile.objects.create_within_quota(user=self.user, file_key='a.pdf', field='Coding', size=-5)
+        with self.assertRaises(ValueError):
+            UploadedFile.objects.bulk_create_within_quota(
+                self.user, [{'file_key': 'a.pdf', 'field': 'Coding', 'size': 100},
+                            {'file_key': 'b.pdf', 'field': 'Astronomy', 'size': -100}])
+        file_key = put_upload(self.s3, self.user, 'Coding', 1500, 'big.pdf')
+        response = self.client.post(reverse('save_file_metadata'),
+                                    {'file_key': file_key, 'field': 'Coding', 'size': '100'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 0)
+
+    def test_only_issued_keys_are_recorded_with_size_from_storage(self):
+        other = User.objects.create_user(username='other', password='secret')
+        theirs = put_upload(self.s3, other, 'Coding', 10)
+        astronomy = put_upload(self.s3, self.user, 'Astronomy', 10)
+        missing, = issue_upload_tokens(self.user, [{'field': 'Coding', 'size': 10, 'file_name': 'a.pdf'}])
+        self.s3.put('raw.pdf', b'x' * 10)
+        # کلید کاربر دیگر، کلید رشته دیگر، شیء آپلودنشده و کلید بدون توکن
+        for file_key in (theirs, astronomy, missing, 'raw.pdf'):
+            response = self.client.post(reverse('save_file_metadata'), {'file_key': file_key, 'field': 'Coding'})
+            self.assertEqual(response.status_code, 400)
+
+        UploadToken.objects.filter(file_key=astronomy).update(created_at=datetime.now(timezone.utc) - timedelta(days=8))
+        response = self.client.post(reverse('save_file_metadata'), {'file_key': astronomy, 'field': 'Astronomy'})
+        self.assertEqual(response.status_code, 400)
+
+        file_key = put_upload(self.s3, self.user, 'Coding', 300)
+        response = self.client.post(reverse('save_file_metadata'),
+                                    {'file_key': file_key, 'field': 'Coding', 'size': '1'})
+        self.assertEqual(response.json(), {'success': True})
+        self.assertEqual(UploadedFile.objects.get(user=self.user).size, 300)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 300)
+        self.assertFalse(UploadToken.objects.filter(file_key=file_key).exists())
+
+
+class MultipartUploadTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='student', password='secret')
+        self.size = 9 * 1024 * 1024
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=self.size + 100)
+        self.client.force_login(self.user)
+
+    def start(self):
+        response = self.client.post(reverse('create_multipart_upload'), {
+            'file_name': 'big.zip', 'file_type': 'application/zip', 'field': 'Coding', 'size': str(self.size),
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def upload_part(self, upload, number, size):
+        # مرورگر بخش را با PUT روی لینک امضاشده می‌فرستد؛ اینجا مستقیم در S3 محلی نوشته می‌شود
+        self.s3.upload_part(Bucket='', Key=upload['file_key'], UploadId=upload['upload_id'],
+                            PartNumber=number, Body=b'x' * size)
+
+    def complete(self, upload):
+        return self.client.post(reverse('complete_multipart_upload'), {'upload_id': upload['upload_id']})
+
+    def test_resumable_upload_reports_size_from_head_object(self):
+        upload = self.start()
+        self.assertEqual((upload['part_size'], upload['part_count']), (8 * 1024 * 1024, 2))
+
+        response = self.client.post(reverse('presign_upload_parts'),
+                                    {'upload_id': upload['upload_id'], 'part_numbers': '1,2'})
+        self.assertEqual(sorted(response.json()['urls']), ['1', '2'])
+        response = self.client.post(reverse('presign_upload_parts'),
+                                    {'upload_id': upload['upload_id'], 'part_numbers': '3'})
+        self.assertEqual(response.status_code, 400)
+
+        self.upload_part(upload, 1, upload['part_size'])
+        self.assertEqual(self.complete(upload).status_code, 400)
+        # ادامه آپلود بعد از قطع شدن: بخش‌های رسیده از S3 خوانده می‌شوند
+        response = self.client.get(reverse('list_uploaded_parts'), {'upload_id': upload['upload_id']})
+        self.assertEqual(response.json()['parts'], [{'part_number': 1, 'size': upload['part_size']}])
+
+        # بخش آخر از اندازه اعلام‌شده کوچک‌تر است؛ اندازه نهایی همان است که head_object برمی‌گرداند
+        self.upload_part(upload, 2, 1000)
+        with mock.patch.object(self.s3, 'head_object', wraps=self.s3.head_object) as head_object:
+            response = self.complete(upload)
+        head_object.assert_called_once()
+        self.assertEqual(response.json(), {
+            'file_key': upload['file_key'], 'field': 'Coding', 'size': upload['part_size'] + 1000,
+        })
+        self.assertEqual(len(self.s3.objects[upload['file_key']][0]), upload['part_size'] + 1000)
+        # upload_id بعد از تکمیل از نشست حذف شده است
+        self.assertEqual(self.complete(upload).status_code, 404)
+
+    def test_complete_rejects_object_larger_than_quota(self):
+        upload = self.start()
+        # upload_id فقط در نشست همان کاربر معتبر است
+        other = Client()
+        other.force_login(User.objects.create_user(username='other', password='secret'))
+        response = other.post(reverse('complete_multipart_upload'), {'upload_id': upload['upload_id']})
+        self.assertEqual(response.status_code, 404)
+
+        self.upload_part(upload, 1, upload['part_size'])
+        self.upload_part(upload, 2, self.size)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(PendingObjectDeletion.objects.values_list('file_key', flat=True)), [upload['file_key']])
+        self.assertFalse(UploadToken.objects.exists())
+        self.assertFalse(UploadedFile.objects.exists())
+
+    @override_settings(S3_WEBHOOK_TOKEN='webhook-secret', AWS_STORAGE_BUCKET_NAME='uploads')
+    def test_complete_after_webhook_does_not_count_twice(self):
+        upload = self.start()
+        self.upload_part(upload, 1, upload['part_size'])
+        self.upload_part(upload, 2, 1000)
+        size = upload['part_size'] + 1000
+        # رویداد ObjectCreated پیش از پاسخ complete_multipart_upload می‌رسد
+        records = [{'eventName': 's3:ObjectCreated:CompleteMultipartUpload',
+                    's3': {'bucket': {'name': 'uploads'}, 'object': {'key': quote_plus(upload['file_key']), 'size': size}}}]
+        Client().post(reverse('s3_events'), json.dumps({'Records': records}),
+                      content_type='application/json', HTTP_AUTHORIZATION='Bearer webhook-secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=size)
+
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, size)
+        self.assertTrue(UploadedFile.objects.filter(file_key=upload['file_key']).exists())
+        self.assertFalse(PendingObjectDeletion.objects.exists())
+
+
+class BatchUploadTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=1000)
+        self.client.force_login(self.user)
+
+    def post(self, name, files):
+        return self.client.post(reverse(name), json.dumps({'files': files}), content_type='application/json')
+
+    def test_upload_urls_check_quota_of_the_whole_batch(self):
+        files = [{'field': 'Coding', 'file_name': 'a.pdf', 'size': 600},
+                 {'field': 'Astronomy', 'file_name': 'b.pdf', 'size': 300}]
+        response = self.post('batch_upload_urls', files)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([u['field'] for u in response.json()['uploads']], ['Coding', 'Astronomy'])
+
+        files[1]['size'] = 500
+        self.assertEqual(self.post('batch_upload_urls', files).status_code, 400)
+        files[1].update(field='Coding', size=100)
+        self.assertEqual(self.post('batch_upload_urls', files).status_code, 400)
+
+    def test_metadata_is_saved_in_one_insert_or_not_at_all(self):
+        files = [{'field': 'Coding', 'file_key': put_upload(self.s3, self.user, 'Coding', 600)},
+                 {'field': 'Astronomy', 'file_key': put_upload(self.s3, self.user, 'Astronomy', 300)}]
+        # کلید بدون توکن کل دسته را رد می‌کند
+        self.assertEqual(self.post('batch_save_file_metadata', files + [
+            {'field': 'Biotechnology', 'file_key': 'c.pdf'},
+        ]).status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.post('batch_save_file_metadata', files)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UploadedFile.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 900)
+        # bulk_create سیگنال ندارد، پس نسخه بخش‌های کش‌شده دستی عوض می‌شود
+        self.assertEqual(len(callbacks), 1)
+
+        # یکی از رشته‌ها قبلاً ثبت شده است؛ هیچ فایلی از دسته ثبت نمی‌شود
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=10 ** 6)
+        with mock.patch('uploader.views._validate_upload', return_value=None):
+            response = self.post('batch_save_file_metadata', [
+                {'field': 'Biotechnology', 'file_key': put_upload(self.s3, self.user, 'Biotechnology', 10)},
+                {'field': 'Coding', 'file_key': put_upload(self.s3, self.user, 'Coding', 10)},
+            ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadedFile.objects.filter(field='Biotechnology').exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 900)
+
+
+@override_settings(S3_WEBHOOK_TOKEN='webhook-secret', AWS_STORAGE_BUCKET_NAME='uploads')
+class S3EventIngestTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=1000)
+        self.client.force_login(self.user)
+
+    def issue(self, *files):
+        response = self.client.post(reverse('batch_upload_urls'), json.dumps({'files': list(files)}),
+                                    content_type='application/json')
+        return [upload['file_key'] for upload in response.json()['uploads']]
+
+    def deliver(self, sizes, token='webhook-secret'):
+        records = [{'eventName': 's3:ObjectCreated:Put',
+                    's3': {'bucket': {'name': 'uploads'}, 'object': {'key': quote_plus(key), 'size': size}}}
+                   for key, size in sizes.items()]
+        return Client().post(reverse('s3_events'), json.dumps({'Records': records}),
+                             content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_events_record_files_with_reported_size_once(self):
+        coding, astronomy = self.issue({'field': 'Coding', 'file_name': 'my report.pdf', 'size': 100},
+                                       {'field': 'Astronomy', 'file_name': 'b.pdf', 'size': 200})
+        self.assertTrue(coding.endswith('/my report.pdf'))
+        self.assertEqual(self.deliver({coding: 120}, token='wrong').status_code, 403)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.deliver({coding: 120, astronomy: 210, 'legacy.pdf': 5})
+        self.assertEqual(response.json(), {'recorded': 2, 'ignored': 1, 'conflicts': 0, 'over_quota': 0})
+        self.assertEqual(sum('INSERT INTO "uploader_uploadedfile"' in q['sql'] for q in queries), 1)
+        self.assertEqual(dict(UploadedFile.objects.values_list('field', 'size')), {'Coding': 120, 'Astronomy': 210})
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 330)
+
+        # تحویل دوباره رویداد و درخواست اختیاری مرورگر هیچ‌کدام دوباره حساب نمی‌شوند
+        self.assertEqual(self.deliver({coding: 120}).json()['ignored'], 1)
+        response = self.client.post(reverse('save_file_metadata'), {'file_key': coding, 'field': 'Coding', 'size': '100'})
+        self.assertEqual(response.json(), {'success': True})
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 330)
+
+    def test_upload_link_is_bound_to_declared_size(self):
+        response = self.client.post(reverse('batch_upload_urls'), json.dumps({'files': [
+            {'field': 'Coding', 'file_name': 'a.pdf', 'size': 100},
+        ]}), content_type='application/json')
+        self.assertIn('ContentLength=100', response.json()['uploads'][0]['upload_url'])
+        response = self.client.post(reverse('generate_upload_url'), {'file_name': 'b.pdf', 'field': 'Astronomy', 'size': '200'})
+        self.assertIn('ContentLength=200', response.json()['upload_url'])
+
+    def test_reported_size_over_quota_is_not_recorded(self):
+        coding, = self.issue({'field': 'Coding', 'file_name': 'a.pdf', 'size': 400})
+        astronomy, = self.issue({'field': 'Astronomy', 'file_name': 'b.pdf', 'size': 400})
+
+        # اندازه گزارش‌شده از سهمیه (۱۰۰۰) بیشتر است؛ هیچ فایلی از این کاربر ثبت نمی‌شود
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.deliver({coding: 700, astronomy: 400})
+        self.assertEqual(response.json(), {'recorded': 0, 'ignored': 0, 'conflicts': 0, 'over_quota': 2})
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 0)
+        self.assertEqual(set(PendingObjectDeletion.objects.values_list('file_key', flat=True)), {coding, astronomy})
+        self.assertFalse(UploadToken.objects.exists())
+
+        other, = self.issue({'field': 'Biotechnology', 'file_name': 'c.pdf', 'size': 1000})
+        self.assertEqual(self.deliver({other: 1000}).json()['recorded'], 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 1000)
+
+    def test_client_save_before_event_uses_stored_size(self):
+        file_key, = self.issue({'field': 'Coding', 'file_name': 'a.pdf', 'size': 100})
+        self.s3.put(file_key, b'x' * 150)
+        response = self.client.post(reverse('save_file_metadata'), {'file_key': file_key, 'field': 'Coding'})
+        self.assertEqual(response.json(), {'success': True})
+        self.assertFalse(UploadToken.objects.exists())
+
+        # توکن مصرف شده است؛ رویداد دیررس چیزی را دوباره حساب نمی‌کند
+        self.assertEqual(self.deliver({file_key: 150}).json()['ignored'], 1)
+        self.assertEqual(UploadedFile.objects.get(user=self.user).size, 150)
+        self.assertEqual(UserProfile.objects.get(user=self.user).used_storage, 150)
+
+    def test_multipart_items_get_one_token_and_expired_tokens_are_purged(self):
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=10 ** 9)
+        big = 100 * 1024 * 1024
+        response = self.client.post(reverse('batch_upload_urls'), json.dumps({'files': [
+            {'field': 'Coding', 'file_name': 'big.zip', 'size': big},
+            {'field': 'Astronomy', 'file_name': 'b.pdf', 'size': 200},
+        ]}), content_type='application/json')
+        coding, astronomy = response.json()['uploads']
+        # فایل بزرگ با create_multipart_upload ارسال می‌شود و اینجا توکن و لینکی نمی‌گیرد
+        self.assertEqual(coding, {'field': 'Coding', 'multipart': True})
+        self.assertIn('upload_url', astronomy)
+        self.assertEqual(UploadToken.objects.count(), 1)
+
+        upload_id = self.client.post(reverse('create_multipart_upload'), {
+            'file_name': 'big.zip', 'field': 'Coding', 'size': str(big),
+        }).json()['upload_id']
+        self.assertEqual(UploadToken.objects.count(), 2)
+        self.client.post(reverse('abort_multipart_upload'), {'upload_id': upload_id})
+        self.assertEqual(UploadToken.objects.count(), 1)
+
+        # بدون وب‌هوک، توکن‌های منقضی را worker صف حذف پاک می‌کند
+        UploadToken.objects.update(created_at=datetime.now(timezone.utc) - timedelta(days=8))
+        out = StringIO()
+        call_command('process_deletions', '--once', stdout=out)
+        self.assertFalse(UploadToken.objects.exists())
+        self.assertIn('Purged 1 expired upload token(s).', out.getvalue())
+
+
+@override_settings(UPLOAD_RATE_LIMIT={'user': (0.1, 3), 'global': (0.1, 5), 'in_flight': 4})
+class UploadRateLimitTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=LocalS3Client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        self.users = [User.objects.create_user(username=f'student-{i}', password='secret') for i in range(3)]
+
+    def request_url(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.post(reverse('generate_upload_url'), {'file_name': 'a.pdf'})
+
+    def test_user_and_global_buckets_reject_with_retry_after(self):
+        self.assertEqual([self.request_url(self.users[0]).status_code for _ in range(4)], [200, 200, 200, 429])
+        response = self.request_url(self.users[0])
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        # دو درخواست دیگر سقف کل (۵) را پر می‌کند؛ رد سراسری از سهم کاربر کم نمی‌کند
+        self.assertEqual([self.request_url(self.users[1]).status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual(ratelimit.limiter_stats(), {
+            'admitted': 5, 'rejected_user': 2, 'rejected_global': 1, 'rejected_in_flight': 0, 'in_flight': 0,
+        })
+
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin)
+        self.assertContains(self.client.get(reverse('admin_dashboard')), '<td>2</td>')
+
+    def test_in_flight_cap_sheds_requests(self):
+        for slot in range(4):
+            cache.set(ratelimit.IN_FLIGHT_KEY.format(slot), 'other', 60)
+        # بیشتر از ظرفیت سطل کاربر (۳) و سطل کل (۵)؛ درخواست‌های ردشده از هیچ‌کدام کم نمی‌کنند
+        self.assertEqual([self.request_url(self.users[2]).status_code for _ in range(6)], [429] * 6)
+        self.assertEqual(ratelimit.limiter_stats(), {
+            'admitted': 0, 'rejected_user': 0, 'rejected_global': 0, 'rejected_in_flight': 6, 'in_flight': 4,
+        })
+
+        cache.delete(ratelimit.IN_FLIGHT_KEY.format(2))
+        self.assertEqual(self.request_url(self.users[2]).status_code, 200)
+        self.assertEqual(ratelimit.limiter_stats()['in_flight'], 3)
+
+    def test_expired_slot_does_not_skew_the_cap(self):
+        taken = []
+
+        def view(request):
+            # خانه این درخواست وسط اجرا منقضی می‌شود و درخواست دیگری همان را می‌گیرد
+            key, = [key for key in ratelimit._in_flight_keys(4) if cache.get(key)]
+            cache.delete(key)
+            cache.add(key, 'other', 60)
+            taken.append(key)
+            return HttpResponse()
+
+        ratelimit.rate_limited(view)(mock.Mock(user=self.users[0]))
+        # پایان درخواست اول خانه درخواست دوم را آزاد نمی‌کند و شمارش زیر صفر نمی‌رود
+        self.assertEqual(cache.get(taken[0]), 'other')
+        self.assertEqual(ratelimit.limiter_stats()['in_flight'], 1)
+        for _ in range(3):
+            self.assertIsNotNone(ratelimit._acquire_slot(4))
+        self.assertIsNone(ratelimit._acquire_slot(4))
+
+class UserImportTests(TestCase):
+    CSV = (
+        'username,password,user_type,region,allowed_storage_gb,field\n'
+        'ali,Str0ng-pass-123,Normal,RaziAbdi,2,\n'
+        'bad,Str0ng-pass-123,Normal,,2,\n'
+        'ali,Str0ng-pass-123,Normal,RaziAbdi,2,\n'
+        'student,Str0ng-pass-123,Normal,RaziAbdi,2,\n'
+        'sara,Str0ng-pass-456,FieldManager,MollaSadraMahki,,Coding\n'
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        User.objects.create_user(username='student', password='secret')
+
+    def test_invalid_rows_block_or_are_skipped(self):
+        created, errors = import_users(StringIO(self.CSV), 'csv')
+        self.assertEqual(created, 0)
+        # پژوهشسرای خالی، تکرار در فایل و نام کاربری موجود در دیتابیس
+        self.assertEqual([line for line, _ in errors], [2, 3, 4])
+        self.assertIn('تکراری', errors[1][1][0])
+        self.assertFalse(User.objects.filter(username__in=['ali', 'sara']).exists())
+
+        created, errors = import_users(StringIO(self.CSV), 'csv', skip_invalid=True)
+        self.assertEqual((created, len(errors)), (2, 3))
+        ali = UserProfile.objects.select_related('user').get(user__username='ali')
+        self.assertEqual((ali.user_type, ali.allowed_storage, ali.field), ('Normal', 2 * 1024 ** 3, None))
+        self.assertTrue(ali.user.check_password('Str0ng-pass-123'))
+        sara = UserProfile.objects.get(user__username='sara')
+        self.assertEqual((sara.field, sara.allowed_storage), ('Coding', 50 * 1024 ** 3))
+
+    def test_admin_upload_hashes_without_a_process_pool(self):
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin)
+        users_file = SimpleUploadedFile('users.csv', self.CSV.encode('utf-8'), content_type='text/csv')
+        with mock.patch('uploader.provisioning.ProcessPoolExecutor') as pool:
+            response = self.client.post(reverse('admin_dashboard'), {'import_users': '1', 'users_file': users_file},
+                                        follow=True)
+        pool.assert_not_called()
+        self.assertContains(response, 'هیچ کاربری ساخته نشد')
+        self.assertFalse(User.objects.filter(username='ali').exists())
+
+        lines = self.CSV.splitlines()
+        valid = '\n'.join([lines[0], lines[1], lines[1].replace('ali', 'reza', 1), lines[5]])
+        users_file = SimpleUploadedFile('users.csv', valid.encode('utf-8'), content_type='text/csv')
+        with mock.patch('uploader.provisioning.ProcessPoolExecutor') as pool:
+            response = self.client.post(reverse('admin_dashboard'), {'import_users': '1', 'users_file': users_file},
+                                        follow=True)
+        pool.assert_not_called()
+        self.assertContains(response, '3 کاربر با موفقیت ایجاد شد')
+        self.assertEqual(UserProfile.objects.filter(user__username__in=['ali', 'reza', 'sara']).count(), 3)
+
+    def test_command_hashes_in_a_process_pool(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as handle:
+            handle.write(self.CSV)
+        self.addCleanup(os.remove, handle.name)
+
+        with self.assertRaises(CommandError):
+            call_command('import_users', handle.name, stdout=StringIO(), stderr=StringIO())
+        # پروسه‌ها در تست با thread جایگزین می‌شوند؛ فقط استفاده از pool بررسی می‌شود
+        with mock.patch('uploader.provisioning.ProcessPoolExecutor', side_effect=ThreadPoolExecutor) as pool:
+            call_command('import_users', handle.name, '--skip-invalid', '--workers', '2',
+                         stdout=StringIO(), stderr=StringIO())
+        pool.assert_called_once()
+        self.assertEqual(User.objects.filter(username__in=['ali', 'sara']).count(), 2)
+
+class FieldBundleTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=False)
+        self.manager = User.objects.create_user(username='manager', password='secret')
+        UserProfile.objects.filter(user=self.manager).update(user_type='FieldManager', field='Coding')
+        self.contents = {}
+        for index, (username, region) in enumerate([('ali', 'RaziAbdi'), ('sara', 'MollaSadraMahki'),
+                                                    ('reza', 'RaziAbdi')]):
+            user = User.objects.create_user(username=username, password='secret')
+            UserProfile.objects.filter(user=user).update(region=region)
+            UploadedFile.objects.create(user=user, file_key=f'{username}/report.pdf', field='Coding', size=10)
+            self.contents[f'{region}/{username}/Coding-report.pdf'] = os.urandom(1000 * (index + 1))
+
+    def download(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('field_manager_download_bundle'))
+        self.assertEqual(response.status_code, 200)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_bundle_is_a_valid_zip_with_every_file(self):
+        for name, data in self.contents.items():
+            region, username, _ = name.split('/')
+            self.s3.put(f'{username}/report.pdf', data)
+
+        archive = self.download()
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), sorted(self.contents))
+        for info in archive.infolist():
+            # خروجی seek ندارد، پس اندازه و CRC بعد از داده در data descriptor می‌آید
+            self.assertTrue(info.flag_bits & 0x08)
+            self.assertEqual(archive.read(info), self.contents[info.filename])
+
+    def test_failed_fetches_end_the_stream_with_an_error_report(self):
+        self.s3.put('ali/report.pdf', self.contents['RaziAbdi/ali/Coding-report.pdf'])
+        get_object = self.s3.get_object
+
+        def flaky_get_object(Bucket, Key, **kwargs):
+            if Key == 'reza/report.pdf':
+                raise EndpointConnectionError(endpoint_url='http://s3')
+            return get_object(Bucket, Key, **kwargs)
+
+        with mock.patch.object(self.s3, 'get_object', side_effect=flaky_get_object):
+            archive = self.download()
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['RaziAbdi/ali/Coding-report.pdf', 'errors.txt'])
+        report = archive.read('errors.txt').decode('utf-8')
+        self.assertIn('RaziAbdi/reza/Coding-report.pdf: Could not connect', report)
+        self.assertIn('MollaSadraMahki/sara/Coding-report.pdf', report)
+
+    def test_closing_the_stream_releases_prefetched_bodies(self):
+        bodies = []
+        get_object = self.s3.get_object
+
+        def tracked_get_object(Bucket, Key, **kwargs):
+            response = get_object(Bucket, Key, **kwargs)
+            bodies.append(response['Body'])
+            return response
+
+        for name, data in self.contents.items():
+            self.s3.put(name.split('/')[1] + '/report.pdf', data)
+        files = UploadedFile.objects.select_related('user__userprofile').order_by('id')
+        with mock.patch.object(self.s3, 'get_object', side_effect=tracked_get_object):
+            stream = stream_zip(iter_bundle_entries(files, prefetch=3))
+            next(stream)
+            stream.close()
+        self.assertEqual(len(bodies), 3)
+        self.assertTrue(all(body.closed for body in bodies))
+
+    def test_unknown_sizes_switch_to_zip64(self):
+        chunks = [b'a' * 1000, b'b' * 1000]
+        data = b''.join(stream_zip([('big.bin', (2024, 1, 1, 0, 0, 0), None, chunks),
+                                    ('small.bin', (2024, 1, 1, 0, 0, 0), 3, [b'abc'])]))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('big.bin'), b''.join(chunks))
+        # سرآیند محلی فایل بدون اندازه، فیلد اضافه ZIP64 (شناسه 0x0001) دارد
+        big, small = archive.infolist()
+        local_extra = data[big.header_offset + 30 + len('big.bin'):][:4]
+        self.assertEqual(local_extra[:2], b'\x01\x00')
+        self.assertNotEqual(data[small.header_offset + 30 + len('small.bin'):][:2], b'\x01\x00')
+
+class DeletionOutboxTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = [User.objects.create_user(username=f'student-{i}', password='secret') for i in range(2)]
+
+    def drain(self):
+        out = StringIO()
+        call_command('process_deletions', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_shared_key_is_only_queued_when_unused(self):
+        # لینک بدون رشته نام فایل را کلید می‌کند، پس دو کاربر می‌توانند یک شیء مشترک داشته باشند
+        first, second = [UploadedFile.objects.create(user=user, file_key='report.pdf', field='Coding', size=10)
+                         for user in self.users]
+        delete_files(UploadedFile.objects.filter(id=first.id))
+        self.assertFalse(PendingObjectDeletion.objects.exists())
+        second.delete()
+        self.assertEqual(list(PendingObjectDeletion.objects.values_list('file_key', flat=True)), ['report.pdf'])
+
+    def test_drain_deletes_objects_and_skips_reused_keys(self):
+        for index, user in enumerate(self.users):
+            self.s3.put(f'{index}.pdf', b'data')
+            UploadedFile.objects.create(user=user, file_key=f'{index}.pdf', field='Coding', size=4)
+        delete_files(UploadedFile.objects.all())
+        self.assertEqual(PendingObjectDeletion.objects.count(), 2)
+        # همان کلید پیش از خالی شدن صف دوباره ثبت شده است
+        UploadedFile.objects.create(user=self.users[1], file_key='1.pdf', field='Coding', size=4)
+
+        self.assertIn('Deleted 2 object(s), 0 failed.', self.drain())
+        self.assertEqual(list(self.s3.objects), ['1.pdf'])
+        self.assertFalse(PendingObjectDeletion.objects.exists())
+
+    def test_failed_keys_are_retried_with_backoff(self):
+        for index, user in enumerate(self.users):
+            UploadedFile.objects.create(user=user, file_key=f'{index}.pdf', field='Coding', size=4)
+        delete_files(UploadedFile.objects.all())
+
+        response = {'Errors': [{'Key': '1.pdf', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]}
+        with mock.patch.object(self.s3, 'delete_objects', return_value=response), \
+                self.assertLogs('uploader.management.commands.process_deletions', 'WARNING'):
+            self.assertIn('Deleted 1 object(s), 1 failed.', self.drain())
+        row = PendingObjectDeletion.objects.get()
+        self.assertEqual((row.file_key, row.attempts, row.last_error), ('1.pdf', 1, 'Access Denied'))
+        self.assertGreater(row.next_attempt_at, datetime.now(timezone.utc))
+
+        # ردیف تا سررسید بعدی برداشته نمی‌شود و بعد از آن با موفقیت حذف می‌شود
+        self.assertNotIn('Deleted', self.drain())
+        PendingObjectDeletion.objects.update(next_attempt_at=datetime.now(timezone.utc))
+        self.assertIn('Deleted 1 object(s), 0 failed.', self.drain())
+        self.assertFalse(PendingObjectDeletion.objects.exists())
+
+
+class AdminDeletionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+        self.first = User.objects.create_user(username='first', password='secret')
+        self.second = User.objects.create_user(username='second', password='secret')
+        UserProfile.objects.filter(user=self.first).update(region='RaziAbdi')
+        UserProfile.objects.filter(user=self.second).update(region='MollaSadraMahki')
+        self.files = {
+            (user.username, field): UploadedFile.objects.create(
+                user=user, file_key=f'{user.username}/{field}.pdf', field=field, size=size,
+            )
+            for user, field, size in ((self.first, 'Coding', 10), (self.first, 'Astronomy', 20),
+                                      (self.second, 'Coding', 40), (self.second, 'Astronomy', 80))
+        }
+        self.client.force_login(self.admin)
+
+    def bulk_delete(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('admin_bulk_delete_files'), data)
+
+    def used_storage(self):
+        return dict(UserProfile.objects.filter(user__in=[self.first, self.second])
+                    .values_list('user__username', 'used_storage'))
+
+    def queued(self):
+        return set(PendingObjectDeletion.objects.values_list('file_key', flat=True))
+
+    def test_bulk_delete_requires_a_valid_filter(self):
+        self.assertEqual(self.client.get(reverse('admin_bulk_delete_files')).status_code, 405)
+        for data in ({}, {'file_ids': 'x'}, {'field': 'Unknown'}, {'region': 'Unknown'}):
+            self.assertEqual(self.bulk_delete(data).status_code, 400)
+        self.assertEqual(UploadedFile.objects.count(), 4)
+
+        student = Client()
+        student.force_login(self.first)
+        self.assertEqual(student.post(reverse('admin_bulk_delete_files'), {'field': 'Coding'}).status_code, 302)
+        self.assertEqual(UploadedFile.objects.count(), 4)
+        self.assertFalse(PendingObjectDeletion.objects.exists())
+
+    def test_bulk_delete_by_ids_field_and_region(self):
+        self.assertEqual(self.used_storage(), {'first': 30, 'second': 120})
+        ids = f"{self.files['first', 'Coding'].id},{self.files['second', 'Astronomy'].id}"
+        self.assertEqual(self.bulk_delete({'file_ids': ids}).json(), {'deleted': 2})
+        self.assertEqual(self.used_storage(), {'first': 20, 'second': 40})
+        self.assertEqual(self.queued(), {'first/Coding.pdf', 'second/Astronomy.pdf'})
+
+        # فیلترها با هم ترکیب می‌شوند
+        self.assertEqual(self.bulk_delete({'field': 'Coding', 'region': 'MollaSadraMahki'}).json(), {'deleted': 1})
+        self.assertEqual(self.used_storage(), {'first': 20, 'second': 0})
+        self.assertEqual(self.bulk_delete({'region': 'RaziAbdi'}).json(), {'deleted': 1})
+        self.assertEqual(self.used_storage(), {'first': 0, 'second': 0})
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertEqual(self.queued(), {file.file_key for file in self.files.values()})
+
+    def test_delete_user_queues_all_keys(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin_delete_user', args=[self.first.id]))
+        self.assertRedirects(response, reverse('admin_dashboard'), fetch_redirect_response=False)
+        self.assertFalse(User.objects.filter(id=self.first.id).exists())
+        self.assertFalse(UserProfile.objects.filter(user_id=self.first.id).exists())
+        self.assertFalse(UploadedFile.objects.filter(user_id=self.first.id).exists())
+        self.assertEqual(self.queued(), {'first/Coding.pdf', 'first/Astronomy.pdf'})
+        self.assertEqual(UploadedFile.objects.count(), 2)
+        self.assertEqual(UserProfile.objects.get(user=self.second).used_storage, 120)
+
+        self.client.post(reverse('admin_delete_user', args=[self.admin.id]))
+        self.assertTrue(User.objects.filter(id=self.admin.id).exists())
+
+
+class UsageExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+        self.first = User.objects.create_user(username='first', password='secret')
+        self.second = User.objects.create_user(username='second', password='secret')
+        UserProfile.objects.filter(user=self.second).update(region='RaziAbdi')
+        UploadedFile.objects.create(user=self.second, file_key='b/2.pdf', field='Coding', size=20)
+        UploadedFile.objects.create(user=self.first, file_key='a/1.pdf', field='Astronomy', size=10)
+        UploadedFile.objects.create(user=self.second, file_key='b/3.pdf', field='Astronomy', size=30)
+        self.client.force_login(self.admin)
+
+    def test_csv_has_a_row_per_user_followed_by_their_files(self):
+        response = self.client.get(reverse('admin_export_usage'), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+
+        self.assertEqual(rows[0][:3], ['row_type', 'username', 'region'])
+        self.assertEqual([(row[0], row[1], row[7]) for row in rows[1:]], [
+            ('user', 'admin', ''),
+            ('user', 'first', ''), ('file', 'first', 'a/1.pdf'),
+            ('user', 'second', ''), ('file', 'second', 'b/2.pdf'), ('file', 'second', 'b/3.pdf'),
+        ])
+        self.assertEqual(rows[-1][2:4] + rows[-1][8:9], ['RaziAbdi', 'Astronomy', '30'])
+
+        filtered = self.client.get(reverse('admin_export_usage'), {'format': 'csv', 'region': 'RaziAbdi'})
+        self.assertEqual(b''.join(filtered.streaming_content).decode('utf-8-sig').count('\r\n'), 4)
+
+    def test_xlsx_sheet_is_valid_and_command_writes_same_rows(self):
+        response = self.client.get(reverse('admin_export_usage'), {'format': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('xl/workbook.xml', archive.namelist())
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        self.assertEqual(len(sheet.findall('.//{*}row')), 7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'usage.csv')
+            call_command('export_usage', '--output', output, '--chunk-size', '1', stdout=StringIO())
+            with open(output, encoding='utf-8-sig') as stream:
+                self.assertEqual(len(stream.read().splitlines()), 7)
+
+    def test_formulas_and_control_characters_are_neutralised(self):
+        UploadedFile.objects.create(user=self.first, file_key='=HYPERLINK("http://x")\x01.pdf', field='Coding', size=1)
+        User.objects.filter(id=self.first.id).update(username='@SUM(A1)')
+
+        response = self.client.get(reverse('admin_export_usage'), {'format': 'csv'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+        self.assertIn("'@SUM(A1)", [row[1] for row in rows])
+        self.assertIn('\'=HYPERLINK("http://x")\x01.pdf', [row[7] for row in rows])
+
+        response = self.client.get(reverse('admin_export_usage'), {'format': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        texts = [node.text for node in sheet.findall('.//{*}t')]
+        self.assertIn("'@SUM(A1)", texts)
+        self.assertIn('\'=HYPERLINK("http://x").pdf', texts)
+
+
+class FilesApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student', password='secret')
+        self.other = User.objects.create_user(username='other', password='secret')
+        UserProfile.objects.filter(user=self.other).update(region='RaziAbdi')
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        fields = [code for code, name in UserProfile.FIELD_CHOICES]
+        for owner in (self.user, self.other):
+            for index, field in enumerate(fields[:5]):
+                file = UploadedFile.objects.create(user=owner, file_key=f'{owner.username}/{field}', field=field,
+                                                   size=(index + 1) * 10)
+                # دو فایل با زمان یکسان تا شکستن تساوی با id بررسی شود
+                UploadedFile.objects.filter(id=file.id).update(uploaded_at=start + timedelta(days=index // 2))
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+
+    def pages(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            data = self.client.get(reverse('files_api'), query).json()
+            ids.extend(row['id'] for row in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_keyset_pages_cover_every_file_once_in_order(self):
+        self.client.force_login(self.admin)
+        expected = list(UploadedFile.objects.order_by('-uploaded_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.pages(limit=3), expected)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('files_api'), {'limit': 3, 'fields': 'id,username,region'})
+        sql = [q['sql'] for q in queries if 'uploader_uploadedfile' in q['sql']][0]
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('file_key', sql)
+
+    def test_cursor_is_a_row_value_comparison(self):
+        self.client.force_login(self.admin)
+        expected = self.pages(limit=3)
+        # SQLite خودش row value را می‌فهمد؛ با روشن کردن قابلیت، همان SQL که PostgreSQL می‌گیرد اجرا می‌شود
+        with mock.patch.object(connection.features, 'supports_tuple_lookups', True), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.pages(limit=3), expected)
+        sql = [q['sql'] for q in queries if 'uploader_uploadedfile' in q['sql']][-1]
+        self.assertIn('("uploader_uploadedfile"."uploaded_at", "uploader_uploadedfile"."id") <', sql)
+
+    def test_filters_projection_and_scope(self):
+        self.client.force_login(self.admin)
+        data = self.client.get(reverse('files_api'), {
+            'region': 'RaziAbdi', 'min_size': 20, 'max_size': 40,
+            'uploaded_after': '2025-01-02', 'fields': 'username,size',
+        }).json()
+        self.assertEqual(data['results'], [{'username': 'other', 'size': 40}, {'username': 'other', 'size': 30}])
+
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.pages(limit=2)), 5)
+        self.assertEqual(self.pages(user=self.other.id), [])
+        self.assertEqual(self.client.get(reverse('files_api'), {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('files_api'), {'cursor': 'forged'}).status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    def test_reports_every_endpoint_without_errors(self):
+        results = run_benchmark(requests=3, warmup=1, seed_options={'users': 5, 'regions': 2, 'files_per_user': 2})
+
+        self.assertEqual(set(results['endpoints']), set(ENDPOINTS))
+        for name, row in results['endpoints'].items():
+            self.assertEqual((row['requests'], row['errors']), (3, 0), name)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertEqual(results['dataset']['files'], 10)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+        self.user = User.objects.create_user(username='student', password='secret')
+
+    def test_records_queries_and_render_time_per_view(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('home'))
+        self.client.force_login(self.admin)
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('uploader_request_duration_seconds_count{view="home"} 1', body)
+        self.assertIn('uploader_template_render_seconds_count{view="home"} 1', body)
+        self.assertNotIn('uploader_db_queries_bucket{view="home",le="0"} 1', body)
+
+    def test_s3_calls_are_timed_per_operation(self):
+        client = storage._build_client()
+        stubber = Stubber(client)
+        stubber.add_response('head_object', {'ContentLength': 1})
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            with stubber:
+                client.head_object(Bucket='bucket', Key='key')
+        finally:
+            metrics.current_request.reset(token)
+
+        self.assertEqual(request_metrics.s3_calls, 1)
+        self.assertIn('uploader_s3_operation_seconds_count{operation="HeadObject"} 1', metrics.expose())
+
+    def test_metrics_requires_superuser_or_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+    def test_slow_requests_log_worst_queries(self):
+        self.client.force_login(self.user)
+        with self.settings(SLOW_REQUEST_THRESHOLD=0), self.assertLogs('uploader.slow_requests') as logs:
+            self.client.get(reverse('home'))
+
+        self.assertIn('(home)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ConcurrentMetadataTests(TransactionTestCase):
+    uploads = 24
+
+    def test_simultaneous_inserts_do_not_hit_lock_errors(self):
+        s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clients = []
+        for i in range(self.uploads):
+            user = User.objects.create_user(username=f'student{i}')
+            UserProfile.objects.filter(user=user).update(allowed_storage=1000)
+            client = Client()
+            client.force_login(user)
+            clients.append((client, put_upload(s3, user, 'Coding', 100)))
+        barrier = threading.Barrier(self.uploads)
+
+        def upload(item):
+            client, file_key = item
+            barrier.wait()
+            try:
+                response = client.post(reverse('save_file_metadata'), {'file_key': file_key, 'field': 'Coding'})
+                return response.status_code, response.json()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.uploads) as executor:
+            results = list(executor.map(upload, clients))
+
+        self.assertEqual(results, [(200, {'success': True})] * self.uploads)
+        self.assertEqual(UploadedFile.objects.count(), self.uploads)
+        self.assertEqual(set(UserProfile.objects.values_list('used_storage', flat=True)), {100})
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_sqlite_connections_use_wal(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # فاز و نسخه بخش‌ها در کش و حافظه پروسه می‌مانند، ولی ردیف‌های دیتابیس بعد از تست برمی‌گردند
+        self.addCleanup(invalidate_phase_cache)
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=10 ** 6, region='RaziAbdi')
+        self.manager = User.objects.create_user(username='manager', password='secret')
+        UserProfile.objects.filter(user=self.manager).update(user_type='FieldManager', field='Coding')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, queries
+
+    def test_home_reload_skips_file_query_until_files_change(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedFile.objects.create(user=self.user, file_key='a.pdf', field='Coding', size=10)
+        _, first = self.count_queries(reverse('home'))
+        response, second = self.count_queries(reverse('home'))
+
+        self.assertLess(len(second), len(first))
+        self.assertFalse(any('"uploader_uploadedfile"."file_key"' in query['sql'] for query in second))
+        self.assertContains(response, 'download-btn" data-file-id', count=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedFile.objects.create(user=self.user, file_key='b.pdf', field='Astronomy', size=20)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'download-btn" data-file-id', count=2)
+
+    def test_field_manager_listing_is_invalidated_by_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=False)
+            file = UploadedFile.objects.create(user=self.user, file_key='a.pdf', field='Coding', size=10)
+        self.client.force_login(self.manager)
+        self.client.get(reverse('field_manager_dashboard'))
+        response, queries = self.count_queries(reverse('field_manager_dashboard'))
+
+        # نشست، کاربر و پروفایل (یک بار برای ویو و base.html)؛ فایل‌های خود مدیر از کش می‌آید
+        # و فهرست رشته را خود صفحه از field_manager_dashboard_data می‌گیرد
+        self.assertEqual(len(queries), 3)
+        self.assertContains(response, reverse('field_manager_dashboard_data'))
+        self.assertContains(self.client.get(reverse('field_manager_dashboard_data')), 'student')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_files(UploadedFile.objects.filter(id=file.id))
+        self.assertNotContains(self.client.get(reverse('field_manager_dashboard_data')), 'student')
+
+    def test_admin_listing_is_invalidated_by_profile_change(self):
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin)
+        self.client.get(reverse('admin_dashboard'))
+        self.assertContains(self.client.get(reverse('admin_dashboard')), 'نوع کاربر: مدیر رشته', count=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.get(user=self.user)
+            profile.user_type = 'FieldManager'
+            profile.save()
+        self.assertContains(self.client.get(reverse('admin_dashboard')), 'نوع کاربر: مدیر رشته', count=2)
+
+
+class AdminDashboardPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('uploader.views.ADMIN_DASHBOARD_PAGE_SIZE', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for index in range(8):
+            user = User.objects.create_user(username=f'student-{index}', password='secret')
+            UserProfile.objects.filter(user=user).update(region='RaziAbdi' if index % 2 else 'MollaSadraMahki')
+            for field in UserProfile.FIELD_CHOICES[:index % 3 + 1]:
+                UploadedFile.objects.create(user=user, file_key=f'{index}-{field[0]}.pdf', field=field[0], size=10)
+        self.client.force_login(User.objects.create_superuser(username='admin', password='secret'))
+
+    def get_page(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin_dashboard') + query)
+        return response.context['page'], len(queries)
+
+    def test_keyset_pages_cover_every_user_with_constant_queries(self):
+        # فاز و نسخه بخش‌ها در درخواست اول خوانده و کش می‌شوند
+        self.get_page('?warm=1')
+        usernames, counts, query = [], set(), ''
+        while True:
+            page, count = self.get_page(query)
+            usernames += [data['user'].username for data in page['user_data']]
+            counts.add(count)
+            if not page['next_query']:
+                break
+            query = '?' + page['next_query']
+        self.assertEqual(usernames, [f'student-{i}' for i in range(8)] + ['admin'])
+        # تعداد کوئری‌ها به تعداد کاربران و فایل‌های هر صفحه بستگی ندارد
+        self.assertEqual(len(counts), 1)
+
+        data = next(data for data in page['user_data'] if data['user'].username == 'student-7')
+        self.assertEqual((data['file_count'], data['used_storage']), (2, 20))
+        previous, _ = self.get_page('?' + page['previous_query'])
+        self.assertEqual([data['user'].username for data in previous['user_data']],
+                         ['student-3', 'student-4', 'student-5'])
+
+    def test_filters_apply_before_pagination(self):
+        page, _ = self.get_page('?region=RaziAbdi')
+        self.assertEqual([data['user'].username for data in page['user_data']],
+                         ['student-1', 'student-3', 'student-5'])
+        self.assertIn('region=RaziAbdi', page['next_query'])
+        page, _ = self.get_page('?' + page['next_query'])
+        self.assertEqual([data['user'].username for data in page['user_data']], ['student-7'])
+
+class DownloadUrlCacheTests(TestCase):
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=False)
+        self.owner = User.objects.create_user(username='student', password='secret')
+        self.manager = User.objects.create_user(username='manager', password='secret')
+        UserProfile.objects.filter(user=self.manager).update(user_type='FieldManager', field='Coding')
+        self.file = UploadedFile.objects.create(user=self.owner, file_key='a.pdf', field='Coding', size=10)
+
+    def download(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.get(reverse('download_file', args=[self.file.id]))
+
+    def test_urls_are_cached_per_scope_and_evicted_on_delete(self):
+        first = self.download(self.owner).json()
+        second = self.download(self.owner).json()
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(first['download_url'], second['download_url'])
+        self.assertEqual(self.s3.calls['generate_presigned_url'], 1)
+
+        # لینک مدیر رشته جداگانه کش می‌شود و کاربر دیگر لینکی نمی‌گیرد
+        self.assertFalse(self.download(self.manager).json()['cached'])
+        self.assertEqual(self.s3.calls['generate_presigned_url'], 2)
+        other = User.objects.create_user(username='other', password='secret')
+        self.assertEqual(self.download(other).status_code, 403)
+        self.assertEqual(storage.download_url_hit_rate(), 1 / 3)
+
+        delete_files(UploadedFile.objects.filter(id=self.file.id))
+        self.assertFalse(any(cache.get(storage.DOWNLOAD_URL_CACHE_KEY.format(self.file.id, scope))
+                             for scope in storage.DOWNLOAD_URL_SCOPES))
+
+class FieldManifestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(invalidate_phase_cache)
+        self.addCleanup(cache.clear)
+        self.student = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.student).update(region='RaziAbdi')
+        self.other = User.objects.create_user(username='other', password='secret')
+        UserProfile.objects.filter(user=self.other).update(region='MollaSadraMahki')
+        self.manager = User.objects.create_user(username='manager', password='secret')
+        UserProfile.objects.filter(user=self.manager).update(user_type='FieldManager', field='Coding')
+        self.first = UploadedFile.objects.create(user=self.student, file_key='a.pdf', field='Coding', size=10)
+        self.second = UploadedFile.objects.create(user=self.other, file_key='b.pdf', field='Coding', size=30)
+        UploadedFile.objects.create(user=self.student, file_key='c.pdf', field='Astronomy', size=5)
+
+    def switch_to_phase_two(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=False)
+
+    def test_manifests_are_built_on_phase_switch(self):
+        self.assertFalse(FieldManifest.objects.exists())
+        self.switch_to_phase_two()
+
+        manifest = FieldManifest.objects.get(field='Coding')
+        self.assertEqual((manifest.file_count, manifest.total_size), (2, 40))
+        self.assertEqual([region['code'] for region in manifest.data['regions']], ['RaziAbdi', 'MollaSadraMahki'])
+        self.assertEqual(FieldManifest.objects.get(field='Astronomy').file_count, 1)
+        self.assertEqual(FieldManifest.objects.get(field='Biotechnology').file_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=True)
+        self.assertFalse(FieldManifest.objects.exists())
+
+    def test_saving_the_same_phase_does_not_rebuild(self):
+        with mock.patch('uploader.manifest.build_field_manifests') as build:
+            phase = Phase.objects.create(is_phase_one=True)
+            phase.save()
+            phase.is_phase_one = False
+            phase.save()
+            phase.save()
+            Phase.objects.create(is_phase_one=False)
+        build.assert_called_once_with()
+
+        # ردیف جدید فاز دوم جای ردیف قبلی فاز دوم را می‌گیرد؛ مانیفست‌ها سر جایشان می‌مانند
+        Phase.objects.create(is_phase_one=True)
+        self.switch_to_phase_two()
+        with mock.patch('uploader.manifest.build_field_manifests') as build:
+            Phase.objects.create(is_phase_one=False)
+        build.assert_not_called()
+        self.assertEqual(FieldManifest.objects.get(field='Coding').file_count, 2)
+
+    def test_field_manager_views_read_the_manifest(self):
+        self.switch_to_phase_two()
+        self.client.force_login(self.manager)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('field_manager_dashboard_data'))
+        self.assertFalse(any('"uploader_uploadedfile"' in query['sql'] for query in queries))
+        users = [user['username'] for region in response.json()['regions'] for user in region['users']]
+        self.assertEqual(users, ['student', 'other'])
+
+    def test_delete_updates_manifest_incrementally(self):
+        self.switch_to_phase_two()
+        self.client.force_login(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('field_manager_delete_file', args=[self.second.id]))
+
+        manifest = FieldManifest.objects.get(field='Coding')
+        self.assertEqual((manifest.file_count, manifest.total_size), (1, 10))
+        self.assertEqual([region['code'] for region in manifest.data['regions']], ['RaziAbdi'])
+
+    def test_new_file_in_phase_two_rebuilds_manifest(self):
+        self.switch_to_phase_two()
+        third = User.objects.create_user(username='third', password='secret')
+        UserProfile.objects.filter(user=third).update(region='RaziAbdi')
+        with self.captureOnCommitCallbacks(execute=True):
+            UploadedFile.objects.create(user=third, file_key='d.pdf', field='Coding', size=7)
+
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin)
+        data = self.client.get(reverse('admin_field_manifest', args=['Coding'])).json()
+        self.assertEqual((data['file_count'], data['total_size']), (3, 47))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Phase.objects.create(is_phase_one=True)
+        self.assertEqual(self.client.get(reverse('admin_field_manifest', args=['Coding'])).status_code, 404)
+
+
+class RequestContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=1000)
+        UploadedFile.objects.create(user=self.user, file_key='a.pdf', field='Coding', size=10)
+        self.client.force_login(self.user)
+
+    def test_home_loads_each_piece_of_user_data_once(self):
+        # نشست، کاربر، پروفایل، رشته‌های استفاده‌شده (فرم) و فهرست فایل‌ها
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('home'))
+
+        self.assertNotIn(('Coding', 'کدنویسی'), response.context['form'].fields['field'].choices)
+        self.assertEqual(response.context['used_storage'], 10)
+
+    def test_owner_download_skips_profile_lookup(self):
+        file = UploadedFile.objects.get(user=self.user)
+        with mock.patch('uploader.storage.get_s3_client', return_value=LocalS3Client()):
+            # نشست، کاربر و فایل
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('download_file', args=[file.id]))
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncViewsTests(TestCase):
+    @staticmethod
+    def reload_urls():
+        # انتخاب بین ویوهای sync و async هنگام import فایل urls انجام می‌شود
+        importlib.reload(uploader_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with override_settings(UPLOADER_ASYNC_VIEWS=True):
+            cls.reload_urls()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.reload_urls()
+
+    def setUp(self):
+        self.s3 = LocalS3Client()
+        patcher = mock.patch('uploader.storage.get_s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(invalidate_phase_cache)
+        self.user = User.objects.create_user(username='student', password='secret')
+        UserProfile.objects.filter(user=self.user).update(allowed_storage=1000)
+        self.other = User.objects.create_user(username='other', password='secret')
+        self.client = AsyncClient()
+        self.client.force_login(self.user)
+
+    def test_urls_route_to_async_views(self):
+        self.assertEqual(resolve(reverse('save_file_metadata')).func.__module__, 'uploader.async_views')
+
+    async def test_generate_and_save(self):
+        response = await self.client.post(reverse('generate_upload_url'),
+                                          {'file_name': 'a.pdf', 'field': 'Coding', 'size': '100'})
+        self.assertEqual(response.status_code, 200)
+        file_key = response.json()['file_key']
+        self.assertTrue(file_key.endswith('/a.pdf'))
+        self.s3.put(file_key, b'x' * 100)
+
+        response = await self.client.post(reverse('save_file_metadata'), {'file_key': file_key, 'field': 'Coding'})
+        self.assertEqual(response.json(), {'success': True})
+        profile = await UserProfile.objects.aget(user=self.user)
+        self.assertEqual(profile.used_storage, 100)
+
+        big = await sync_to_async(put_upload)(self.s3, self.user, 'Astronomy', 5000, 'big.pdf')
+        for data in ({'file_key': 'b.pdf', 'field': 'Coding'},
+                     {'file_key': 'b.pdf', 'field': 'Astronomy'},
+                     {'file_key': big, 'field': 'Astronomy'}):
+            response = await self.client.post(reverse('save_file_metadata'), data)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(await UploadedFile.objects.acount(), 1)
+
+    async def test_upload_is_forbidden_in_phase_two(self):
+        await Phase.objects.acreate(is_phase_one=False)
+        await sync_to_async(invalidate_phase_cache)()
+        response = await self.client.post(reverse('generate_upload_url'),
+                                          {'file_name': 'a.pdf', 'field': 'Coding', 'size': '100'})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_download_checks_ownership(self):
+        own = await UploadedFile.objects.acreate(user=self.user, file_key='a.pdf', field='Coding', size=10)
+        theirs = await UploadedFile.objects.acreate(user=self.other, file_key='b.pdf', field='Coding', size=10)
+
+        response = await self.client.get(reverse('download_file', args=[own.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['cached'])
+        response = await self.client.get(reverse('download_file', args=[own.id]))
+        self.assertEqual((response.json()['cached'], response.json()['hit_rate']), (True, 0.5))
+
+        response = await self.client.get(reverse('download_file', args=[theirs.id]))
+        self.assertEqual(response.status_code, 403)
+        response = await self.client.get(reverse('download_file', args=[theirs.id + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_delete_only_own_files(self):
+        own = await UploadedFile.objects.acreate(user=self.user, file_key='a.pdf', field='Coding', size=10)
+        theirs = await UploadedFile.objects.acreate(user=self.other, file_key='b.pdf', field='Coding', size=10)
+
+        response = await self.client.get(reverse('delete_file', args=[theirs.id]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.client.get(reverse('delete_file', args=[own.id]))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+        self.assertEqual([file.id async for file in UploadedFile.objects.all()], [theirs.id])
+        self.assertEqual(await PendingObjectDeletion.objects.filter(file_key='a.pdf').acount(), 1)
+        self.assertEqual((await UserProfile.objects.aget(user=self.user)).used_storage, 0)
+
+    async def test_admin_delete_requires_superuser(self):
+        theirs = await UploadedFile.objects.acreate(user=self.other, file_key='b.pdf', field='Coding', size=10)
+        response = await self.client.get(reverse('admin_delete_file', args=[theirs.id]))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertTrue(await UploadedFile.objects.filter(id=theirs.id).aexists())
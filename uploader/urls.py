@@ -1,19 +1,46 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
-    home, delete_file, admin_dashboard, admin_delete_file, admin_delete_user,
-    download_file, field_manager_dashboard, field_manager_delete_file,
-    generate_upload_url, save_file_metadata
+    home, delete_file, admin_dashboard, admin_export_usage, admin_delete_file, admin_delete_user,
+    admin_bulk_delete_files, admin_field_manifest,
+    download_file, field_manager_dashboard, field_manager_dashboard_data, field_manager_delete_file,
+    field_manager_download_bundle,
+    generate_upload_url, save_file_metadata, create_multipart_upload, presign_upload_parts,
+    list_uploaded_parts, complete_multipart_upload, abort_multipart_upload, batch_upload_urls,
+    batch_save_file_metadata, files_api, s3_events, metrics_view
 )
 
+# در استقرار ASGI ویوهای وابسته به دیتابیس و S3 با نسخه async جایگزین می‌شوند
+if settings.UPLOADER_ASYNC_VIEWS:
+    from .async_views import (
+        delete_file, admin_delete_file, admin_delete_user, download_file, field_manager_delete_file,
+        generate_upload_url, save_file_metadata
+    )
+
 urlpatterns = [
     path('', home, name='home'),
     path('delete/<int:file_id>/', delete_file, name='delete_file'),
     path('admin-dashboard/', admin_dashboard, name='admin_dashboard'),
     path('admin-delete/<int:file_id>/', admin_delete_file, name='admin_delete_file'),
     path('admin-delete-user/<int:user_id>/', admin_delete_user, name='admin_delete_user'),
+    path('admin-export/', admin_export_usage, name='admin_export_usage'),
+    path('admin-manifest/<str:field>/', admin_field_manifest, name='admin_field_manifest'),
+    path('admin-bulk-delete/', admin_bulk_delete_files, name='admin_bulk_delete_files'),
     path('download/<int:file_id>/', download_file, name='download_file'),
     path('field-manager-dashboard/', field_manager_dashboard, name='field_manager_dashboard'),
+    path('field-manager-dashboard/data/', field_manager_dashboard_data, name='field_manager_dashboard_data'),
+    path('field-manager-bundle/', field_manager_download_bundle, name='field_manager_download_bundle'),
     path('field-manager-delete/<int:file_id>/', field_manager_delete_file, name='field_manager_delete_file'),
     path('generate-upload-url/', generate_upload_url, name='generate_upload_url'),
     path('save-file-metadata/', save_file_metadata, name='save_file_metadata'),
+    path('batch/upload-urls/', batch_upload_urls, name='batch_upload_urls'),
+    path('batch/save-file-metadata/', batch_save_file_metadata, name='batch_save_file_metadata'),
+    path('multipart/create/', create_multipart_upload, name='create_multipart_upload'),
+    path('multipart/presign/', presign_upload_parts, name='presign_upload_parts'),
+    path('multipart/parts/', list_uploaded_parts, name='list_uploaded_parts'),
+    path('multipart/complete/', complete_multipart_upload, name='complete_multipart_upload'),
+    path('multipart/abort/', abort_multipart_upload, name='abort_multipart_upload'),
+    path('api/files/', files_api, name='files_api'),
+    path('s3-events/', s3_events, name='s3_events'),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,90 +1,219 @@
+import datetime
+import io
+import json
+import math
 import uuid
 
-from botocore.config import Config
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
-from .models import UploadedFile, UserProfile, Phase
-from .forms import FileUploadForm, CreateUserForm
-from django.db.models import Sum
+from django.conf import settings
+from .models import FieldManifest, PendingObjectDeletion, UploadedFile, UploadToken, UserProfile, Phase
+from .forms import FileUploadForm, CreateUserForm, ImportUsersForm
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Prefetch, Q, Sum
+from django.db.models.fields.tuple_lookups import Tuple, TupleLessThan
+from django.db.models.functions import Coalesce
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core import signing
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
-import boto3
+from django.utils.crypto import constant_time_compare
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import SimpleLazyObject
 from botocore.exceptions import ClientError
-from datetime import datetime
+from . import fragments, metrics, storage
+from .bundle import iter_bundle_entries, stream_zip
+from .deletion import delete_files, delete_user
+from .export import EXPORT_FORMATS, iter_usage_rows
+from .ingest import (
+    consume_upload_tokens, ingest_created_objects, issue_upload_tokens, issued_upload_keys, parse_object_created,
+)
+from .manifest import get_field_manifest
+from .phase import get_current_phase
+from .provisioning import import_users
+from .ratelimit import limiter_stats, rate_limited
+
+
+# آپلود چندبخشی: حداقل اندازه هر بخش در S3 پنج مگابایت و حداکثر تعداد بخش‌ها ۱۰۰۰۰ است
+MULTIPART_MIN_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_PRESIGN_BATCH = 100
+# در آپلود گروهی، فایل‌های کوچک‌تر از این با یک PUT و بزرگ‌ترها به صورت چندبخشی ارسال می‌شوند
+SINGLE_UPLOAD_MAX_SIZE = 64 * 1024 * 1024
+UPLOAD_BATCH_MAX_FILES = len(UserProfile.FIELD_CHOICES)
+
+ADMIN_DASHBOARD_PAGE_SIZE = 50
+FILES_API_DEFAULT_LIMIT = 100
+FILES_API_MAX_LIMIT = 1000
+# فیلدهای قابل انتخاب با fields= و ستون‌هایی که برای هر کدام با only() خوانده می‌شود
+FILES_API_FIELDS = {
+    'id': 'id',
+    'user': 'user_id',
+    'username': 'user__username',
+    'region': 'user__userprofile__region',
+    'field': 'field',
+    'file_key': 'file_key',
+    'size': 'size',
+    'uploaded_at': 'uploaded_at',
+}
+FILES_API_DEFAULT_FIELDS = ('id', 'user', 'field', 'size', 'uploaded_at')
+FIELD_MANAGER_REGIONS_PER_PAGE = 5
+
+
+def _validate_upload(ctx, field, size):
+    # بررسی‌های مشترک قبل از آپلود؛ در صورت خطا JsonResponse برمی‌گرداند
+    profile = ctx.profile
+    if not ctx.is_phase_one:
+        return JsonResponse({'error': 'در فاز دوم، آپلود فایل غیرفعال است. فقط مشاهده و حذف امکان‌پذیر است.'}, status=403)
+    if not (profile.user_type == 'Normal' or profile.user_type == 'FieldManager'):
+        return JsonResponse({'error': 'شما اجازه آپلود ندارید'}, status=403)
+    if field not in dict(UserProfile.FIELD_CHOICES):
+        return JsonResponse({'error': 'رشته نامعتبر است'}, status=400)
+    # اندازه صفر یا منفی از سهمیه کم می‌کند و شرط رزرو فضا را دور می‌زند
+    if size <= 0:
+        return JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
+
+    if profile.used_storage + size > profile.allowed_storage:
+        return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+    if field in ctx.used_fields:
+        return JsonResponse({'error': 'شما قبلاً فایلی در این رشته آپلود کرده‌اید'}, status=400)
+    return None
+
+
+def _parse_upload_batch(request, with_size=True):
+    # بدنه JSON به شکل {"files": [{"field": ..., "size": ..., ...}]}؛ در صورت خطا JsonResponse برمی‌گرداند
+    try:
+        files = json.loads(request.body)['files']
+    except (ValueError, TypeError, KeyError):
+        return None, JsonResponse({'error': 'درخواست نامعتبر است'}, status=400)
+    if not isinstance(files, list) or not 0 < len(files) <= UPLOAD_BATCH_MAX_FILES:
+        return None, JsonResponse({'error': 'تعداد فایل‌ها نامعتبر است'}, status=400)
+
+    items = []
+    for file in files:
+        if not isinstance(file, dict) or not isinstance(file.get('field'), str):
+            return None, JsonResponse({'error': 'رشته نامعتبر است'}, status=400)
+        size = None
+        if with_size:
+            try:
+                size = int(file.get('size'))
+                if size <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                return None, JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
+        items.append({
+            'field': file['field'],
+            'size': size,
+            'file_name': str(file.get('file_name') or ''),
+            'file_type': str(file.get('file_type') or 'application/octet-stream'),
+            'file_key': str(file.get('file_key') or ''),
+        })
+    return items, None
+
+
+def _validate_upload_batch(ctx, items):
+    fields = [item['field'] for item in items]
+    if len(set(fields)) != len(fields):
+        return JsonResponse({'error': 'برای هر رشته فقط یک فایل می‌توانید آپلود کنید'}, status=400)
+    for item in items:
+        error = _validate_upload(ctx, item['field'], item['size'])
+        if error:
+            return error
+    # سهمیه برای مجموع فایل‌ها، نه تک‌تک آن‌ها
+    profile = ctx.profile
+    if profile.used_storage + sum(item['size'] for item in items) > profile.allowed_storage:
+        return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+    return None
+
+
+def _already_recorded(ctx, field, file_key):
+    # وب‌هوک باکت یا درخواست قبلی همین فایل را ثبت کرده است؛ ثبت دوباره بی‌اثر و موفق است
+    return field in ctx.used_fields and UploadedFile.objects.filter(
+        user=ctx.user, field=field, file_key=file_key
+    ).exists()
+
+
+def _uploaded_sizes(ctx, items):
+    # items: (field, file_key)؛ فقط کلیدی ثبت می‌شود که برای همین کاربر و همان رشته صادر شده باشد،
+    # و اندازه از خود S3 (head_object) خوانده می‌شود، نه از درخواست
+    issued = issued_upload_keys(ctx.user, items)
+    if any(item not in issued for item in items):
+        return None, JsonResponse({'error': 'کلید فایل نامعتبر است'}, status=400)
+    try:
+        return storage.object_sizes(file_key for _, file_key in items), None
+    except ClientError:
+        return None, JsonResponse({'error': 'فایل در فضای ذخیره‌سازی پیدا نشد'}, status=400)
 
 
-def get_current_phase():
-    phase = Phase.objects.first()
-    return phase.is_phase_one if phase else True
+def _get_multipart_upload(request, upload_id):
+    # هر upload_id فقط برای کاربری که آن را شروع کرده معتبر است
+    return request.session.get('multipart_uploads', {}).get(upload_id)
 
 
 @login_required
 def home(request):
-    profile = UserProfile.objects.get(user=request.user)
-    is_phase_one = get_current_phase()
+    ctx = request.ctx
     if request.user.is_superuser:
         return redirect('admin_dashboard')
-    elif profile.user_type == 'FieldManager' and not is_phase_one:
+    elif ctx.is_active_field_manager:
         return redirect('field_manager_dashboard')
 
-    used_storage = UploadedFile.objects.filter(user=request.user).aggregate(total=Sum('size'))['total'] or 0
-    allowed_storage = profile.allowed_storage
-    percentage_used = (used_storage / allowed_storage * 100) if allowed_storage > 0 else 0
+    usage = ctx.usage
+    # queryset تنبل است؛ اگر بخش فایل‌ها از کش بیاید اصلاً اجرا نمی‌شود
     files = UploadedFile.objects.filter(user=request.user)
-    form = FileUploadForm(user=request.user)
+    form = FileUploadForm(ctx=ctx)
 
     context = {
         'form': form,
         'files': files,
-        'used_storage': used_storage,
-        'allowed_storage': allowed_storage,
-        'percentage_used': percentage_used,
-        'is_normal_user': profile.user_type == 'Normal' or (profile.user_type == 'FieldManager' and is_phase_one),
+        'fragment_version': fragments.home_version(request.user.id),
+        'fragment_ttl': settings.FRAGMENT_CACHE_TTL,
+        'used_storage': usage['used'],
+        'allowed_storage': usage['allowed'],
+        'percentage_used': usage['percentage'],
+        'is_normal_user': ctx.is_normal_user,
     }
     return render(request, 'home.html', context)
 
 
 @csrf_exempt
 @login_required
+@rate_limited
 def save_file_metadata(request):
     if request.method == 'POST':
         file_key = request.POST.get('file_key')
         field = request.POST.get('field')
-        size = request.POST.get('size')
-        profile = UserProfile.objects.get(user=request.user)
-        is_phase_one = get_current_phase()
-
-        # توی فاز دوم، هیچ‌کس نمی‌تونه آپلود کنه
-        if not is_phase_one:
-            return JsonResponse({'error': 'در فاز دوم، آپلود فایل غیرفعال است. فقط مشاهده و حذف امکان‌پذیر است.'}, status=403)
-
-        # توی فاز اول، فقط Normal و Field Manager می‌تونن آپلود کنن
-        if not (profile.user_type == 'Normal' or profile.user_type == 'FieldManager'):
-            return JsonResponse({'error': 'شما اجازه آپلود ندارید'}, status=403)
-
-        used_storage = UploadedFile.objects.filter(user=request.user).aggregate(total=Sum('size'))['total'] or 0
-        try:
-            size = int(size)
-            if used_storage + size > profile.allowed_storage:
-                return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
-        except ValueError:
-            return JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
 
-        existing_file = UploadedFile.objects.filter(user=request.user, field=field).exists()
-        if existing_file:
-            return JsonResponse({'error': 'شما قبلاً فایلی در این رشته آپلود کرده‌اید'}, status=400)
+        if _already_recorded(request.ctx, field, file_key):
+            return JsonResponse({'success': True})
+        sizes, error = _uploaded_sizes(request.ctx, [(field, file_key)])
+        if error:
+            return error
+        size = sizes[file_key]
+        # فاز، نوع کاربر، سهمیه و تکراری نبودن رشته
+        error = _validate_upload(request.ctx, field, size)
+        if error:
+            return error
 
         try:
-            UploadedFile.objects.create(
+            # بررسی نهایی سهمیه به صورت اتمیک، تا آپلودهای هم‌زمان از سهمیه عبور نکنند
+            file = UploadedFile.objects.create_within_quota(
                 user=request.user,
                 file_key=file_key,
                 field=field,
                 size=size
             )
+            if file is None:
+                return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+            consume_upload_tokens(request.user, [file_key])
             return JsonResponse({'success': True})
+        except IntegrityError:
+            # درخواست هم‌زمان دیگری (یا وب‌هوک باکت) زودتر فایل این رشته را ثبت کرده است (قید یکتای user و field)
+            if UploadedFile.objects.filter(user=request.user, field=field, file_key=file_key).exists():
+                return JsonResponse({'success': True})
+            return JsonResponse({'error': 'شما قبلاً فایلی در این رشته آپلود کرده‌اید'}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Invalid method'}, status=405)
@@ -92,38 +221,29 @@ def save_file_metadata(request):
 
 @csrf_exempt
 @login_required
+@rate_limited
 def generate_upload_url(request):
     if request.method == 'POST':
         file_name = request.POST.get('file_name', f'upload_{uuid.uuid4()}')
         file_type = request.POST.get('file_type', 'application/octet-stream')
-        current_date = datetime.now().strftime('%Y/%m/%d')
         file_key = file_name
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        endpoint_url = settings.AWS_S3_ENDPOINT_URL
-
-        s3_client = boto3.client('s3',
-                          endpoint_url=endpoint_url,
-                          region_name='us-east-1',
-                          config=Config(signature_version='s3v4'),
-                          aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-                          )
+        size = None
 
-        response = s3_client.list_objects_v2(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
-        print(response)
+        # با رشته و اندازه، لینک برای همان رشته صادر می‌شود و کلید توکن دارد؛ فقط چنین کلیدی را وب‌هوک باکت
+        # یا save_file_metadata ثبت می‌کند
+        field = request.POST.get('field')
+        if field:
+            try:
+                size = int(request.POST.get('size'))
+            except (TypeError, ValueError):
+                return JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
+            error = _validate_upload(request.ctx, field, size)
+            if error:
+                return error
+            file_key, = issue_upload_tokens(request.user, [{'field': field, 'size': size, 'file_name': file_name}])
 
         try:
-            print("*********")
-            print(file_name)
-            print("*********")
-            presigned_url = s3_client.generate_presigned_url(
-                'put_object',
-                Params={
-                    'Bucket': "c589428",
-                    'Key': file_key,
-                },
-                ExpiresIn=3600
-            )
+            presigned_url = storage.presigned_upload_url(file_key, content_length=size)
             return JsonResponse({
                 'upload_url': presigned_url,
                 'file_key': file_key,
@@ -133,34 +253,327 @@ def generate_upload_url(request):
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Invalid method'}, status=405)
 
+
+@csrf_exempt
 @login_required
-def delete_file(request, file_id):
-    profile = UserProfile.objects.get(user=request.user)
-    is_phase_one = get_current_phase()
-    if not (profile.user_type == 'Normal' or (profile.user_type == 'FieldManager' and is_phase_one)):
-        return redirect('home')
-    file = get_object_or_404(UploadedFile, id=file_id, user=request.user)
+@rate_limited
+def batch_upload_urls(request):
+    # سهمیه و رشته‌های چند فایل یک‌جا بررسی و لینک آپلود همه در یک پاسخ برگردانده می‌شود
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    items, error = _parse_upload_batch(request)
+    if error:
+        return error
+    error = _validate_upload_batch(request.ctx, items)
+    if error:
+        return error
+
+    # فایل‌های بزرگ‌تر از SINGLE_UPLOAD_MAX_SIZE با create_multipart_upload ارسال می‌شوند و توکن و لینکشان
+    # همان‌جا صادر می‌شود؛ اینجا فقط در بررسی سهمیه مجموع حساب می‌شوند
+    single = [item for item in items if item['size'] <= SINGLE_UPLOAD_MAX_SIZE]
+    file_keys = dict(zip((item['field'] for item in single), issue_upload_tokens(request.user, single)))
+    uploads = []
+    try:
+        for item in items:
+            if item['field'] not in file_keys:
+                uploads.append({'field': item['field'], 'multipart': True})
+                continue
+            uploads.append({
+                'field': item['field'],
+                'file_key': file_keys[item['field']],
+                'upload_url': storage.presigned_upload_url(file_keys[item['field']], content_length=item['size']),
+                'content_type': item['file_type'],
+            })
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'uploads': uploads})
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+def batch_save_file_metadata(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    items, error = _parse_upload_batch(request, with_size=False)
+    if error:
+        return error
+    if not all(item['file_key'] for item in items):
+        return JsonResponse({'error': 'کلید فایل نامعتبر است'}, status=400)
+    items = [item for item in items if not _already_recorded(request.ctx, item['field'], item['file_key'])]
+    if not items:
+        return JsonResponse({'success': True, 'files': []})
+    sizes, error = _uploaded_sizes(request.ctx, [(item['field'], item['file_key']) for item in items])
+    if error:
+        return error
+    for item in items:
+        item['size'] = sizes[item['file_key']]
+    error = _validate_upload_batch(request.ctx, items)
+    if error:
+        return error
+
+    try:
+        # یک رزرو سهمیه و یک INSERT برای همه فایل‌ها؛ اگر یکی رد شود هیچ‌کدام ثبت نمی‌شود
+        files = UploadedFile.objects.bulk_create_within_quota(
+            request.user,
+            [{'file_key': item['file_key'], 'field': item['field'], 'size': item['size']} for item in items],
+        )
+    except IntegrityError:
+        return JsonResponse({'error': 'شما قبلاً فایلی در این رشته آپلود کرده‌اید'}, status=400)
+    if files is None:
+        return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+    consume_upload_tokens(request.user, [file.file_key for file in files])
+    return JsonResponse({'success': True, 'files': [{'id': file.id, 'field': file.field} for file in files]})
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+def create_multipart_upload(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    file_name = request.POST.get('file_name') or f'upload_{uuid.uuid4()}'
+    file_type = request.POST.get('file_type', 'application/octet-stream')
+    field = request.POST.get('field')
+    try:
+        size = int(request.POST.get('size'))
+        if size <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'اندازه فایل نامعتبر است'}, status=400)
+
+    error = _validate_upload(request.ctx, field, size)
+    if error:
+        return error
+
+    # اندازه بخش طوری انتخاب می‌شود که تعداد بخش‌ها از سقف S3 بیشتر نشود
+    mib = 1024 * 1024
+    part_size = max(MULTIPART_MIN_PART_SIZE, math.ceil(size / MULTIPART_MAX_PARTS / mib) * mib)
+    part_count = math.ceil(size / part_size)
+    file_key, = issue_upload_tokens(request.user, [{'field': field, 'size': size, 'file_name': file_name}])
+
+    try:
+        upload_id = storage.create_multipart_upload(file_key, file_type)
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    uploads = request.session.get('multipart_uploads', {})
+    uploads[upload_id] = {
+        'file_key': file_key,
+        'field': field,
+        'size': size,
+        'part_size': part_size,
+        'part_count': part_count,
+    }
+    request.session['multipart_uploads'] = uploads
+
+    return JsonResponse({
+        'upload_id': upload_id,
+        'file_key': file_key,
+        'part_size': part_size,
+        'part_count': part_count,
+    })
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+def presign_upload_parts(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    upload_id = request.POST.get('upload_id')
+    upload = _get_multipart_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({'error': 'آپلود یافت نشد'}, status=404)
+
+    try:
+        part_numbers = [int(n) for n in request.POST.get('part_numbers', '').split(',') if n]
+    except ValueError:
+        return JsonResponse({'error': 'شماره بخش نامعتبر است'}, status=400)
+    if not part_numbers or len(part_numbers) > MULTIPART_PRESIGN_BATCH:
+        return JsonResponse({'error': 'تعداد بخش‌های درخواستی نامعتبر است'}, status=400)
+    if any(n < 1 or n > upload['part_count'] for n in part_numbers):
+        return JsonResponse({'error': 'شماره بخش نامعتبر است'}, status=400)
+
+    try:
+        urls = storage.presigned_part_urls(upload['file_key'], upload_id, part_numbers)
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'urls': urls})
+
+
+@login_required
+def list_uploaded_parts(request):
+    upload_id = request.GET.get('upload_id')
+    upload = _get_multipart_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({'error': 'آپلود یافت نشد'}, status=404)
+
+    try:
+        parts = storage.list_parts(upload['file_key'], upload_id)
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'file_key': upload['file_key'],
+        'part_size': upload['part_size'],
+        'part_count': upload['part_count'],
+        'parts': [{'part_number': p['PartNumber'], 'size': p['Size']} for p in parts],
+    })
+
+
+@csrf_exempt
+@login_required
+@rate_limited
+def complete_multipart_upload(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    upload_id = request.POST.get('upload_id')
+    upload = _get_multipart_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({'error': 'آپلود یافت نشد'}, status=404)
+
+    # فهرست بخش‌ها و ETagها از خود S3 خوانده می‌شود تا کلاینت نیازی به نگه‌داشتن آن‌ها نداشته باشد
+    try:
+        parts = storage.list_parts(upload['file_key'], upload_id)
+        if len(parts) != upload['part_count']:
+            return JsonResponse({'error': 'همه بخش‌های فایل آپلود نشده‌اند'}, status=400)
+        size = storage.complete_multipart_upload(upload['file_key'], upload_id, parts)
+    except ClientError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    uploads = request.session.get('multipart_uploads', {})
+    uploads.pop(upload_id, None)
+    request.session['multipart_uploads'] = uploads
+
+    # وب‌هوک باکت ممکن است شیء را زودتر، با همان بررسی سهمیه، ثبت کرده باشد؛ دیگر نباید دوباره حساب شود
+    if _already_recorded(request.ctx, upload['field'], upload['file_key']):
+        return JsonResponse({'file_key': upload['file_key'], 'field': upload['field'], 'size': size})
+
+    # اندازه واقعی (از head_object) ممکن است از اندازه اعلام‌شده بیشتر باشد؛ شیء بزرگ‌تر از سهمیه ثبت
+    # نمی‌شود، توکنش پاک می‌شود تا وب‌هوک هم آن را ثبت نکند، و خودش در صف حذف قرار می‌گیرد
+    profile = request.ctx.profile
+    if profile.used_storage + size > profile.allowed_storage:
+        with transaction.atomic():
+            UploadToken.objects.filter(user=request.user, file_key=upload['file_key']).delete()
+            PendingObjectDeletion.objects.create(file_key=upload['file_key'])
+        return JsonResponse({'error': 'آپلود از حد مجاز فضای ذخیره‌سازی شما فراتر می‌رود'}, status=400)
+    return JsonResponse({
+        'file_key': upload['file_key'],
+        'field': upload['field'],
+        'size': size,
+    })
+
+
+@csrf_exempt
+@login_required
+def abort_multipart_upload(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    upload_id = request.POST.get('upload_id')
+    upload = _get_multipart_upload(request, upload_id)
+    if upload is None:
+        return JsonResponse({'error': 'آپلود یافت نشد'}, status=404)
 
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL
-    )
     try:
-        s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file.file_key)
+        storage.abort_multipart_upload(upload['file_key'], upload_id)
     except ClientError as e:
-        messages.error(request, f'خطا در حذف فایل از bucket: {str(e)}')
+        return JsonResponse({'error': str(e)}, status=400)
+    UploadToken.objects.filter(user=request.user, file_key=upload['file_key']).delete()
+
+    uploads = request.session.get('multipart_uploads', {})
+    uploads.pop(upload_id, None)
+    request.session['multipart_uploads'] = uploads
+    return JsonResponse({'success': True})
+
 
-    file.delete()
+@login_required
+def delete_file(request, file_id):
+    if not request.ctx.is_normal_user:
+        return redirect('home')
+    file = get_object_or_404(UploadedFile, id=file_id, user=request.user)
+
+    delete_files(UploadedFile.objects.filter(id=file.id))
     messages.success(request, 'فایل با موفقیت حذف شد.')
     return redirect('home')
 
 
+def _admin_filters(request):
+    filters = {}
+    for name, choices in (('region', UserProfile.REGION_CHOICES),
+                          ('user_type', UserProfile.USER_TYPE_CHOICES),
+                          ('field', UserProfile.FIELD_CHOICES)):
+        value = request.GET.get(name)
+        if value in dict(choices):
+            filters[name] = value
+    return filters
+
+
+def _admin_user_page(request, filters):
+    # همه ستون‌های جدول کاربران با یک کوئری annotate شده و یک prefetch ساخته می‌شوند؛
+    # صفحه‌بندی keyset روی id است تا تعداد کوئری‌ها به تعداد کاربران بستگی نداشته باشد
+    profiles = UserProfile.objects.select_related('user').annotate(
+        file_count=Count('user__files'),
+        files_size=Coalesce(Sum('user__files__size'), 0),
+    ).prefetch_related(
+        Prefetch('user__files', queryset=UploadedFile.objects.order_by('id'), to_attr='file_list')
+    )
+    profiles = profiles.filter(**filters)
+
+    try:
+        after = int(request.GET['after']) if 'after' in request.GET else None
+        before = int(request.GET['before']) if 'before' in request.GET else None
+    except ValueError:
+        after = before = None
+
+    size = ADMIN_DASHBOARD_PAGE_SIZE
+    if before is not None:
+        page = list(profiles.filter(id__lt=before).order_by('-id')[:size + 1])
+        has_previous, has_next = len(page) > size, True
+        page = page[:size][::-1]
+    else:
+        if after is not None:
+            profiles = profiles.filter(id__gt=after)
+        page = list(profiles.order_by('id')[:size + 1])
+        has_previous, has_next = after is not None, len(page) > size
+        page = page[:size]
+
+    user_data = [
+        {
+            'profile': profile,
+            'user': profile.user,
+            'used_storage': profile.files_size,
+            'file_count': profile.file_count,
+            'files': profile.user.file_list,
+        }
+        for profile in page
+    ]
+
+    def page_query(key, value):
+        query = request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[key] = value
+        return query.urlencode()
+
+    return {
+        'user_data': user_data,
+        'next_query': page_query('after', page[-1].id) if page and has_next else None,
+        'previous_query': page_query('before', page[0].id) if page and has_previous else None,
+    }
+
+
 @login_required
 @user_passes_test(lambda u: u.is_superuser)
 def admin_dashboard(request):
     phase, created = Phase.objects.get_or_create(id=1, defaults={'is_phase_one': True})
+    form = CreateUserForm()
+    import_form = ImportUsersForm()
 
     if request.method == 'POST':
         if 'phase_select' in request.POST:
@@ -175,56 +588,60 @@ def admin_dashboard(request):
                 user = form.save()
                 messages.success(request, 'کاربر با موفقیت ایجاد شد.')
                 return redirect('admin_dashboard')
-            else:
-                messages.error(request, 'خطا در ایجاد کاربر. لطفاً اطلاعات را بررسی کنید.')
-                user_data = []
-                for profile in UserProfile.objects.select_related('user').all():
-                    if profile.user:
-                        used_storage = UploadedFile.objects.filter(user=profile.user).aggregate(total=Sum('size'))[
-                                           'total'] or 0
-                        files = UploadedFile.objects.filter(user=profile.user)
-                        user_data.append(
-                            {'profile': profile, 'used_storage': used_storage, 'files': files, 'user': profile.user})
-                context = {
-                    'phase': phase,
-                    'user_data': user_data,
-                    'form': form
-                }
-                return render(request, 'admin_dashboard.html', context)
-
-    user_data = []
-    for profile in UserProfile.objects.select_related('user').all():
-        if profile.user:
-            used_storage = UploadedFile.objects.filter(user=profile.user).aggregate(total=Sum('size'))['total'] or 0
-            files = UploadedFile.objects.filter(user=profile.user)
-            user_data.append({'profile': profile, 'used_storage': used_storage, 'files': files, 'user': profile.user})
+            messages.error(request, 'خطا در ایجاد کاربر. لطفاً اطلاعات را بررسی کنید.')
+        elif 'import_users' in request.POST:
+            import_form = ImportUsersForm(request.POST, request.FILES)
+            if import_form.is_valid():
+                users_file = import_form.cleaned_data['users_file']
+                file_format = users_file.name.rsplit('.', 1)[-1].lower()
+                stream = io.TextIOWrapper(users_file.file, encoding='utf-8-sig', newline='')
+                created, errors = import_users(stream, file_format)
+                for line, line_errors in errors:
+                    messages.error(request, f'سطر {line}: ' + ' '.join(line_errors))
+                if errors:
+                    messages.error(request, 'به دلیل خطاهای بالا هیچ کاربری ساخته نشد.')
+                else:
+                    messages.success(request, f'{created} کاربر با موفقیت ایجاد شد.')
+                return redirect('admin_dashboard')
 
+    filters = _admin_filters(request)
     context = {
         'phase': phase,
-        'user_data': user_data,
-        'form': CreateUserForm()
+        'form': form,
+        'import_form': import_form,
+        'filters': filters,
+        # فقط وقتی بخش جدول کاربران در کش نباشد کوئری‌ها اجرا می‌شوند
+        'page': SimpleLazyObject(lambda: _admin_user_page(request, filters)),
+        'page_fragment_version': f'{fragments.admin_version()}:{request.GET.urlencode()}',
+        'fragment_ttl': settings.FRAGMENT_CACHE_TTL,
+        'region_choices': UserProfile.REGION_CHOICES,
+        'user_type_choices': UserProfile.USER_TYPE_CHOICES,
+        'field_choices': UserProfile.FIELD_CHOICES,
+        'rate_limit_stats': limiter_stats(),
+        # خلاصه مانیفست رشته‌ها در فاز دوم (بدون ستون داده)
+        'field_manifests': [] if phase.is_phase_one else FieldManifest.objects.defer('data').order_by('field'),
     }
     return render(request, 'admin_dashboard.html', context)
 
 
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def admin_field_manifest(request, field):
+    if field not in dict(UserProfile.FIELD_CHOICES):
+        return JsonResponse({'error': 'رشته نامعتبر است'}, status=404)
+    if get_current_phase():
+        return JsonResponse({'error': 'مانیفست رشته‌ها با رفتن به فاز دوم ساخته می‌شود'}, status=404)
+    manifest = get_field_manifest(field)
+    return JsonResponse({'field': field, 'built_at': manifest.built_at.isoformat(), **manifest.data})
+
+
 @login_required
 def admin_delete_file(request, file_id):
     if not request.user.is_superuser:
         return redirect('home')
     file = get_object_or_404(UploadedFile, id=file_id)
 
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL
-    )
-    try:
-        s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file.file_key)
-    except ClientError as e:
-        messages.error(request, f'خطا در حذف فایل از bucket: {str(e)}')
-
-    file.delete()
+    delete_files(UploadedFile.objects.filter(id=file.id))
     messages.success(request, 'فایل با موفقیت حذف شد.')
     return redirect('admin_dashboard')
 
@@ -235,109 +652,301 @@ def admin_delete_user(request, user_id):
         return redirect('home')
     user = get_object_or_404(User, id=user_id)
     if not user.is_superuser:
-        files = UploadedFile.objects.filter(user=user)
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            endpoint_url=settings.AWS_S3_ENDPOINT_URL
-        )
-        for file in files:
-            try:
-                s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file.file_key)
-            except ClientError as e:
-                messages.error(request, f'خطا در حذف فایل از bucket: {str(e)}')
-            file.delete()
-        user.delete()
+        delete_user(user)
         messages.success(request, 'کاربر و فایل‌هایش با موفقیت حذف شدند.')
     else:
         messages.error(request, 'نمی‌توان سوپریوزر را حذف کرد.')
     return redirect('admin_dashboard')
 
 
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def admin_export_usage(request):
+    # با همان فیلترهای داشبورد؛ ردیف‌ها هم‌زمان با خواندن از دیتابیس فرستاده می‌شوند
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'قالب خروجی نامعتبر است'}, status=400)
+    stream, content_type = EXPORT_FORMATS[export_format]
+
+    response = StreamingHttpResponse(stream(iter_usage_rows(_admin_filters(request))), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="usage-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"'
+    return response
+
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def admin_bulk_delete_files(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    # انتخاب فایل‌ها با شناسه، رشته یا پژوهشسرا؛ حداقل یکی از این فیلترها الزامی است
+    files = UploadedFile.objects.all()
+    selected = False
+    file_ids = [i for value in request.POST.getlist('file_ids') for i in value.split(',') if i]
+    if file_ids:
+        try:
+            files = files.filter(id__in=[int(i) for i in file_ids])
+        except ValueError:
+            return JsonResponse({'error': 'شناسه فایل نامعتبر است'}, status=400)
+        selected = True
+    field = request.POST.get('field')
+    if field:
+        if field not in dict(UserProfile.FIELD_CHOICES):
+            return JsonResponse({'error': 'رشته نامعتبر است'}, status=400)
+        files = files.filter(field=field)
+        selected = True
+    region = request.POST.get('region')
+    if region:
+        if region not in dict(UserProfile.REGION_CHOICES):
+            return JsonResponse({'error': 'پژوهشسرا نامعتبر است'}, status=400)
+        files = files.filter(user__userprofile__region=region)
+        selected = True
+    if not selected:
+        return JsonResponse({'error': 'حداقل یکی از file_ids، field یا region الزامی است'}, status=400)
+
+    return JsonResponse({'deleted': delete_files(files)})
+
+
 @login_required
 def download_file(request, file_id):
     file_obj = get_object_or_404(UploadedFile, id=file_id)
-    profile = UserProfile.objects.get(user=request.user)
-    is_phase_one = get_current_phase()
+    ctx = request.ctx
 
-    if not (request.user.is_superuser or file_obj.user == request.user or
-            (profile.user_type == 'FieldManager' and not is_phase_one and file_obj.field == profile.field)):
+    # پروفایل و فاز فقط وقتی خوانده می‌شوند که کاربر ادمین یا صاحب فایل نباشد
+    if not (request.user.is_superuser or file_obj.user_id == request.user.id or
+            (ctx.is_active_field_manager and file_obj.field == ctx.profile.field)):
         return JsonResponse({'error': 'شما اجازه دانلود این فایل را ندارید'}, status=403)
 
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL
-    )
+    if request.user.is_superuser:
+        scope = 'admin'
+    elif file_obj.user_id == request.user.id:
+        scope = 'owner'
+    else:
+        scope = 'manager'
+
     try:
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': file_obj.file_key},
-            ExpiresIn=3600
-        )
-        return JsonResponse({'download_url': presigned_url})
+        presigned_url, cached = storage.cached_download_url(file_obj.id, file_obj.file_key, scope)
+        return JsonResponse({
+            'download_url': presigned_url,
+            'cached': cached,
+            'hit_rate': storage.download_url_hit_rate(),
+        })
     except ClientError as e:
         return JsonResponse({'error': str(e)}, status=400)
 
 
+def _field_files(field, regions=None):
+    return UploadedFile.objects.filter(
+        field=field,
+        user__userprofile__region__in=regions if regions is not None else dict(UserProfile.REGION_CHOICES),
+    ).select_related('user__userprofile').order_by('user__username', 'id')
+
+
 @login_required
 def field_manager_dashboard(request):
-    profile = UserProfile.objects.get(user=request.user)
-    is_phase_one = get_current_phase()
-    if profile.user_type != 'FieldManager' or is_phase_one:
+    profile = request.ctx.profile
+    if not request.ctx.is_active_field_manager:
         return redirect('home')
 
-    regions = UserProfile.REGION_CHOICES
-    region_display_names = dict(regions)
-    files_by_region = {}
-    for region_code, region_name in regions:
-        region_users = UserProfile.objects.filter(region=region_code)
-        users_files = []
-        for user_profile in region_users:
-            user_files = UploadedFile.objects.filter(user=user_profile.user, field=profile.field)
-            if user_files.exists():
-                users_files.append({
-                    'user': user_profile.user,
-                    'files': user_files
-                })
-        if users_files:
-            files_by_region[region_code] = {
-                'display_name': region_name,
-                'users_files': users_files
-            }
-
+    # queryset تنبل است و فقط وقتی بخش فایل‌های خود مدیر در کش نباشد اجرا می‌شود؛ فایل‌های رشته را
+    # صفحه با field_manager_dashboard_data از مانیفست رشته و صفحه‌به‌صفحه می‌خواند
     own_files = UploadedFile.objects.filter(user=request.user)
     context = {
-        'files_by_region': files_by_region,
-        'regions': regions,
         'manager_field': dict(UserProfile.FIELD_CHOICES).get(profile.field),
         'own_files': own_files,
+        'fragment_version': fragments.home_version(request.user.id),
+        'fragment_ttl': settings.FRAGMENT_CACHE_TTL,
     }
     return render(request, 'field_manager_dashboard.html', context)
 
 
+@login_required
+def field_manager_dashboard_data(request):
+    profile = request.ctx.profile
+    if not request.ctx.is_active_field_manager:
+        return JsonResponse({'error': 'شما اجازه دسترسی ندارید'}, status=403)
+
+    # مانیفست فقط پژوهشسراهای دارای فایل را به ترتیب REGION_CHOICES دارد
+    regions = get_field_manifest(profile.field).data['regions']
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    size = FIELD_MANAGER_REGIONS_PER_PAGE
+
+    return JsonResponse({
+        'regions': regions[(page - 1) * size:page * size],
+        'page': page,
+        'num_pages': math.ceil(len(regions) / size),
+        'has_next': page * size < len(regions),
+    })
+
+
+@login_required
+def field_manager_download_bundle(request):
+    profile = request.ctx.profile
+    if not request.ctx.is_active_field_manager:
+        return redirect('home')
+
+    region = request.GET.get('region')
+    if region and region not in dict(UserProfile.REGION_CHOICES):
+        return JsonResponse({'error': 'پژوهشسرا نامعتبر است'}, status=400)
+
+    files = _field_files(profile.field, [region] if region else None).order_by(
+        'user__userprofile__region', 'user__username', 'id'
+    ).iterator(chunk_size=500)
+    response = StreamingHttpResponse(stream_zip(iter_bundle_entries(files)), content_type='application/zip')
+    file_name = f'{profile.field}-{region}.zip' if region else f'{profile.field}.zip'
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
+
 @login_required
 def field_manager_delete_file(request, file_id):
-    profile = UserProfile.objects.get(user=request.user)
-    is_phase_one = get_current_phase()
-    if profile.user_type != 'FieldManager' or is_phase_one:
+    profile = request.ctx.profile
+    if not request.ctx.is_active_field_manager:
         return redirect('home')
     file = get_object_or_404(UploadedFile, id=file_id, field=profile.field)
 
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL
-    )
-    try:
-        s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file.file_key)
-    except ClientError as e:
-        messages.error(request, f'خطا در حذف فایل از bucket: {str(e)}')
-
-    file.delete()
+    delete_files(UploadedFile.objects.filter(id=file.id))
     messages.success(request, 'فایل با موفقیت حذف شد.')
     return redirect('field_manager_dashboard')
 
+
+def _files_api_scope(request):
+    # ادمین همه فایل‌ها، مدیر رشته در فاز دوم فایل‌های رشته‌اش و بقیه فقط فایل‌های خودشان
+    if request.user.is_superuser:
+        return UploadedFile.objects.all()
+    if request.ctx.is_active_field_manager:
+        return UploadedFile.objects.filter(Q(field=request.ctx.profile.field) | Q(user=request.user))
+    return UploadedFile.objects.filter(user=request.user)
+
+
+def _parse_api_datetime(value):
+    # تاریخ تنها به ابتدای همان روز تبدیل می‌شود
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(value)
+        parsed = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _files_api_filters(request, files):
+    params = request.GET
+    try:
+        if params.get('user'):
+            files = files.filter(user_id=int(params['user']))
+        if params.get('min_size'):
+            files = files.filter(size__gte=int(params['min_size']))
+        if params.get('max_size'):
+            files = files.filter(size__lte=int(params['max_size']))
+    except ValueError:
+        return None, JsonResponse({'error': 'پارامتر عددی نامعتبر است'}, status=400)
+
+    if params.get('region'):
+        if params['region'] not in dict(UserProfile.REGION_CHOICES):
+            return None, JsonResponse({'error': 'پژوهشسرا نامعتبر است'}, status=400)
+        files = files.filter(user__userprofile__region=params['region'])
+    if params.get('field'):
+        if params['field'] not in dict(UserProfile.FIELD_CHOICES):
+            return None, JsonResponse({'error': 'رشته نامعتبر است'}, status=400)
+        files = files.filter(field=params['field'])
+
+    try:
+        if params.get('uploaded_after'):
+            files = files.filter(uploaded_at__gte=_parse_api_datetime(params['uploaded_after']))
+        if params.get('uploaded_before'):
+            files = files.filter(uploaded_at__lt=_parse_api_datetime(params['uploaded_before']))
+    except ValueError:
+        return None, JsonResponse({'error': 'تاریخ نامعتبر است'}, status=400)
+    return files, None
+
+
+@login_required
+def files_api(request):
+    # فهرست فقط‌خواندنی فایل‌ها، جدیدترین اول؛ صفحه‌بندی keyset روی (uploaded_at, id) و بدون OFFSET،
+    # پس هزینه هر صفحه به شماره صفحه بستگی ندارد
+    files, error = _files_api_filters(request, _files_api_scope(request))
+    if error:
+        return error
+
+    requested = request.GET.get('fields')
+    names = [name for name in requested.split(',') if name] if requested else list(FILES_API_DEFAULT_FIELDS)
+    if not names or any(name not in FILES_API_FIELDS for name in names):
+        return JsonResponse({'error': 'فیلدهای درخواستی نامعتبر است'}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', FILES_API_DEFAULT_LIMIT))
+        if not 1 <= limit <= FILES_API_MAX_LIMIT:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'تعداد نامعتبر است'}, status=400)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            uploaded_at, last_id = signing.loads(cursor, salt='uploader.files_api')
+            uploaded_at = datetime.datetime.fromisoformat(uploaded_at)
+        except (signing.BadSignature, TypeError, ValueError):
+            return JsonResponse({'error': 'cursor نامعتبر است'}, status=400)
+        # مقایسه row value روی (uploaded_at, id)، هم‌راستا با ایندکس؛ Django روی SQLite که از آن پشتیبانی نمی‌کند
+        # همان شرط را به شکل OR معادل می‌نویسد
+        files = files.filter(TupleLessThan(Tuple(F('uploaded_at'), F('id')), (uploaded_at, last_id)))
+
+    # ستون‌های مرتب‌سازی همیشه خوانده می‌شوند تا cursor صفحه بعد ساخته شود
+    columns = {FILES_API_FIELDS[name] for name in names} | {'id', 'uploaded_at'}
+    related = [path.rsplit('__', 1)[0] for path in columns if '__' in path]
+    if related:
+        files = files.select_related(*related)
+    page = list(files.only(*columns).order_by('-uploaded_at', '-id')[:limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = signing.dumps([last.uploaded_at.isoformat(), last.id], salt='uploader.files_api')
+
+    def value(file, name):
+        path = FILES_API_FIELDS[name]
+        obj = file
+        for attribute in path.split('__'):
+            obj = getattr(obj, attribute)
+        return obj.isoformat() if name == 'uploaded_at' else obj
+
+    return JsonResponse({
+        'results': [{name: value(file, name) for name in names} for file in page],
+        'next_cursor': next_cursor,
+    })
+
+
+@csrf_exempt
+def s3_events(request):
+    # وب‌هوک رویدادهای ObjectCreated باکت (MinIO یا S3)؛ فایل با اندازه‌ای که S3 گزارش داده ثبت می‌شود
+    # و درخواست save_file_metadata از مرورگر اختیاری است
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else authorization
+    if not (settings.S3_WEBHOOK_TOKEN and constant_time_compare(token, settings.S3_WEBHOOK_TOKEN)):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+
+    try:
+        objects = parse_object_created(json.loads(request.body))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'error': 'Invalid event payload'}, status=400)
+    return JsonResponse(ingest_created_objects(objects))
+
+
+def metrics_view(request):
+    # برای scrape توسط Prometheus با توکن، یا مشاهده توسط سوپریوزر
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+    if not ((settings.METRICS_TOKEN and constant_time_compare(token, settings.METRICS_TOKEN))
+            or request.user.is_superuser):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')